@@ -5,10 +5,19 @@
 # - Runs PD + wheel-damping controller in ODrive torque mode
 
 import asyncio
+import atexit
 import math
-from datetime import datetime
+import os
 import smbus
 import time as pytime
+from encoder import AS5048Reader, Unwrapper
+from telemetry import Telemetry, FLAG_SATURATED, FLAG_INVALID, FLAG_STALE
+from scheduler import DeadlineScheduler
+import latency
+from latency import StageProfiler, install_dump_handlers
+from gains import load_gains, has_tuned_gains
+from startup import StartupTimer, odrive_ready, stable_rest
+from odrive_can import wheel_feedback
 
 # =========================
 # ====== USER CONFIG ======
@@ -18,6 +27,10 @@ import time as pytime
 ENC_I2C_ADDR = 0x40      # <-- confirm for your sensor
 ENC_REG_RAW  = 0xFE      # <-- register that returns 2 bytes of angle
 ENC_BUS_NUM  = 1         # I2C bus number (RPi usually 1)
+ENC_SAMPLE_HZ = 0        # >0: poll the encoder on its own thread (encoder_sampler.py)
+ENC_FORMAT   = "split"   # byte layout, see encoder.py: "split" (OPTION A), "nibble" (OPTION B), "as5048"
+ENC_BLOCK_READ = True    # one 6-byte read of AGC/diagnostics/magnitude/angle (0xFA..0xFF)
+ENC_MIN_MAGNITUDE = 0    # samples with a weaker field magnitude are flagged invalid
 
 # If your odrive.velocity is in turns/s, set to "turns_s"; else "rad_s"
 VELOCITY_UNITS = "rad_s"   # "rad_s" or "turns_s"
@@ -30,18 +43,75 @@ KT_NM_PER_A  = 0.060       # motor torque constant (Nm/A), only used if TORQUE_U
 
 # Axis / Bus selection
 ODRIVE_BUS_ID = 0          # CAN interface index for pyodrivecan.ODriveCAN(…)
+# "pyodrivecan", or "adapter" for odrive_can.ODriveAdapter: cached feedback
+# with a staleness flag (logged as FLAG_STALE), repeated torque frames not
+# resent, bus load printed at exit
+ODRIVE_DRIVER = "pyodrivecan"
+# While the wheel rate is stale (or not yet received) the law runs with the
+# wheel term off (Kw gated) instead of on an old or zero rate; older than
+# this, e-stop
+WHEEL_STALE_ESTOP_S = 0.1
 GEAR_RATIO    = 1        # motor:pendulum angle ratio, 1.0 if direct
 
 # Limits & safety
 TORQUE_LIMIT_NM = 10.0      # Saturation limit in Nm (or in A if TORQUE_UNITS=="A", after conversion below)
 FALLBACK_ANGLE = 1000      # rad (~31°); estop if exceeded
+# Watchdog outside the control loop (watchdog.py): e-stops when no tick has
+# run for WATCHDOG_TIMEOUT_S (a stalled I2C read, a blocked loop) or, on the
+# tick that sees it, when |θ| > WATCHDOG_ANGLE. "process" keeps working
+# while the loop holds the GIL and sends its estop on its own CAN socket
+# (needs python-can). "thread" cannot meet the deadline for stalls that hold
+# the GIL, and python-smbus's blocking read is one (`python watchdog.py`:
+# gil stalls in thread mode all miss 10 ms); "" = off
+WATCHDOG = "process"
+WATCHDOG_TIMEOUT_S = 0.005
+WATCHDOG_DEADLINE_S = 0.010  # last tick -> estop, reported at exit
+WATCHDOG_ANGLE = 0.55        # rad (~31°)
 RUN_SECONDS = 600.0        # how long to try balancing
 
+# LQR gain schedule over |θ| built by lqr.py; if missing, the PD gains below
+# are used, with their per-tick |θ| creep unless tune_gains.py's are loaded
+GAIN_SCHEDULE_PATH = "gain_schedule.npz"
+
 
 
 # Loop timing
 CONTROL_DT = 0.001  # seconds (≈1 kHz)
 
+# Telemetry: every tick goes to a binary log, the console only gets a summary
+TELEMETRY_PATH = "telemetry.bin"   # read back with telemetry.read_telemetry()
+CONSOLE_HZ = 10                    # console lines per second, 0 = none
+
+# Raw input recording (I2C bytes, ODrive feedback, commands) for replay.py,
+# e.g. "session.rec"; None = off. Grows for as long as the run lasts
+RECORD_PATH = None
+
+# "inline": everything on one event loop. "process": the control loop runs in
+# its own process (rt_process.py), optionally pinned to RT_CPU at SCHED_FIFO
+# RT_PRIORITY, and this process only logs and handles Ctrl-C
+RUN_MODE = "inline"
+RT_CPU = None
+RT_PRIORITY = None
+
+# Online estimate of I_s, b and m·g·l (identify.py) from the running loop,
+# printed at exit. Needs some excitation beyond plain balancing
+IDENTIFY = False
+
+# Control step generated at startup by step_codegen.py ("pd_wheel", "lqr" or
+# "feedback_lin"), with the units and limit above compiled in; fixed gains,
+# so it replaces the schedule and the |θ| creep. "" = the step below
+CODEGEN_STEP = ""
+
+# Latency compensation (predict.py): the law sees theta, theta_dot and the
+# wheel rate propagated from their capture times to when the torque is
+# expected to land (measured send latency), instead of the sampled values.
+# Propagation needs a real rate, and the LPF_ALPHA = 0 difference is always
+# 0, so with this on theta_dot comes from discretize.ModelKalmanFilter
+# (encoder θ + wheel rate, driven by the applied torque). At 1 kHz it costs
+# θ accuracy (`python predict.py`: 0.209 vs 0.170 mrad RMS unpredicted at
+# 0.9 ms latency); it pays off for loops of 5 ms and slower
+PREDICT_LATENCY = False
+
 # =========================
 # ===== IMPLEMENTATION ====
 # =========================
@@ -49,26 +119,44 @@ CONTROL_DT = 0.001  # seconds (≈1 kHz)
 # Global bus instance (avoid recreating per read)
 bus = smbus.SMBus(ENC_BUS_NUM)
 
+def make_encoder():
+    return AS5048Reader(bus, ENC_I2C_ADDR, ENC_FORMAT, block=ENC_BLOCK_READ,
+                        min_magnitude=ENC_MIN_MAGNITUDE, clock=lambda: pytime.monotonic())
+
+enc = make_encoder()
+
 def read_raw_angle_turns():
     """
-    Read raw angle from encoder and return turns in [0, 1).
+    Read raw angle from encoder and return turns (about [0, 1)), or None if the
+    sensor flagged the sample invalid (e.g. magnet-field dropout).
 
-    Adjust this to match your encoder's byte format.
-    Current example follows the user's prior code (8-bit + 6-bit fraction feel).
-    If you actually have a 12-bit sensor, use the commented 12-bit path.
+    The angle byte layout is picked by ENC_FORMAT and decoded by
+    AS5048Reader (encoder.py). The user's prior 8-bit + 6-bit fraction
+    split is "split"; a 12-bit angle across the two bytes is "nibble".
     """
-    data = bus.read_i2c_block_data(ENC_I2C_ADDR, ENC_REG_RAW, 2)
-    hi, lo = data[0], data[1]
-
-    # ---- OPTION A: user's previous split (keep if correct for your sensor) ----
-    turns = (hi / 255.0) + (lo / (64.0 * 255.0))  # ~[0, ~1)
-    turns = turns % 1.0
+    return enc.read()
 
-    # ---- OPTION B: common 12-bit angle across two bytes (uncomment if needed) ----
-    # angle_counts = ((hi << 4) | (lo >> 4)) & 0x0FFF   # 0..4095
-    # turns = angle_counts / 4096.0
+def sample_time():
+    """
+    Capture time of the last encoder sample, on loop.time()'s clock.
+    """
+    return enc.t_sample
 
-    return turns
+def make_watchdog(odrive):
+    """
+    Started (not yet armed) Watchdog for the WATCHDOG settings, or None
+    when it is off. Shared with rt_process.py's control loop.
+    """
+    if not WATCHDOG:
+        return None
+    import functools
+    from watchdog import Watchdog
+    factory = None
+    if WATCHDOG == "process":
+        from odrive_can import estop_sender
+        factory = functools.partial(estop_sender, ODRIVE_BUS_ID)
+    return Watchdog(odrive.estop, WATCHDOG_TIMEOUT_S, WATCHDOG_DEADLINE_S, WATCHDOG_ANGLE,
+                    mode=WATCHDOG, estop_factory=factory, clock=lambda: pytime.monotonic()).start()
 
 def clamp(x, lo, hi):
     return max(lo, min(hi, x))
@@ -105,107 +193,260 @@ async def controller(odrive):
       - compute tau_cmd = -Kp*theta - Kd*theta_dot - Kw*wheel_rate
       - send torque/current to ODrive
     """
-    # Control gains (initial guesses)
+    # Control gains (initial guesses, overridden by tune_gains.py output)
     Kp = -120      # Nm/rad (or A/rad if TORQUE_UNITS=="A")
     Kd = -20       # Nm·s/rad
     Kw = 10     # Nm/(rad/s) wheel-rate damping
+    g = load_gains("pd_wheel", Kp=Kp, Kd=Kd, Kw=Kw)
+    Kp, Kd, Kw = g["Kp"], g["Kd"], g["Kw"]
+    # Tuned gains were optimized as fixed values: no |θ| creep on top
+    creep = not has_tuned_gains("pd_wheel")
+    timer = StartupTimer()
+    schedule = None
+    if os.path.exists(GAIN_SCHEDULE_PATH):     # lqr.py pulls in NumPy, only import it when used
+        try:
+            from lqr import GainSchedule
+            schedule = GainSchedule.load(GAIN_SCHEDULE_PATH)
+            print(f"Using LQR gain schedule from {GAIN_SCHEDULE_PATH}")
+        except (ImportError, OSError):
+            schedule = None
+    step = None
+    if CODEGEN_STEP:
+        from step_codegen import build_step
+        step = build_step(CODEGEN_STEP, g if CODEGEN_STEP == "pd_wheel" else None,
+                          velocity_units=VELOCITY_UNITS, torque_units=TORQUE_UNITS,
+                          kt=KT_NM_PER_A, torque_limit_nm=TORQUE_LIMIT_NM)
+        print(f"Using generated {CODEGEN_STEP} step")
     LPF_ALPHA = 0  # 0..1, low-pass for theta_dot (smaller = more smoothing)
-    
-    await asyncio.sleep(1.0)
+    timer.mark("gains")
+
+    # ODrive feedback flowing (clear_errors/initCanBus done) before the mode switch
+    await odrive_ready(odrive)
     odrive.set_controller_mode("torque_control")
+    timer.mark("odrive ready")
 
-    # Establish zero reference near upright
+    # Establish zero reference near upright, once the pendulum is held still
     print("Hold pendulum near upright to set zero…")
-    await asyncio.sleep(1.0)
-    rest_turns = read_raw_angle_turns()
-    prev_turns = rest_turns
-    wrap_count = 0
+    rest_turns = await stable_rest(read_raw_angle_turns)
+    unwrap = Unwrapper(initial=rest_turns)
+    timer.mark("rest reading")
 
     # Rate estimation state
+    theta = 0.0
     theta_prev = 0.0
     theta_dot = 0.0
 
     # Torque saturation in *drive* units
     torque_limit_drive = to_drive_units(TORQUE_LIMIT_NM)
 
+    telem = Telemetry(TELEMETRY_PATH, console_hz=CONSOLE_HZ, units=TORQUE_UNITS)
+    ident = None
+    if IDENTIFY:
+        from identify import OnlineIdentifier
+        ident = OnlineIdentifier()
+    predictor = None
+    if PREDICT_LATENCY:
+        from predict import LatencyPredictor, FeedbackStamp
+        from discretize import ModelKalmanFilter
+        predictor = LatencyPredictor(wheel_scale=2.0 * math.pi if VELOCITY_UNITS == "turns_s" else 1.0)
+        wheel_stamp = FeedbackStamp()
+        rate_kf = ModelKalmanFilter()
+        t_kf = None
+
     # Timing
     loop = asyncio.get_event_loop()
     t_prev = loop.time()
-    stop_at = pytime.time() + RUN_SECONDS
+    sched = DeadlineScheduler(CONTROL_DT)
 
-    print("Starting control loop.")
-    while pytime.time() < stop_at:
-        # ----- Encoder read + unwrap to continuous turns -----
-        raw_turns = read_raw_angle_turns()
-        dturns = raw_turns - prev_turns
-        if dturns < -0.5:
-            wrap_count += 1
-        elif dturns > 0.5:
-            wrap_count -= 1
-        cont_turns = raw_turns + wrap_count
-        prev_turns = raw_turns
-
-        # Normalize so upright zero = rest_turns
-        norm_turns = cont_turns - rest_turns
-
-        # turns -> radians at the pendulum joint
-        theta = (2.0 * math.pi / GEAR_RATIO) * norm_turns
-
-        # ----- dt -----
-        t_now = loop.time()
-        dt = max(1e-4, t_now - t_prev)
-        t_prev = t_now
-
-        # ----- theta_dot finite-difference + LPF -----
-        raw_theta_dot = (theta - theta_prev) / dt
-        theta_dot = (1.0 - LPF_ALPHA) * theta_dot + LPF_ALPHA * raw_theta_dot
-        theta_prev = theta
-
-        # ----- wheel rate from ODrive -----
-        try:
-            wheel_rate = from_velocity_units(odrive.velocity)  # rad/s
-        except Exception:
-            wheel_rate = 0.0
-
-        # ----- Control law -----
-        Kp = Kp-abs(theta)
-        Kd = Kd-abs(theta)
-        tau_cmd_nm = -(Kp * theta + Kd * theta_dot + Kw * wheel_rate)
-
-        # Saturate (in Nm), then convert to drive units
-        tau_cmd_nm = clamp(tau_cmd_nm, -TORQUE_LIMIT_NM, TORQUE_LIMIT_NM)
-        drive_cmd = to_drive_units(tau_cmd_nm)
-        drive_cmd = clamp(drive_cmd, -torque_limit_drive, torque_limit_drive)
-
-        # Safety: bail if we’re too far from upright
-        if abs(theta) > FALLBACK_ANGLE:
-            print(f"[SAFETY] Fall detected | θ={theta:+.3f} rad > {FALLBACK_ANGLE:.2f} rad. E-stop.")
-            try:
-                odrive.estop()
-            finally:
-                break
+    # Only the CAN adapter has feedback ages and bus stats (printed at exit)
+    feedback = getattr(odrive, "feedback", None)
+    wheel_held = 0.0   # last fresh wheel rate (drive units), logged while stale
 
-        # Send command
-        odrive.set_torque(drive_cmd)
+    wd = make_watchdog(odrive)
 
-        # Telemetry
-        print(
-            f"θ={theta:+.3f} rad | θ̇={theta_dot:+.3f} rad/s | ϕ̇={wheel_rate:+.2f} rad/s | "
-            f"τ={tau_cmd_nm:+.3f} Nm ({drive_cmd:+.3f} {TORQUE_UNITS}) | dt={dt*1e3:.1f} ms"
-        )
+    # Per-stage timing, dumped at exit or on `kill -USR1`
+    prof = StageProfiler(latency.PIPELINE_STAGES)
+    install_dump_handlers(prof)
 
-        # ~1 kHz loop
-        await asyncio.sleep(CONTROL_DT)
+    print(timer.report())
+    print("Starting control loop.")
+    enc.reset_stats()      # bus rates over the loop only, not startup
+    if wd is not None:
+        wd.arm()
+    try:
+        while sched.elapsed < RUN_SECONDS:
+            # ----- Encoder read + unwrap to continuous turns -----
+            ts = prof.begin()
+            raw_turns = read_raw_angle_turns()
+            ts = prof.mark(latency.ENCODER, ts)
+            valid = raw_turns is not None
+            if valid:
+                cont_turns = unwrap.update(raw_turns)
+
+                # Normalize so upright zero = rest_turns
+                norm_turns = cont_turns - rest_turns
+
+                # turns -> radians at the pendulum joint
+                theta = (2.0 * math.pi / GEAR_RATIO) * norm_turns
+            ts = prof.mark(latency.UNWRAP, ts)
+
+            # Heartbeat + angle limit; the watchdog e-stops on its own
+            if wd is not None and wd.beat(theta):
+                print(f"[SAFETY] Watchdog fired | θ={theta:+.3f} rad. E-stopped.")
+                break
+
+            # ----- dt between sample capture times -----
+            # (not loop.time() after the read, which adds I2C and scheduling jitter)
+            t_now = loop.time()
+            t_sample = sample_time()
+            dt = max(1e-4, t_sample - t_prev)
+
+            # ----- theta_dot finite-difference + LPF -----
+            # An invalid sample holds theta and theta_dot; the next valid one
+            # differences across the gap
+            if valid:
+                t_prev = t_sample
+                raw_theta_dot = (theta - theta_prev) / dt
+                theta_dot = (1.0 - LPF_ALPHA) * theta_dot + LPF_ALPHA * raw_theta_dot
+                theta_prev = theta
+            ts = prof.mark(latency.ESTIMATOR, ts)
+
+            # ----- wheel rate from ODrive -----
+            wheel_vel, wheel_age, wheel_stale = wheel_feedback(odrive)
+            if not wheel_stale:
+                wheel_held = float(wheel_vel)
+            elif wheel_age > WHEEL_STALE_ESTOP_S:
+                print(f"[SAFETY] Wheel feedback {wheel_age * 1e3:.0f} ms old > "
+                      f"{WHEEL_STALE_ESTOP_S * 1e3:.0f} ms. E-stop.")
+                try:
+                    odrive.estop()
+                finally:
+                    break
+            # Stale: wheel term gated off, not fed an old rate
+            wheel_raw = 0.0 if wheel_stale else wheel_held
+            ts = prof.mark(latency.VELOCITY, ts)
+
+            # ----- state at the expected actuation time -----
+            if predictor is not None:
+                # Rate from the model filter, driven by the torque last applied
+                if t_kf is not None and t_sample > t_kf:
+                    rate_kf.predict(t_sample - t_kf, predictor.tau)
+                t_kf = t_sample
+                rate_kf.update(theta if valid else None,
+                               None if wheel_stale else from_velocity_units(wheel_raw))
+                theta_dot = rate_kf.theta_dot
+                ctl_theta, ctl_theta_dot, wheel_raw = predictor.predict(
+                    theta, theta_dot, t_sample, wheel_raw, wheel_stamp.update(wheel_raw, t_now), t_now)
+            else:
+                ctl_theta, ctl_theta_dot = theta, theta_dot
+
+            if step is not None:
+                # Generated: law, unit conversions and saturation in one call
+                wheel_rate, tau_cmd_nm, drive_cmd, saturated = step(ctl_theta, ctl_theta_dot, wheel_raw)
+                flags = FLAG_SATURATED if saturated else 0
+            else:
+                wheel_rate = from_velocity_units(wheel_raw)  # rad/s
+
+                # ----- Control law -----
+                if schedule is not None:
+                    Kp, Kd, Kw = schedule.lookup(ctl_theta)
+                elif creep:
+                    Kp = Kp-abs(ctl_theta)
+                    Kd = Kd-abs(ctl_theta)
+                tau_cmd_nm = -(Kp * ctl_theta + Kd * ctl_theta_dot + Kw * wheel_rate)
+
+                # Saturate (in Nm), then convert to drive units
+                flags = FLAG_SATURATED if abs(tau_cmd_nm) > TORQUE_LIMIT_NM else 0
+                tau_cmd_nm = clamp(tau_cmd_nm, -TORQUE_LIMIT_NM, TORQUE_LIMIT_NM)
+                drive_cmd = to_drive_units(tau_cmd_nm)
+                drive_cmd = clamp(drive_cmd, -torque_limit_drive, torque_limit_drive)
+            if not valid:
+                flags |= FLAG_INVALID
+            if wheel_stale:
+                flags |= FLAG_STALE
+                wheel_rate = from_velocity_units(wheel_held)
+            ts = prof.mark(latency.CONTROL, ts)
+
+            # Safety: bail if we’re too far from upright
+            if abs(theta) > FALLBACK_ANGLE:
+                print(f"[SAFETY] Fall detected | θ={theta:+.3f} rad > {FALLBACK_ANGLE:.2f} rad. E-stop.")
+                try:
+                    odrive.estop()
+                finally:
+                    break
+
+            # Send command
+            odrive.set_torque(drive_cmd)
+            if predictor is not None:
+                predictor.actuated(loop.time(), tau_cmd_nm)
+            ts = prof.mark(latency.CAN_SEND, ts)
+
+            # Telemetry
+            telem.log(t_now, theta, theta_dot, wheel_rate, tau_cmd_nm, drive_cmd, dt, flags)
+            if ident is not None:
+                ident.update(t_sample, theta, tau_cmd_nm)
+            prof.mark(latency.TELEMETRY, ts)
+            prof.end_tick()
+
+            # ~1 kHz loop on absolute deadlines
+            await sched.wait_next()
+    finally:
+        if wd is not None:
+            wd.stop()
+
+    telem.close()
+    print(sched.report())
+    b = enc.bus_stats()
+    print(f"[I2C] {b['transactions_s']:.0f} transactions/s | {b['bytes_s'] / 1e3:.1f} kB/s on the wire | "
+          f"{b['invalid']}/{b['samples']} samples invalid | AGC {b['agc']} | magnitude {b['magnitude']}")
+    if predictor is not None:
+        print(predictor.report())
+    if feedback is not None:
+        print(odrive.report())
+    if wd is not None:
+        print(wd.report())
+    if ident is not None:
+        est = ident.estimates()
+        print(f"[ID] I_s={est['I_s']:.5f} kg·m² | b={est['b']:.5f} N·m·s | "
+              f"m·g·l={est['mgl']:.4f} N·m ({ident.samples} samples)")
+    print(f"Telemetry: {telem.records} records -> {TELEMETRY_PATH} ({telem.dropped} dropped)")
+
+# The drive in use, for the Ctrl-C handler
+odrive_handle = None
 
 async def main():
-    import pyodrivecan  # import locally so the file can still be linted without it
-    odrive = pyodrivecan.ODriveCAN(ODRIVE_BUS_ID)
+    global odrive_handle
+    if ODRIVE_DRIVER == "adapter":
+        from odrive_can import ODriveAdapter
+        odrive = ODriveAdapter(ODRIVE_BUS_ID)
+    else:
+        import pyodrivecan  # import locally so the file can still be linted without it
+        odrive = pyodrivecan.ODriveCAN(ODRIVE_BUS_ID)
+    odrive_handle = odrive
+
+    # Optional: record every raw input so the run can be replayed offline
+    if RECORD_PATH:
+        global bus, enc
+        from replay import Recorder, RecordingBus, RecordingODrive
+        recorder = Recorder(RECORD_PATH)
+        atexit.register(recorder.close)
+        bus = RecordingBus(bus, recorder)
+        odrive = RecordingODrive(odrive, recorder)
+        enc = make_encoder()
+
+    # Optional: move blocking I2C reads off the event loop
+    if ENC_SAMPLE_HZ > 0:
+        global read_raw_angle_turns, sample_time
+        from encoder_sampler import EncoderSampler
+        sampler = EncoderSampler(enc, rate_hz=ENC_SAMPLE_HZ).start()
+        sampler.wait_first(1.0)
+        read_raw_angle_turns = sampler.latest_turns
+        sample_time = sampler.latest_time
 
     # Clear errors and init bus
     odrive.clear_errors(identify=False)
     print("Cleared ODrive errors.")
-    await asyncio.sleep(0.2)
-    odrive.initCanBus()
+    odrive.initCanBus()     # controller() waits for feedback before using the drive
 
     # Optional: see if position is available (might not be in torque mode)
     try:
@@ -219,14 +460,31 @@ async def main():
         controller(odrive)
     )
 
-if __name__ == "__main__":
+def run_isolated():
+    from rt_process import RTSupervisor
+    sup = RTSupervisor(cpu=RT_CPU, priority=RT_PRIORITY).start()
+    telem = Telemetry(TELEMETRY_PATH, console_hz=CONSOLE_HZ, units=TORQUE_UNITS)
+    try:
+        sup.run_console(telem)
+    finally:
+        telem.close()
+        print(f"Telemetry: {telem.records} records -> {TELEMETRY_PATH} "
+              f"({sup.lost} lost in shared memory, {sup.misses} deadline misses)")
+        sup.close()
+
+if __name__ == "__main__" and RUN_MODE == "process":
+    run_isolated()
+elif __name__ == "__main__":
     try:
         asyncio.run(main())
     except KeyboardInterrupt:
         print("KeyboardInterrupt: attempting estop…")
         try:
-            # If we can still reach the drive object, stop it
-            import pyodrivecan
-            pyodrivecan.ODriveCAN(ODRIVE_BUS_ID).estop()
+            # The drive object already on the bus, if main() got that far
+            if odrive_handle is not None:
+                odrive_handle.estop()
+            else:
+                import pyodrivecan
+                pyodrivecan.ODriveCAN(ODRIVE_BUS_ID).estop()
         except Exception:
             pass
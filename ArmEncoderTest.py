@@ -1,5 +1,6 @@
 import smbus
 import time
+from encoder import Unwrapper
 
 # Create an SMBus instance
 bus = smbus.SMBus(1)
@@ -10,39 +11,17 @@ AS5048A_ADDR = 0x40
 # AS5048A Register
 AS5048A_ANGLE_REG = 0xFE
 
-class Wrap: # This dumbass sensor has #N_g poles, just use 1:1 gear ratios and comment this out next time 
-    def __init__(self):
-        self.prev_val = None
-        self.turns = 0
-        self.angle = 0.0
-    def update(self,val):
-        if self.prev_val is not None: 
-            diff = val-self.prev_val
-            print(f'{diff}',flush=True)
-            if diff<-0.5: # Forward wrapping
-                self.turns += 1
-            elif diff >0.5: # Backwards jump 
-                self.turns -= 1
-            print(selfturn)
-        self.prev_val = val
-        
-        self.angle = self.turns + val
-
-        
-        return self.angle
 
+# One shared unwrapper, so wraps are counted across reads
+det = Unwrapper() # This dumbass sensor has #N_g poles, just use 1:1 gear ratios and comment this out next time 
 
 # Function to read raw angle from the encoder
 def read_raw_angle():
     data = bus.read_i2c_block_data(AS5048A_ADDR, AS5048A_ANGLE_REG, 2)
-    data = data[0] / 255 + data[1]/64/255
-    data = data
-    return data
+    return data[0] / 255 + data[1] / 16320
     
 def wrapped_raw():
-    det = Wrap()
-    data = det.update(read_raw_angle())
-    return data
+    return det.update(read_raw_angle())
 
 # Function to convert raw angle to degrees
 def Degrees():
@@ -1,11 +1,11 @@
 import pyodrivecan
 import asyncio
 import math
-import numpy as np
 from datetime import datetime, timedelta
 import smbus
-import time
-import os
+from encoder import Unwrapper
+from startup import StartupTimer, odrive_ready, stable_rest
+from gains import load_gains
 # import uvloop # TODO: Implement uvloop for better performance
 
 
@@ -14,9 +14,11 @@ import os
 bus = smbus.SMBus(1)
 def read_raw_angle(): # TODO: Change to async for better performance
     data = bus.read_i2c_block_data(0x40, 0xFE, 2)
-    return data[0] / 255 + data[1]/64/255
+    return data[0] / 255 + data[1] / 16320
 
 ################## ODRIVE ################
+TWO_PI = 2 * math.pi
+TORQUE_LIMIT = 10.0  # Nm, as in the simulated plant
 
 async def controller(odrive):
     await asyncio.sleep(0)
@@ -25,47 +27,37 @@ async def controller(odrive):
     stop_at = datetime.now() + timedelta(seconds=10000)
     
     #### Gains ######
+    # pendulum_sim.pid_wheel_controller's law with K1v..K3v = 0 (tune_gains.py
+    # pid): e in rad, torque in Nm
     K1, K2, K3 = 6,3,4
-    K1v, K2v, K3v = 6,3,4
+    g = load_gains("pid", K1=K1, K2=K2, K3=K3) # tune_gains.py output
+    K1, K2, K3 = g["K1"], g["K2"], g["K3"]
     # #### Initilize #####
     rest_pos = read_raw_angle()
-    val = 0
-    hturns = 0
+    unwrap = Unwrapper(initial=rest_pos)
     odrive.set_torque(10)
-    sum_e = 0
-    err_last = 0
     loop = asyncio.get_running_loop()
-    dt = loop.time()
-    I = 0
-    Iv = 0
+    t_last = loop.time()
+    e_last = 0.0
+    sum_e = 0.0
+    first = True
     while datetime.now() < stop_at:
 		# ### Encoder ######
-        prev_val = val
-        val = read_raw_angle()
-        diff = val - prev_val
-        if diff < -.5:  # This is to wrap the position due to magnetic encoder limits
-            hturns += 1
-        elif diff> 0.5:
-            hturns -= 1
-        position = val + hturns
-        e = position - rest_pos
-        # stuff
-        
+        position = unwrap.update(read_raw_angle()) # wrap the position due to magnetic encoder limits
+        e = TWO_PI * (position - rest_pos)  # turns -> rad
+        now = loop.time()
+        dt = max(now - t_last, 1e-4)
+        t_last = now
+        if first:
+            e_last = e
+            first = False
+
         sum_e += e*dt
-        de = e-err_last
-        dt -= loop.time()
-        err_last = 0
-        ev = odrive.velocity  
-        if ev is None:
-           ev = 0.0
-        I = K2*de/dt + I
-        Iv = K2v*ev/dt + Iv
-      
-        u2 = -(ev*K1v + Iv +K3v*ev/dt)
-        u1 = -(e*K1 + I + K3*de/dt) # TODO: Recheck the equation
-        odrive.set_torque(u1)
-        
-        dt = loop.time()
+        de = (e-e_last)/dt
+        e_last = e
+        u1 = -(K1*e + K2*sum_e + K3*de)
+        odrive.set_torque(max(-TORQUE_LIMIT, min(TORQUE_LIMIT, u1)))
+
         await asyncio.sleep(0)  # yield, but don't delay
 
 
@@ -74,26 +66,30 @@ odrive = pyodrivecan.ODriveCAN(0)
 
 # Run multiple busses.
 async def main():
+    timer = StartupTimer()
     odrive.clear_errors(identify=False)
     print("Cleared Errors")
-    await asyncio.sleep(1)
 
-    #Initalize odrive
+    #Initalize odrive, then wait for its feedback instead of a fixed delay
     odrive.initCanBus()
+    feedback = asyncio.ensure_future(odrive.loop())
+    timer.mark("clear_errors + initCanBus")
+    await odrive_ready(odrive)
+    timer.mark("odrive feedback")
 
-    
     print("Put Arm at bottom center to calibrate Zero Position.")
-    await asyncio.sleep(1)
+    await stable_rest(read_raw_angle)
+    timer.mark("arm at rest")
     cur_pos = odrive.position
-    await asyncio.sleep(1)
     print(f"Encoder Absolute Position Set: {cur_pos}")
 
     #odrive.setAxisState("closed_loop_control")
     odrive.setAxisState("open_loop_control")
+    print(timer.report())
 
     #add each odrive to the async loop so they will run.
     await asyncio.gather(
-        odrive.loop(),
+        feedback,
         controller(odrive) 
     )
 
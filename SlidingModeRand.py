@@ -1,12 +1,12 @@
 
 import pyodrivecan
 import asyncio
-import math
-import numpy as np
-from datetime import datetime, timedelta
 import smbus
-import time
-import os
+from encoder import Unwrapper
+from startup import StartupTimer, odrive_ready, stable_rest
+from scheduler import DeadlineScheduler
+from gains import load_gains
+from excitation import dither
 # import uvloop # TODO: Implement uvloop for better performance
 
 
@@ -15,7 +15,10 @@ import os
 bus = smbus.SMBus(1)
 def read_raw_angle(): # TODO: Change to async for better performance
     data = bus.read_i2c_block_data(0x40, 0xFE, 2)
-    return data[0] / 255 + data[1]/64/255
+    return data[0] / 255 + data[1] / 16320
+
+def sign(x): # np.sign for a float, without importing NumPy
+    return (x > 0) - (x < 0)
 
 ################## ODRIVE ################
 
@@ -23,39 +26,36 @@ async def controller(odrive):
     await asyncio.sleep(0)
     #Run for set time delay example runs for 15 seconds.
     odrive.set_controller_mode("torque_control")
-    stop_at = datetime.now() + timedelta(seconds=10000)
+    run_seconds = 10000
+    loop_dt = 0.001   # 1 kHz, on absolute deadlines
     
     #### Gains ######
-    C = 3
+    C = load_gains("sliding", C=3)["C"] # tune_gains.py output
     n = 3
+    DITHER = dither(level=n, seed=0) # precomputed ±n, one index step per tick
     # #### Initilize #####
     rest_pos = read_raw_angle()
-    val = 0
-    hturns = 0
+    unwrap = Unwrapper(initial=rest_pos)
     odrive.set_torque(10)
     sum_e = 0
     p_last = 0
     loop = asyncio.get_running_loop()
     dt = loop.time()
-    while datetime.now() < stop_at:
+    sched = DeadlineScheduler(loop_dt)
+    while sched.elapsed < run_seconds:
 		# ### Encoder ######
-        prev_val = val
-        val = read_raw_angle()
-        diff = val - prev_val
-        if diff < -.5:  # This is to wrap the position due to magnetic encoder limits
-            hturns += 1
-        elif diff> 0.5:
-            hturns -= 1
-        position = val + hturns
+        position = unwrap.update(read_raw_angle()) # wrap the position due to magnetic encoder limits
         p = position - rest_pos
         dt = loop.time() - dt
         v = (p-p_last)/dt
         # Calculate next wheel input
-        u = 10*np.sign(p+C*v)+n*np.random.choice([-1,1]) # TODO: Recheck the equation
+        u = 10*sign(p+C*v)+DITHER.next() # TODO: Recheck the equation
         odrive.set_torque(u)
         dt = loop.time()
         p_last = p
-        await asyncio.sleep(0)
+        await sched.wait_next()
+
+    print(sched.report())
 
 
 #Set up Node_ID 10 ACTIV NODE ID = 10
@@ -63,26 +63,30 @@ odrive = pyodrivecan.ODriveCAN(0)
 
 # Run multiple busses.
 async def main():
+    timer = StartupTimer()
     odrive.clear_errors(identify=False)
     print("Cleared Errors")
-    await asyncio.sleep(1)
 
-    #Initalize odrive
+    #Initalize odrive, then wait for its feedback instead of a fixed delay
     odrive.initCanBus()
-   
-    
+    feedback = asyncio.ensure_future(odrive.loop())
+    timer.mark("clear_errors + initCanBus")
+    await odrive_ready(odrive)
+    timer.mark("odrive feedback")
+
     print("Put Arm at bottom center to calibrate Zero Position.")
-    await asyncio.sleep(1)
+    await stable_rest(read_raw_angle)
+    timer.mark("arm at rest")
     cur_pos = odrive.position
-    await asyncio.sleep(1)
     print(f"Encoder Absolute Position Set: {cur_pos}")
 
     #odrive.setAxisState("closed_loop_control")
     odrive.setAxisState("open_loop_control")
+    print(timer.report())
 
     #add each odrive to the async loop so they will run.
     await asyncio.gather(
-        odrive.loop(),
+        feedback,
         controller(odrive) 
     )
 
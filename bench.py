@@ -0,0 +1,312 @@
+#!/usr/bin/env python3
+# Controller Benchmark Suite
+# - Runs each controller script's controller(odrive) on sim_hardware's
+#   virtual-clock rig and measures, from the first torque frame on:
+#     cpu_us / cpu_p99_us   CPU time per tick (thread time between torque
+#                           frames, minus the time spent simulating the plant)
+#     alloc_b               transient heap bytes per tick (tracemalloc peak
+#                           above the tick's starting level, own pass)
+#     blocks                net allocated memory blocks per tick (growth)
+#     rate_hz               achieved loop rate on the real clock
+#     jitter_us / jitter_p99_us   std and p99 of |period - median period|,
+#                           real clock
+# - CPU and memory come from virtual-clock runs (deterministic, faster than
+#   real time); rate and jitter from one run of REALTIME_SECONDS on the rig's
+#   real clock, since on the virtual clock every tick lands exactly on its
+#   deadline. The plant is integrated in the same thread in that run
+# - Each script runs in a fresh process (module state, atexit handlers and
+#   the heap do not leak between scripts); CPU is the best of --repeat runs
+# - Outcome of each script: ticks run on the virtual clock, and whether the
+#   virtual or the real-time run e-stopped (a fall or a safety trip). A
+#   controller that stops early runs fewer, cheaper ticks, so its timing
+#   numbers only mean something next to these
+# - Baselines are stored as JSON; --check fails (exit 1) when any metric
+#   regresses past THRESHOLDS or any outcome in OUTCOMES changes at all.
+#   Baselines are per machine, so save one on the machine that checks
+#   against it
+#
+# Usage: python bench.py --save               (write bench_baseline.json)
+#        python bench.py --check              (compare, exit 1 on regression)
+#        python bench.py AIMain new_Main --seconds 10
+
+import gc
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+# =========================
+# ====== USER CONFIG ======
+# =========================
+
+SCRIPTS = ("Main", "Main2", "SlidingModeTest", "SlidingModeRand", "new_Main", "AIMain", "chatgpt")
+BENCH_SECONDS = 5.0          # virtual seconds per run (includes each script's startup)
+REPEAT = 3                   # CPU metrics: best of this many runs
+REALTIME_SECONDS = 3.0       # real seconds of the rate/jitter run (includes startup)
+BASELINE_PATH = "bench_baseline.json"
+
+# metric -> (worse when, allowed relative change, allowed absolute change).
+# A metric regresses only when it is worse by more than both.
+THRESHOLDS = {
+    "cpu_us":        ("higher", 0.25, 2.0),
+    "cpu_p99_us":    ("higher", 0.50, 5.0),
+    "alloc_b":       ("higher", 0.10, 64.0),
+    "blocks":        ("higher", 0.0, 0.1),
+    "rate_hz":       ("lower", 0.01, 0.0),
+    "jitter_us":     ("higher", 0.10, 1.0),
+    "jitter_p99_us": ("higher", 0.10, 1.0),
+}
+# Run outcomes that must match the baseline exactly
+OUTCOMES = ("ticks", "estopped", "real_estopped")
+
+HERE = Path(__file__).resolve().parent
+
+# =========================
+# ===== MEASUREMENT =======
+# =========================
+
+class TickMeter:
+    """
+    Instruments one SimRig: every odrive.set_torque ends a tick. Records
+    per-tick controller CPU time (thread time minus the stand-ins' plant
+    integration),
+    real-time (perf_counter) tick intervals and, with allocations=True, the transient
+    tracemalloc peak of each tick and the allocated block count from the
+    first tick to the last (not after the run, when the controller's
+    locals are already freed).
+    """
+
+    def __init__(self, rig, allocations=False):
+        self.rig = rig
+        self.allocations = allocations
+        self.cpu_ns = array("q")
+        self.intervals = array("d")
+        self.alloc = array("q")
+        self.blocks = (0, 0)
+        self.estopped = False
+        self._plant_ns = 0
+        self._depth = 0
+        self._t_cpu = None
+        self._t_real = None
+        self._base_bytes = 0
+
+        advance, set_torque = rig.advance, rig.odrive.set_torque
+
+        def timed_advance():
+            # Nested calls (set_torque -> release -> advance) count once
+            self._depth += 1
+            t0 = time.thread_time_ns()
+            try:
+                advance()
+            finally:
+                self._depth -= 1
+                if not self._depth:
+                    self._plant_ns += time.thread_time_ns() - t0
+
+        def metered_set_torque(torque):
+            self._depth += 1
+            t0 = time.thread_time_ns()
+            try:
+                set_torque(torque)
+            finally:
+                self._depth -= 1
+                self._plant_ns += time.thread_time_ns() - t0
+            self._tick()
+
+        rig.advance = timed_advance
+        rig.odrive.set_torque = metered_set_torque
+
+    def _tick(self):
+        now = time.thread_time_ns()
+        t_real = time.perf_counter()
+        if self._t_cpu is not None:
+            self.cpu_ns.append(now - self._t_cpu - self._plant_ns)
+            self.intervals.append(t_real - self._t_real)
+        else:
+            self.blocks = (sys.getallocatedblocks(), 0)
+        if self.allocations:
+            self.blocks = (self.blocks[0], sys.getallocatedblocks())
+            current, peak = tracemalloc.get_traced_memory()
+            if self._t_cpu is not None:
+                self.alloc.append(peak - self._base_bytes)
+            self._base_bytes = current
+            tracemalloc.reset_peak()
+        self._plant_ns = 0
+        # Re-read the clock so the meter's own work is not billed to the next tick
+        self._t_cpu = time.thread_time_ns()
+        self._t_real = t_real
+
+def _percentile(sorted_values, p):
+    n = len(sorted_values)
+    return sorted_values[min(n - 1, int(p / 100.0 * n))] if n else 0.0
+
+
+def _run_once(script, seconds, allocations, real_time=False):
+    from sim_hardware import rig_for_script
+
+    gc.collect()        # free earlier runs' modules before counting blocks
+    rig, module = rig_for_script(HERE / f"{script}.py", real_time=real_time)
+    meter = TickMeter(rig, allocations)
+    if allocations:
+        tracemalloc.start()
+    try:
+        rig.run(module.controller, seconds)
+    finally:
+        if allocations:
+            tracemalloc.stop()
+    meter.estopped = rig.odrive.estopped
+    return meter
+
+
+def bench_script(script, seconds=BENCH_SECONDS, repeat=REPEAT, realtime_seconds=REALTIME_SECONDS):
+    """
+    Metrics dict for one script. Runs in the calling process; files the
+    script writes (telemetry logs) go to a temporary directory.
+    """
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        try:
+            runs = [_run_once(script, seconds, False) for _ in range(repeat)]
+            alloc_run = _run_once(script, seconds, True)
+            real_run = _run_once(script, realtime_seconds, False, real_time=True)
+        finally:
+            os.chdir(cwd)
+
+    best = min(runs, key=lambda m: sum(m.cpu_ns) / max(1, len(m.cpu_ns)))
+    ticks = len(best.cpu_ns)
+    outcome = {
+        "ticks": ticks,
+        "estopped": int(any(m.estopped for m in runs)),
+        "real_estopped": int(real_run.estopped),
+    }
+    if not ticks:
+        return outcome
+    cpu = sorted(best.cpu_ns)
+    intervals = real_run.intervals or array("d", [0.0])
+    median = statistics.median(intervals)
+    dev = sorted(abs(x - median) for x in intervals)
+    n_alloc = len(alloc_run.alloc)
+    return {
+        **outcome,
+        "cpu_us": sum(cpu) / ticks / 1e3,
+        "cpu_p99_us": _percentile(cpu, 99) / 1e3,
+        "alloc_b": sum(alloc_run.alloc) / n_alloc if n_alloc else 0.0,
+        "blocks": (alloc_run.blocks[1] - alloc_run.blocks[0]) / max(1, n_alloc),
+        "rate_hz": len(intervals) / sum(intervals) if sum(intervals) > 0 else 0.0,
+        "jitter_us": statistics.pstdev(intervals) * 1e6,
+        "jitter_p99_us": _percentile(dev, 99) * 1e6,
+    }
+
+
+def _bench_worker(args):
+    return bench_script(*args)
+
+
+def run_suite(scripts=SCRIPTS, seconds=BENCH_SECONDS, repeat=REPEAT):
+    """
+    {script: metrics}, each script benchmarked in its own fresh process,
+    one at a time so runs do not compete for the CPU.
+    """
+    results = {}
+    for script in scripts:
+        with ProcessPoolExecutor(1) as pool:
+            results[script] = pool.submit(_bench_worker, (script, seconds, repeat)).result()
+    return results
+
+# =========================
+# ===== BASELINES =========
+# =========================
+
+def save_baseline(results, path=BASELINE_PATH, seconds=BENCH_SECONDS):
+    with open(path, "w") as f:
+        json.dump({"seconds": seconds, "python": sys.version.split()[0], "results": results},
+                  f, indent=2, sort_keys=True)
+
+
+def load_baseline(path=BASELINE_PATH):
+    with open(path) as f:
+        return json.load(f)["results"]
+
+
+def compare(results, baseline, thresholds=THRESHOLDS):
+    """
+    [(script, metric, baseline value, new value)] for every metric that got
+    worse by more than its threshold and every outcome that changed.
+    Scripts or metrics missing from the baseline are not compared.
+    """
+    regressions = []
+    for script, metrics in results.items():
+        base = baseline.get(script)
+        if base is None:
+            continue
+        for metric in OUTCOMES:
+            if metric in base and metric in metrics and base[metric] != metrics[metric]:
+                regressions.append((script, metric, base[metric], metrics[metric]))
+        for metric, (worse, rel, abs_) in thresholds.items():
+            if metric not in base or metric not in metrics:
+                continue
+            old, new = base[metric], metrics[metric]
+            delta = new - old if worse == "higher" else old - new
+            if delta > abs_ and delta > rel * abs(old):
+                regressions.append((script, metric, old, new))
+    return regressions
+
+
+def format_table(results, baseline=None):
+    cols = OUTCOMES + tuple(THRESHOLDS)
+    lines = ["  " + f"{'script':16s}" + "".join(f"{c:>14s}" for c in cols)]
+    for script, metrics in results.items():
+        row = f"  {script:16s}"
+        for c in cols:
+            v = metrics.get(c)
+            cell = "-" if v is None else f"{v:.0f}" if c in OUTCOMES else f"{v:.2f}"
+            if baseline and c in THRESHOLDS and script in baseline and c in baseline[script] and v is not None:
+                old = baseline[script][c]
+                if old:
+                    cell += f" {100.0 * (v - old) / abs(old):+.0f}%"
+            row += f"{cell:>14s}"
+        lines.append(row)
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Benchmark the controller scripts on the simulated rig.")
+    parser.add_argument("scripts", nargs="*", default=list(SCRIPTS), help="script names without .py")
+    parser.add_argument("--seconds", type=float, default=BENCH_SECONDS)
+    parser.add_argument("--repeat", type=int, default=REPEAT)
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--save", action="store_true", help="store the results as the baseline")
+    parser.add_argument("--check", action="store_true", help="exit 1 if any metric regressed")
+    args = parser.parse_args()
+
+    results = run_suite(args.scripts, args.seconds, args.repeat)
+    baseline = None
+    if not args.save and Path(args.baseline).exists():
+        baseline = load_baseline(args.baseline)
+    print(f"[BENCH] {args.seconds:.0f} s virtual per run, CPU best of {args.repeat}, "
+          f"rate/jitter over {REALTIME_SECONDS:.0f} s real"
+          + (f", vs {args.baseline}" if baseline else ""))
+    print(format_table(results, baseline))
+
+    if args.save:
+        save_baseline(results, args.baseline, args.seconds)
+        print(f"[BENCH] baseline -> {args.baseline}")
+    elif args.check:
+        if baseline is None:
+            sys.exit(f"[BENCH] no baseline at {args.baseline}; run with --save first")
+        regressions = compare(results, baseline)
+        for script, metric, old, new in regressions:
+            fmt = ".0f" if metric in OUTCOMES else ".2f"
+            print(f"[REGRESSION] {script}.{metric}: {old:{fmt}} -> {new:{fmt}}")
+        if regressions:
+            sys.exit(1)
+        print("[BENCH] no regressions")
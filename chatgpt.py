@@ -2,7 +2,10 @@ import pyodrivecan
 import asyncio
 import math
 import smbus
+from encoder import Unwrapper
+from startup import StartupTimer, odrive_ready, stable_rest
 from datetime import datetime, timedelta
+from telemetry import Telemetry, FLAG_SATURATED
 
 ############################
 # USER PHYSICAL CONSTANTS
@@ -35,6 +38,9 @@ K_AMPS = MAX_AMPS / (math.pi/3)           # reacts strongly within ±60°
 
 LOOP_DT = 0.001  # 1 ms loop
 
+TELEMETRY_PATH = "telemetry_chatgpt.bin"
+CONSOLE_HZ = 10   # console lines per second, 0 = none
+
 ############################
 # ENCODER SETUP
 ############################
@@ -43,7 +49,7 @@ bus = smbus.SMBus(1)
 
 def read_raw_angle():
     data = bus.read_i2c_block_data(0x40, 0xFE, 2)
-    return data[0] / 255 + data[1] / 64 / 255
+    return data[0] / 255 + data[1] / 16320
 
 def normalize(pos, rest):
     return pos - rest
@@ -53,32 +59,31 @@ def normalize(pos, rest):
 ############################
 
 async def controller(odrive):
-    await asyncio.sleep(1)
+    timer = StartupTimer()
+    await odrive_ready(odrive)
+    timer.mark("odrive feedback")
 
     print("[INFO] Switching to TORQUE_CONTROL (raw amps mode)")
     odrive.set_controller_mode("torque_control")
-    await asyncio.sleep(0.3)
 
-    rest_pos = read_raw_angle()
-    prev_val = rest_pos
-    hturns = 0
+    rest_pos = await stable_rest(read_raw_angle)
+    timer.mark("rest reading")
+    unwrap = Unwrapper(initial=rest_pos)
 
     stop_at = datetime.now() + timedelta(hours=1)
 
+    telem = Telemetry(TELEMETRY_PATH, console_hz=CONSOLE_HZ, units="A")
+    loop = asyncio.get_running_loop()
+    t_prev = loop.time()
+
     print(f"[INFO] Using MAX_AMPS={MAX_AMPS:.1f}, K_AMPS={K_AMPS:.2f}")
     print("[INFO] Remember: firmware current limit must be raised via odrivetool!")
     print()
+    print(timer.report())
 
     while datetime.now() < stop_at:
         # --- Encoder unwrap ---
-        raw = read_raw_angle()
-        diff = raw - prev_val
-        prev_val = raw
-
-        if diff < -0.5:   hturns += 1
-        elif diff > 0.5:  hturns -= 1
-
-        position = normalize(raw + hturns, rest_pos)
+        position = normalize(unwrap.update(read_raw_angle()), rest_pos)
         angle_rad = position * math.pi
 
         # ----- RAW CURRENT REQUEST -----
@@ -97,10 +102,10 @@ async def controller(odrive):
         odrive.set_torque(amps_cmd)
 
         # ---- DIAGNOSTICS ----
-        if sat:
-            print(f"[SAT] angle={angle_rad:.3f} rad | amps={amps_cmd:.2f}A | LIMIT HIT!")
-        else:
-            print(f"angle={angle_rad:.3f} rad | amps={amps_cmd:.2f}A")
+        t_now = loop.time()
+        telem.log(t_now, angle_rad, math.nan, math.nan, amps_cmd * Kt, amps_cmd,
+                  t_now - t_prev, FLAG_SATURATED if sat else 0)
+        t_prev = t_now
 
         await asyncio.sleep(LOOP_DT)
 
@@ -113,11 +118,10 @@ async def main():
     odrive = pyodrivecan.ODriveCAN(0)
 
     odrive.clear_errors(identify=False)
-    await asyncio.sleep(1)
     odrive.initCanBus()
 
+    # controller() waits for ODrive feedback and a still pendulum
     print("[INFO] Put pendulum straight down to record zero.")
-    await asyncio.sleep(2)
 
     await asyncio.gather(
         odrive.loop(),
@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+# Cached Exact Discretization of the Pendulum Model
+# - Zero-order-hold (Ad, Bd) and process noise Qd (Van Loan) of lqr.py's
+#   linear model x = [theta, theta_dot, wheel_rate], u = torque in Nm, for
+#   any loop period, from one matrix exponential each
+# - Memoized in a bounded LRU cache keyed by (parameters, linearization
+#   angle, noise density, dt quantized to DT_QUANTUM), so a loop passing its
+#   measured dt every tick pays the expm only once per distinct period
+# - ModelKalmanFilter: on-line estimator built on it, measuring theta
+#   (encoder) and wheel rate (ODrive), driven by the commanded torque
+#
+# Usage: python discretize.py   (accuracy check against the simulator + timing)
+
+from functools import lru_cache
+
+import numpy as np
+
+from lqr import c2d, expm, linear_model
+from pendulum_sim import PendulumParams
+
+# =========================
+# ====== USER CONFIG ======
+# =========================
+
+DT_QUANTUM = 1e-6          # s, measured periods are rounded to this
+CACHE_SIZE = 4096          # distinct (params, theta0, qc, dt) entries kept
+
+# Continuous process-noise density on (theta, theta_dot, wheel_rate):
+# unmodelled angular accelerations, (rad/s^2)^2 per Hz
+QC_DIAG = (0.0, 50.0, 200.0)
+
+# =========================
+# ===== DISCRETIZATION ====
+# =========================
+
+def van_loan_qd(A, Qc, dt):
+    """
+    Discrete process noise  Qd = int_0^dt e^(A s) Qc e^(A' s) ds.
+    """
+    n = A.shape[0]
+    M = np.zeros((2 * n, 2 * n))
+    M[:n, :n] = -A
+    M[:n, n:] = Qc
+    M[n:, n:] = A.T
+    E = expm(M * dt)
+    Ad_T = E[n:, n:]
+    Qd = Ad_T.T @ E[:n, n:]
+    return 0.5 * (Qd + Qd.T)
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def _discretize(params, theta0, qc, ticks, quantum):
+    dt = ticks * quantum
+    A, B = linear_model(params, theta0)
+    Ad, Bd = c2d(A, B, dt)
+    Qd = van_loan_qd(A, np.diag(qc), dt)
+    for M in (Ad, Bd, Qd):
+        M.setflags(write=False)    # shared by every caller
+    return Ad, Bd, Qd
+
+
+def discretize(dt, params=PendulumParams(), theta0=0.0, qc=QC_DIAG, quantum=DT_QUANTUM):
+    """
+    (Ad, Bd, Qd) for a loop period dt, from the cache when dt rounds to a
+    period seen before. The arrays are read-only.
+    """
+    return _discretize(params, theta0, tuple(qc), int(round(dt / quantum)), quantum)
+
+
+class DiscreteModel:
+    """
+    Per-loop handle for one (params, theta0, qc): at(dt) looks the period up
+    in a local dict keyed by the quantized dt, falling back to the shared
+    cache, so the per-tick cost is one round() and one int hash.
+    """
+    __slots__ = ("params", "theta0", "qc", "inv_quantum", "_local")
+
+    def __init__(self, params=PendulumParams(), theta0=0.0, qc=QC_DIAG):
+        self.params = params
+        self.theta0 = theta0
+        self.qc = tuple(qc)
+        self.inv_quantum = 1.0 / DT_QUANTUM
+        self._local = {}
+
+    def at(self, dt):
+        ticks = int(round(dt * self.inv_quantum))
+        mats = self._local.get(ticks)
+        if mats is None:
+            if len(self._local) >= CACHE_SIZE:
+                self._local.clear()
+            mats = self._local[ticks] = _discretize(self.params, self.theta0, self.qc,
+                                                    ticks, DT_QUANTUM)
+        return mats
+
+
+def cache_info():
+    return _discretize.cache_info()
+
+
+def cache_clear():
+    _discretize.cache_clear()
+
+
+# =========================
+# ===== ESTIMATOR =========
+# =========================
+
+class ModelKalmanFilter:
+    """
+    Kalman filter on the physical model: state (theta, theta_dot,
+    wheel_rate), input = applied torque (Nm), measurements theta and/or
+    wheel_rate. predict(dt, tau) uses the cached exact discretization for
+    the measured dt; either measurement may be None (e.g. an invalid
+    encoder sample) and is then skipped.
+    """
+
+    def __init__(self, params=PendulumParams(), r_theta=5e-5, r_wheel=1e-2,
+                 qc=QC_DIAG, theta0=0.0):
+        self.model = DiscreteModel(params, qc=qc)
+        self.x = np.array([theta0, 0.0, 0.0])
+        self.P = np.eye(3)
+        self.r = (r_theta, r_wheel)
+
+    @property
+    def theta(self):
+        return float(self.x[0])
+
+    @property
+    def theta_dot(self):
+        return float(self.x[1])
+
+    @property
+    def wheel_rate(self):
+        return float(self.x[2])
+
+    def predict(self, dt, tau=0.0):
+        Ad, Bd, Qd = self.model.at(dt)
+        self.x = Ad @ self.x + Bd[:, 0] * tau
+        self.P = Ad @ self.P @ Ad.T + Qd
+
+    def _update_scalar(self, i, z, r):
+        # Sequential scalar updates: no matrix inverse per tick
+        P = self.P
+        s = P[i, i] + r
+        k = P[:, i] / s
+        self.x = self.x + k * (z - self.x[i])
+        self.P = P - np.outer(k, P[i, :])
+
+    def update(self, theta=None, wheel_rate=None):
+        if theta is not None:
+            self._update_scalar(0, theta, self.r[0])
+        if wheel_rate is not None:
+            self._update_scalar(2, wheel_rate, self.r[1])
+
+
+if __name__ == "__main__":
+    import time
+
+    import pendulum_sim as sim
+
+    params = PendulumParams()
+
+    # Accuracy: one discrete step vs the nonlinear RK4 simulator near upright
+    x0 = np.array([1e-3, -2e-3, 5.0])
+    tau = 0.05
+    for dt in (0.001, 0.0025, 0.01):
+        Ad, Bd, _ = discretize(dt, params)
+        x_lin = Ad @ x0 + Bd[:, 0] * tau
+        x4 = np.array([[x0[0], x0[1], 0.0, x0[2]]])
+        for _ in range(100):
+            x4 = sim.rk4_step(x4, np.array([tau]), dt / 100, params)
+        x_sim = x4[0, [sim.THETA, sim.THETA_DOT, sim.WHEEL_VEL]]
+        err = np.max(np.abs(x_lin - x_sim) / np.maximum(np.abs(x_sim), 1e-9))
+        print(f"dt={dt * 1e3:5.2f} ms: max relative error vs simulator {err:.1e}")
+
+    # Cost: cold expm vs cached lookup at a jittery measured dt
+    rng = np.random.default_rng(0)
+    dts = 0.001 + rng.integers(-50, 51, 20000) * 1e-6
+    cache_clear()
+    t0 = time.perf_counter()
+    for dt in dts:
+        discretize(dt, params)
+    first = time.perf_counter() - t0
+    info = cache_info()
+    t0 = time.perf_counter()
+    for dt in dts:
+        discretize(dt, params)
+    warm = time.perf_counter() - t0
+    model = DiscreteModel(params)
+    t0 = time.perf_counter()
+    for dt in dts:
+        model.at(dt)
+    local = time.perf_counter() - t0
+    print(f"{len(dts)} lookups over {info.currsize} distinct periods: "
+          f"first pass {first / len(dts) * 1e6:.1f} us/call ({info.misses} expm), "
+          f"cached {warm / len(dts) * 1e6:.2f} us/call, DiscreteModel.at {local / len(dts) * 1e6:.2f} us/call")
+
+    # Estimator on a simulated balance run with the continuous LQR
+    from lqr import pendulum_gains
+    K = pendulum_gains(params, dt=0.001)
+    plant = sim.Plant(params, theta0=0.05)
+    kf = ModelKalmanFilter(params, theta0=0.05)
+    step = 2 * np.pi / (255 * 64)           # "split" encoder resolution
+    errs = []
+    t, u = 0.0, 0.0
+    t0 = time.perf_counter()
+    for k in range(3000):
+        dt = 0.001 + rng.integers(-50, 51) * 1e-6
+        t += dt
+        plant.set_torque(t, u)
+        kf.predict(dt, plant.tau)
+        z = round(plant.theta / step) * step
+        kf.update(z, plant.wheel_vel)
+        errs.append(kf.theta_dot - plant.theta_dot)
+        u = -(K[0] * kf.theta + K[1] * kf.theta_dot + K[2] * kf.wheel_rate)
+    per_tick = (time.perf_counter() - t0) / 3000
+    print(f"ModelKalmanFilter: theta_dot RMS error {np.sqrt(np.mean(np.square(errs))):.3f} rad/s, "
+          f"final theta {plant.theta:+.4f} rad, {per_tick * 1e6:.0f} us/tick incl. plant")
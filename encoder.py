@@ -0,0 +1,309 @@
+#!/usr/bin/env python3
+# Shared AS5048 Encoder Decode + Unwrap
+# - "split" decodes with two float ops inline (hi / 255 + lo / 16320); the
+#   bit-packed formats go through a 65,536-entry table indexed by the raw
+#   2-byte read (hi << 8) | lo, built on first use. A table lookup only
+#   beats the arithmetic when that has shifts and masks to do
+# - Unwrapper: continuous turns from the wrapped reading with a configurable
+#   hysteresis threshold, replacing the copies in every script
+# - AS5048Reader: angle plus AGC, diagnostics and magnitude in one 6-byte
+#   block read (registers 0xFA..0xFF are contiguous), invalid-sample flags
+#   and bus transaction/byte rates, and the capture time of each sample
+#
+# Formats (what each script decodes today):
+#   "split"   hi/255 + lo/64/255, up to ~1.004 Main.py, chatgpt.py, AIMain OPTION A
+#   "12bit"   ((hi << 6) | (lo >> 2)) & 0xFFF  new_Main.py
+#   "nibble"  ((hi << 4) | (lo >> 4)) & 0xFFF  AIMain OPTION B
+#   "as5048"  (hi << 6) | (lo & 0x3F), 14 bit  datasheet layout of 0xFE/0xFF
+#
+# Usage:
+#     data = bus.read_i2c_block_data(ENC_I2C_ADDR, ENC_REG_RAW, 2)
+#     turns = data[0] / 255 + data[1] / 16320           # "split"
+#
+#     TURNS = decode_table("12bit")
+#     turns = TURNS[(data[0] << 8) | data[1]]
+#
+#     enc = AS5048Reader(bus, 0x40, "split")
+#     turns = enc.read()          # None when the sample is flagged invalid
+#
+# Usage: python encoder.py   (benchmarks inline arithmetic vs table lookup)
+
+import time
+
+# =========================
+# ===== FORMATS ===========
+# =========================
+
+def _turns_split(hi, lo):
+    # lo / 64 is exact, so this rounds the same as hi / 255 + lo / 64 / 255.
+    # Not wrapped: hi = 255 reads slightly past 1, as it always has
+    return hi / 255 + lo / 16320
+
+
+def _turns_12bit(hi, lo):
+    return (((hi << 6) | (lo >> 2)) & 0x0FFF) / 4096.0
+
+
+def _turns_nibble(hi, lo):
+    return (((hi << 4) | (lo >> 4)) & 0x0FFF) / 4096.0
+
+
+def _turns_as5048(hi, lo):
+    return ((hi << 6) | (lo & 0x3F)) / 16384.0
+
+
+def _encode_split(turns):
+    scaled = turns * 255.0
+    hi = min(int(scaled), 255)
+    lo = min(int(round((scaled - hi) * 64.0)), 63)
+    return hi, lo
+
+
+def _encode_12bit(turns):
+    counts = int(turns * 4096.0) & 0x0FFF
+    return (counts >> 6) & 0x3F, (counts & 0x3F) << 2
+
+
+def _encode_nibble(turns):
+    counts = int(turns * 4096.0) & 0x0FFF
+    return counts >> 4, (counts & 0x0F) << 4
+
+
+def _encode_as5048(turns):
+    counts = int(turns * 16384.0) & 0x3FFF
+    return counts >> 6, counts & 0x3F
+
+
+# name -> (hi, lo -> turns, turns -> (hi, lo))
+FORMATS = {
+    "split": (_turns_split, _encode_split),
+    "12bit": (_turns_12bit, _encode_12bit),
+    "nibble": (_turns_nibble, _encode_nibble),
+    "as5048": (_turns_as5048, _encode_as5048),
+}
+
+# Formats decoded through decode_table(); "split" is cheaper inline
+TABLE_FORMATS = ("12bit", "nibble", "as5048")
+
+_TABLES = {}
+
+
+def decode_table(fmt="12bit"):
+    """
+    List of 65,536 turns values indexed by (hi << 8) | lo. Built on first
+    use and shared by every caller. Only for TABLE_FORMATS.
+    """
+    if fmt not in TABLE_FORMATS:
+        raise ValueError(f"no decode table for {fmt!r}: decode it inline")
+    table = _TABLES.get(fmt)
+    if table is None:
+        turns = FORMATS[fmt][0]
+        table = _TABLES[fmt] = [turns(i >> 8, i & 0xFF) for i in range(1 << 16)]
+    return table
+
+
+def encoder_bytes(turns, fmt="split"):
+    """
+    (hi, lo) a sensor would report for an angle in turns (for simulation).
+    """
+    return FORMATS[fmt][1](turns % 1.0)
+
+
+# =========================
+# ======= UNWRAPPING ======
+# =========================
+
+class Unwrapper:
+    """
+    Continuous turns from a reading that wraps in [0, 1).
+
+    A jump of more than `threshold` turns between samples counts as a wrap
+    (0.5 in most scripts, 0.6 for new_Main's hysteresis). The first sample
+    only sets the reference, so no bogus wrap is counted at startup.
+    """
+    __slots__ = ("threshold", "prev", "wraps")
+
+    def __init__(self, threshold=0.5, initial=None):
+        self.threshold = threshold
+        self.prev = initial
+        self.wraps = 0
+
+    def update(self, turns):
+        prev = self.prev
+        if prev is not None:
+            diff = turns - prev
+            if diff < -self.threshold:
+                self.wraps += 1
+            elif diff > self.threshold:
+                self.wraps -= 1
+        self.prev = turns
+        return turns + self.wraps
+
+
+# =========================
+# ===== AS5048 READER =====
+# =========================
+
+# AS5048B register map: AGC, diagnostics, magnitude hi/lo, angle hi/lo
+AS5048_REG_AGC = 0xFA
+AS5048_REG_ANGLE = 0xFE
+AS5048_BLOCK_LEN = 6
+
+# Diagnostics register bits
+DIAG_OCF = 0x01          # offset compensation finished (must be set)
+DIAG_COF = 0x02          # CORDIC overflow: angle and magnitude are invalid
+DIAG_COMP_LOW = 0x04     # AGC at maximum: field too weak
+DIAG_COMP_HIGH = 0x08    # AGC at minimum: field too strong
+
+# Bytes on the wire per register read besides the data:
+# address+W, register, address+R
+I2C_OVERHEAD_BYTES = 3
+
+
+class AS5048Reader:
+    """
+    Encoder driver that reads AGC, diagnostics, magnitude and angle in a
+    single transaction and decodes in place.
+
+    A sample is invalid when the CORDIC overflowed, offset compensation has
+    not finished, or the magnitude is below min_magnitude; read() then
+    returns None, `turns` and `magnitude` keep their last valid values and
+    `diag` shows the fault, so the caller can skip its estimator update.
+    With smbus2 the transfer uses preallocated i2c_msg buffers; with
+    python-smbus it falls back to read_i2c_block_data. block=False reads
+    only the 2 angle bytes (every sample valid), as the scripts did before.
+
+    `t_sample` is the clock() reading at the end of the last transfer: the
+    angle registers are the last bytes clocked out, so that is when the
+    sample was taken to within a byte time. It is set for invalid samples
+    too.
+    """
+    __slots__ = ("bus", "addr", "table", "block", "min_magnitude", "clock",
+                 "turns", "raw", "t_sample", "agc", "diag", "magnitude", "valid",
+                 "samples", "invalid", "transactions", "wire_bytes", "_t0",
+                 "_msgs", "_buf")
+
+    def __init__(self, bus, addr=0x40, fmt="split", block=True, min_magnitude=0,
+                 clock=time.monotonic):
+        self.bus = bus
+        self.addr = addr
+        self.table = decode_table(fmt) if fmt in TABLE_FORMATS else None  # None: split
+        self.block = block
+        self.min_magnitude = min_magnitude
+        self.clock = clock
+        self.turns = 0.0
+        self.raw = 0
+        self.t_sample = 0.0
+        self.agc = 0
+        self.diag = DIAG_OCF
+        self.magnitude = 0
+        self.valid = True
+        self._msgs = None
+        self._buf = None
+        if hasattr(bus, "i2c_rdwr"):
+            try:
+                import ctypes
+                from smbus2 import i2c_msg
+                reg, n = (AS5048_REG_AGC, AS5048_BLOCK_LEN) if block else (AS5048_REG_ANGLE, 2)
+                rd = i2c_msg.read(addr, n)
+                self._msgs = (i2c_msg.write(addr, [reg]), rd)
+                self._buf = ctypes.cast(rd.buf, ctypes.POINTER(ctypes.c_uint8 * n)).contents
+            except ImportError:
+                pass
+        self.reset_stats()
+
+    def _transfer(self, reg, n):
+        if self._msgs is not None:
+            self.bus.i2c_rdwr(*self._msgs)
+            return self._buf
+        return self.bus.read_i2c_block_data(self.addr, reg, n)
+
+    def read(self):
+        """
+        One transaction. Returns turns, or None if flagged invalid.
+        """
+        self.samples += 1
+        self.transactions += 1
+        if not self.block:
+            d = self._transfer(AS5048_REG_ANGLE, 2)
+            self.t_sample = self.clock()
+            self.wire_bytes += 2 + I2C_OVERHEAD_BYTES
+            hi, lo = d[0], d[1]
+        else:
+            d = self._transfer(AS5048_REG_AGC, AS5048_BLOCK_LEN)
+            self.t_sample = self.clock()
+            self.wire_bytes += AS5048_BLOCK_LEN + I2C_OVERHEAD_BYTES
+            diag = d[1]
+            magnitude = (d[2] << 6) | (d[3] & 0x3F)
+            if diag & (DIAG_OCF | DIAG_COF) != DIAG_OCF or magnitude < self.min_magnitude:
+                self.valid = False
+                self.invalid += 1
+                self.diag = diag
+                return None
+            self.valid = True
+            self.agc = d[0]
+            self.diag = diag
+            self.magnitude = magnitude
+            hi, lo = d[4], d[5]
+        raw = self.raw = (hi << 8) | lo
+        table = self.table
+        turns = self.turns = hi / 255 + lo / 16320 if table is None else table[raw]
+        return turns
+
+    def reset_stats(self):
+        self.samples = 0
+        self.invalid = 0
+        self.transactions = 0
+        self.wire_bytes = 0
+        self._t0 = self.clock()
+
+    def bus_stats(self):
+        """
+        Transactions/s and bytes/s on the wire since reset_stats().
+        """
+        elapsed = self.clock() - self._t0
+        rate = 1.0 / elapsed if elapsed > 0 else 0.0
+        return {
+            "transactions_s": self.transactions * rate,
+            "bytes_s": self.wire_bytes * rate,
+            "samples": self.samples,
+            "invalid": self.invalid,
+            "agc": self.agc,
+            "magnitude": self.magnitude,
+            "diag": self.diag,
+        }
+
+
+if __name__ == "__main__":
+    import random
+    import timeit
+
+    N = 100000
+    rng = random.Random(0)
+    samples = [[rng.randrange(256), rng.randrange(64)] for _ in range(N)]
+    env = {"S": samples, "T12": decode_table("12bit")}
+
+    def bench(stmt):
+        # best of 7 to keep scheduler noise out, minus the bare loop cost
+        best = min(timeit.repeat(stmt, globals=env, number=1, repeat=7))
+        return best / N * 1e9
+
+    loop = bench("for d in S: pass")
+    cases = [
+        ("split, two divides (scripts before)", "for d in S: x = d[0] / 255 + d[1] / 64 / 255"),
+        ("split, one divide (encoder.py)", "for d in S: x = d[0] / 255 + d[1] / 16320"),
+        ("12bit, per-call arithmetic (new_Main)", "for d in S: x = (((d[0] << 6) | (d[1] >> 2)) & 0x0FFF) / 4096.0"),
+        ("12bit, table lookup", "for d in S: x = T12[(d[0] << 8) | d[1]]"),
+    ]
+    for name, stmt in cases:
+        print(f"{name:40s}: {bench(stmt) - loop:6.1f} ns/sample")
+
+    unwrap = Unwrapper()
+    env["U"] = unwrap
+    env["R"] = [(0.001 * i) % 1.0 for i in range(N)]
+    print(f"{'Unwrapper.update':40s}: {bench('for r in R: x = U.update(r)') - loop:6.1f} ns/sample")
+
+    for fmt, (decode, _) in FORMATS.items():
+        err = max(abs(decode(h, l) - t) for t in (k / 997.0 for k in range(997))
+                  for h, l in [encoder_bytes(t, fmt)])
+        print(f"round-trip {fmt:7s}: max error {err:.2e} turns")
@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+# Threaded AS5048 Encoder Sampler
+# - Polls the I2C encoder at a fixed rate on its own thread, so blocking
+#   read_i2c_block_data calls never stall the asyncio loop (odrive.loop())
+# - Timestamps every sample with time.monotonic_ns()
+# - Publishes into a preallocated single-producer/single-consumer ring buffer;
+#   the controller reads the newest sample without locks or blocking
+# - Samples through AS5048Reader.read(), so the OCF/COF/magnitude checks and
+#   bus statistics are the same as for a direct read; invalid samples are
+#   counted and not published
+# - Counts late, skipped and failed samples
+#
+# The writer fills a slot first and only then bumps `count`, and the GIL
+# makes that int store atomic, so a reader that sees count = n can always
+# read slot (n - 1) % capacity intact unless it lags a whole ring behind,
+# which is detected and reported as an overrun.
+
+import threading
+import time
+from array import array
+
+from encoder import AS5048Reader
+
+# =========================
+# ====== USER CONFIG ======
+# =========================
+
+ENC_I2C_ADDR = 0x40
+ENC_BUS_NUM = 1
+
+SAMPLE_HZ = 2000          # encoder poll rate
+RING_CAPACITY = 4096      # samples kept (≈2 s at 2 kHz)
+ENC_FORMAT = "split"      # byte layout, see encoder.py
+
+
+# =========================
+# ===== IMPLEMENTATION ====
+# =========================
+
+class EncoderSampler:
+    """
+    Fixed-rate encoder acquisition thread with a lock-free ring buffer.
+
+    start() launches the thread; latest() and read_new() are non-blocking and
+    safe to call from the controller coroutine. `reader` is an AS5048Reader
+    owned by the thread from then on; a sample it flags invalid is counted
+    and skipped, so latest() keeps returning the last valid one.
+    """
+
+    def __init__(self, reader, rate_hz=SAMPLE_HZ, capacity=RING_CAPACITY):
+        self.reader = reader
+        self.period_ns = int(1e9 / rate_hz)
+        self.capacity = capacity
+
+        # Ring storage (preallocated, never resized)
+        self.t_ns = array("q", bytes(8 * capacity))
+        self.turns = array("d", bytes(8 * capacity))
+        self.raw = array("H", bytes(2 * capacity))    # (hi << 8) | lo
+        self.count = 0                                # samples published
+
+        # Health counters
+        self.late = 0          # sample started more than half a period late
+        self.skipped = 0       # whole periods skipped to catch up
+        self.errors = 0        # I2C exceptions
+        self.invalid = 0       # samples the sensor flagged invalid
+        self.max_late_ns = 0
+        self.overruns = 0      # samples overwritten before read_new() saw them
+
+        self._read_cursor = 0
+        self._stop = threading.Event()
+        self._first = threading.Event()
+        self._thread = None
+
+    # ---------- producer ----------
+
+    def _run(self):
+        reader = self.reader
+        read = reader.read
+        period = self.period_ns
+        cap = self.capacity
+        t_buf, turns_buf, raw_buf = self.t_ns, self.turns, self.raw
+        monotonic_ns = time.monotonic_ns
+
+        deadline = monotonic_ns()
+        while not self._stop.is_set():
+            now = monotonic_ns()
+            wait = deadline - now
+            if wait > 0:
+                time.sleep(wait * 1e-9)
+                now = monotonic_ns()
+            lateness = now - deadline
+            if lateness > period // 2:
+                self.late += 1
+                if lateness > self.max_late_ns:
+                    self.max_late_ns = lateness
+            if lateness >= period:
+                # Fell behind: drop the missed slots rather than bursting
+                missed = lateness // period
+                self.skipped += missed
+                deadline += missed * period
+
+            try:
+                t0 = monotonic_ns()
+                turns = read()
+                t1 = monotonic_ns()
+            except OSError:
+                self.errors += 1
+            else:
+                if turns is None:
+                    self.invalid += 1
+                    deadline += period
+                    continue
+                n = self.count
+                slot = n % cap
+                t_buf[slot] = (t0 + t1) >> 1
+                turns_buf[slot] = turns
+                raw_buf[slot] = reader.raw
+                self.count = n + 1        # publish
+                if n == 0:
+                    self._first.set()
+
+            deadline += period
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="encoder-sampler", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self, timeout=1.0):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def wait_first(self, timeout=None):
+        """
+        Block until the first sample is published (for startup only).
+        """
+        return self._first.wait(timeout)
+
+    # ---------- consumer ----------
+
+    def latest(self):
+        """
+        Newest sample as (t_ns, turns, seq), or None before the first one.
+        """
+        n = self.count
+        if n == 0:
+            return None
+        slot = (n - 1) % self.capacity
+        return self.t_ns[slot], self.turns[slot], n - 1
+
+    def latest_turns(self):
+        """
+        Newest angle in turns; drop-in for read_raw_angle_turns().
+        """
+        n = self.count
+        return self.turns[(n - 1) % self.capacity] if n else 0.0
+
+    def latest_time(self):
+        """
+        Capture time of the newest sample in seconds on the time.monotonic()
+        clock (the event loop's), 0.0 before the first one.
+        """
+        n = self.count
+        return self.t_ns[(n - 1) % self.capacity] * 1e-9 if n else 0.0
+
+    def read_new(self):
+        """
+        All samples published since the previous read_new() call, oldest
+        first, as a list of (t_ns, turns). Samples overwritten before they
+        were read are counted in `overruns`.
+        """
+        n = self.count
+        start = self._read_cursor
+        if n - start > self.capacity:
+            self.overruns += n - self.capacity - start
+            start = n - self.capacity
+        cap = self.capacity
+        out = [(self.t_ns[i % cap], self.turns[i % cap]) for i in range(start, n)]
+        self._read_cursor = n
+        return out
+
+    def stats(self):
+        return {
+            "samples": self.count,
+            "late": self.late,
+            "skipped": self.skipped,
+            "errors": self.errors,
+            "invalid": self.invalid,
+            "overruns": self.overruns,
+            "max_late_us": self.max_late_ns / 1e3,
+        }
+
+
+if __name__ == "__main__":
+    import smbus
+
+    reader = AS5048Reader(smbus.SMBus(ENC_BUS_NUM), ENC_I2C_ADDR, ENC_FORMAT)
+    sampler = EncoderSampler(reader).start()
+    sampler.wait_first(1.0)
+    try:
+        while True:
+            time.sleep(0.5)
+            t_ns, turns, seq = sampler.latest()
+            s = sampler.stats()
+            print(f"seq={seq} turns={turns:.4f} | late={s['late']} skipped={s['skipped']} "
+                  f"errors={s['errors']} invalid={s['invalid']} max_late={s['max_late_us']:.0f} us")
+    except KeyboardInterrupt:
+        sampler.stop()
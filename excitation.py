@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+# Precomputed Excitation Signals (system identification + dithering)
+# - PRBS (maximal-length LFSR), linear/log chirp, multisine and random ±n
+#   dither, generated offline from a seed into one preallocated array
+# - Excitation serves them one sample per tick with an index increment
+#   (wrapping or stopping at the end); signals add with `+`
+# - ExcitedODrive adds an excitation to every set_torque of any controller
+#   without touching its code
+#
+# Usage:
+#     DITHER = dither(1 << 16, level=3, seed=0)
+#     u = law(...) + DITHER.next()
+#
+#     odrive = ExcitedODrive(odrive, chirp(20000, 0.001, 0.5, 50.0, 0.2))
+#
+# Usage: python excitation.py   (per-tick cost vs np.random.choice)
+
+import math
+
+import numpy as np
+
+# =========================
+# ====== USER CONFIG ======
+# =========================
+
+DEFAULT_LENGTH = 1 << 16    # samples per precomputed signal (≈65 s at 1 kHz), then wraps
+
+# Maximal-length LFSR feedback taps (bit positions, 1-based) per register order
+LFSR_TAPS = {
+    5: (5, 3), 6: (6, 5), 7: (7, 6), 8: (8, 6, 5, 4), 9: (9, 5), 10: (10, 7),
+    11: (11, 9), 12: (12, 11, 10, 4), 13: (13, 12, 11, 8), 14: (14, 13, 12, 2),
+    15: (15, 14), 16: (16, 15, 13, 4),
+}
+
+# =========================
+# ===== SERVING ===========
+# =========================
+
+class Excitation:
+    """
+    A precomputed signal served one sample per next() call.
+
+    wrap=True repeats the signal; otherwise next() returns 0.0 once it is
+    used up. `index` is the number of samples served, so the injected
+    sequence can be reconstructed from values[:index] for identification.
+    """
+    __slots__ = ("values", "n", "index", "wrap", "name")
+
+    def __init__(self, values, wrap=True, name="excitation"):
+        values = np.asarray(values, dtype=float)
+        self.values = values.tolist()      # list indexing is cheaper than ndarray per tick
+        self.n = len(values)
+        self.index = 0
+        self.wrap = wrap
+        self.name = name
+
+    def next(self):
+        i = self.index
+        self.index = i + 1
+        if i >= self.n:
+            if not self.wrap:
+                return 0.0
+            i %= self.n
+        return self.values[i]
+
+    def reset(self):
+        self.index = 0
+
+    def array(self):
+        return np.array(self.values)
+
+    def __add__(self, other):
+        """
+        Sample-wise sum; the shorter signal is zero-padded, or tiled when
+        it wraps.
+        """
+        a, b = self.array(), other.array()
+        n = max(len(a), len(b))
+
+        def fit(x, wrap):
+            if len(x) == n:
+                return x
+            return np.resize(x, n) if wrap else np.pad(x, (0, n - len(x)))
+        return Excitation(fit(a, self.wrap) + fit(b, other.wrap), self.wrap and other.wrap,
+                          f"{self.name}+{other.name}")
+
+
+class ExcitedODrive:
+    """
+    ODrive proxy that adds the next excitation sample to every torque
+    command, so any controller can be excited unchanged.
+    """
+
+    def __init__(self, odrive, excitation):
+        self._odrive = odrive
+        self.excitation = excitation
+
+    def set_torque(self, torque):
+        return self._odrive.set_torque(torque + self.excitation.next())
+
+    def __getattr__(self, name):
+        return getattr(self._odrive, name)
+
+
+# =========================
+# ===== GENERATORS ========
+# =========================
+
+def prbs(n=DEFAULT_LENGTH, amplitude=1.0, order=10, hold=1, seed=1, wrap=True):
+    """
+    ±amplitude maximal-length PRBS of period (2**order - 1) * hold samples.
+    `hold` ticks per bit sets the bandwidth; the seed picks the start state.
+    """
+    taps = LFSR_TAPS[order]
+    period = (1 << order) - 1
+    state = seed % period + 1                  # any non-zero state
+    bits = np.empty(period, dtype=np.int8)
+    for k in range(period):
+        bits[k] = state & 1
+        fb = 0
+        for t in taps:
+            fb ^= (state >> (order - t)) & 1
+        state = (state >> 1) | (fb << (order - 1))
+    seq = np.repeat(2.0 * bits - 1.0, hold)
+    return Excitation(amplitude * np.resize(seq, n), wrap, f"prbs{order}")
+
+
+def chirp(n, dt, f0, f1, amplitude=1.0, log=False, wrap=False):
+    """
+    Swept sine from f0 to f1 Hz over n samples of period dt.
+    """
+    t = np.arange(n) * dt
+    T = n * dt
+    if log:
+        k = (f1 / f0) ** (1.0 / T)
+        phase = 2.0 * math.pi * f0 * (k ** t - 1.0) / math.log(k)
+    else:
+        phase = 2.0 * math.pi * (f0 * t + 0.5 * (f1 - f0) / T * t ** 2)
+    return Excitation(amplitude * np.sin(phase), wrap, "chirp")
+
+
+def multisine(n, dt, freqs, amplitude=1.0, seed=None, wrap=True):
+    """
+    Sum of sines at `freqs` (Hz) scaled to a peak of `amplitude`. Schroeder
+    phases (low crest factor) by default, random phases from `seed` if given.
+    """
+    freqs = np.asarray(freqs, dtype=float)
+    k = np.arange(1, len(freqs) + 1)
+    if seed is None:
+        phases = -math.pi * k * (k - 1) / len(freqs)
+    else:
+        phases = np.random.default_rng(seed).uniform(0.0, 2.0 * math.pi, len(freqs))
+    t = np.arange(n)[:, None] * dt
+    x = np.sin(2.0 * math.pi * freqs[None, :] * t + phases[None, :]).sum(axis=1)
+    peak = np.abs(x).max()
+    return Excitation(amplitude * x / peak if peak > 0 else x, wrap, "multisine")
+
+
+def dither(n=DEFAULT_LENGTH, level=1.0, seed=0, wrap=True):
+    """
+    Random ±level per tick (what np.random.choice([-1, 1]) * level gave).
+    """
+    signs = np.random.default_rng(seed).integers(0, 2, n) * 2.0 - 1.0
+    return Excitation(level * signs, wrap, "dither")
+
+
+if __name__ == "__main__":
+    import timeit
+
+    N = 100000
+    d = dither(level=3, seed=0)
+    t_choice = min(timeit.repeat("np.random.choice([-1, 1])", globals={"np": np},
+                                 number=N // 10, repeat=5)) / (N // 10)
+    t_next = min(timeit.repeat("d.next()", globals={"d": d}, number=N, repeat=5)) / N
+    print(f"dither: np.random.choice {t_choice * 1e9:.0f} ns/tick | Excitation.next {t_next * 1e9:.0f} ns/tick")
+
+    p = prbs(order=10, seed=7).array()
+    period = (1 << 10) - 1
+    print(f"prbs10: period {period}, repeats exactly: {np.array_equal(p[:period], p[period:2 * period])}, "
+          f"mean {p[:period].mean():+.4f}")
+    c = chirp(10000, 0.001, 0.5, 50.0, amplitude=0.2).array()
+    m = multisine(4096, 0.001, np.arange(1, 41) * 0.5, amplitude=0.2).array()
+    print(f"chirp: peak {np.abs(c).max():.3f} | multisine (Schroeder): crest factor "
+          f"{np.abs(m).max() / np.sqrt(np.mean(m ** 2)):.2f}")
+    s = dither(1000, 3, seed=1) + chirp(500, 0.001, 1.0, 10.0)
+    print(f"composed {s.name}: {s.n} samples")
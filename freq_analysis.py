@@ -0,0 +1,393 @@
+#!/usr/bin/env python3
+# Frequency-Domain Loop Analysis and Stability Margins over Gain Grids
+# - Plant from lqr.linear_model (the derivation's 1/(I_s s^2 + b s - g m l)
+#   for the pendulum, plus the wheel), loop broken at the torque input:
+#       tau = -(Kp*theta + Ki*int(theta) + Kd*theta_dot + Kw*wheel_rate)
+#       L(jw) = [(Kp + Ki/jw + Kd jw) P_theta(jw) + Kw P_wheel(jw)] e^(-jw T)
+#   PD, PID and PD + wheel damping are the cases Ki = Kw = 0, Kw = 0, Ki = 0
+# - T is the pure delay of the 1 ms loop: sample -> torque (COMPUTE_DELAY_S)
+#   plus the zero-order hold's half period
+# - Every gain combination is a row of one (G x frequencies) complex array:
+#   thousands of loops per call, in chunks
+# - Margins per row: Nyquist stability (the open loop is unstable, so the
+#   loop must encircle -1 once), phase margin, delay margin (extra latency
+#   the loop tolerates), lower/upper gain margins, peak sensitivity Ms
+# - bode() / nyquist() give the curves for a few gain sets
+#
+# Usage: python freq_analysis.py                    (margins of the gains in use, Kp x Kd map)
+#        python freq_analysis.py --points 200 --delay 0.003 --save margins.npz
+
+import math
+
+import numpy as np
+
+from lqr import linear_model
+from pendulum_sim import AIMAIN_LPF_ALPHA, PendulumParams
+
+# =========================
+# ====== USER CONFIG ======
+# =========================
+
+LOOP_DT = 0.001              # control period (CONTROL_DT)
+COMPUTE_DELAY_S = 0.001      # sample -> torque applied, worst case one tick
+DELAY_S = COMPUTE_DELAY_S + LOOP_DT / 2   # + zero-order hold
+
+OMEGA_MIN = 1e-3             # rad/s, frequency grid (log spaced)
+OMEGA_MAX = 1e5              # rad/s, |L| must be small here for the encirclement count
+OMEGA_POINTS = 4000
+CHUNK = 512                  # gain rows per block (bounds memory at G x OMEGA_POINTS)
+
+# =========================
+# ===== IMPLEMENTATION ====
+# =========================
+
+def frequency_grid(points=OMEGA_POINTS, omega_min=OMEGA_MIN, omega_max=OMEGA_MAX):
+    return np.logspace(math.log10(omega_min), math.log10(omega_max), points)
+
+
+def plant_response(omega, params=PendulumParams()):
+    """
+    (P_theta, P_wheel): theta and wheel rate per Nm of motor torque at
+    s = j*omega, and the number of open-loop poles in the right half plane.
+    """
+    A, B = linear_model(params)
+    s = 1j * np.asarray(omega, dtype=float)
+    M = s[:, None, None] * np.eye(3) - A
+    X = np.linalg.solve(M, np.broadcast_to(B.astype(complex), (len(s), 3, 1)))[:, :, 0]
+    unstable = int(np.sum(np.linalg.eigvals(A).real > 0))
+    return X[:, 0], X[:, 2], unstable
+
+
+def static_response(params=PendulumParams()):
+    """
+    (P_theta(0), dP_theta/ds(0), P_wheel(0), origin_zero). With wheel
+    friction a constant torque ends up spinning the wheel, not tilting the
+    body, so P_theta has a zero at s = 0 (origin_zero): an integrator on
+    theta cancels against it and Ki acts like a proportional gain on the
+    static loop, while int(theta) itself is left unregulated (a closed-loop
+    pole at s = 0).
+    """
+    A, B = linear_model(params)
+    x0 = np.linalg.solve(-A, B)[:, 0]                 # (0*I - A)^-1 B
+    dx0 = np.linalg.solve(A, x0)                      # d/ds (sI - A)^-1 B = -(sI - A)^-2 B at 0
+    origin_zero = abs(x0[0]) <= 1e-9 * abs(dx0[0])
+    return float(x0[0]), float(dx0[0]), float(x0[2]), bool(origin_zero)
+
+
+def _gain_rows(Kp, Kd, Ki, Kw):
+    Kp, Kd, Ki, Kw = np.broadcast_arrays(*(np.asarray(k, dtype=float) for k in (Kp, Kd, Ki, Kw)))
+    return Kp.shape, np.stack([Kp.ravel(), Kd.ravel(), Ki.ravel(), Kw.ravel()], axis=1)
+
+
+def _basis(omega, params, delay):
+    """
+    (4 x W) responses so that L = [Kp, Kd, Ki, Kw] @ basis: one matrix
+    product per block of gain rows.
+    """
+    p_theta, p_wheel, unstable = plant_response(omega, params)
+    s = 1j * omega
+    lag = np.exp(-s * delay)
+    return np.stack([p_theta, s * p_theta, p_theta / s, p_wheel]) * lag, unstable
+
+
+def loop_response(Kp, Kd=0.0, Ki=0.0, Kw=0.0, omega=None, params=PendulumParams(), delay=DELAY_S):
+    """
+    L(j*omega) for every gain combination (the gains broadcast together),
+    shape gains.shape + omega.shape.
+    """
+    omega = frequency_grid() if omega is None else np.asarray(omega, dtype=float)
+    shape, K = _gain_rows(Kp, Kd, Ki, Kw)
+    basis, _ = _basis(omega, params, delay)
+    return (K @ basis).reshape(shape + omega.shape)
+
+
+def _crossings(a):
+    """
+    (row, column, fraction) where a (G x W) changes sign between column and
+    column + 1, the fraction being the linear interpolation of the zero.
+    """
+    pos = a > 0
+    r, c = np.nonzero(pos[:, 1:] != pos[:, :-1])
+    a0, a1 = a[r, c], a[r, c + 1]
+    f = a0 / (a0 - a1)
+    return r, c, f
+
+
+def _margins_block(re, im, L0, log_w, unstable, integral):
+    """
+    Margins of a block of rows of L = re + j*im (G x W on the frequency
+    grid). L0 is L at omega = 0 where finite; `integral` marks rows with a
+    true integrator in L. Full-width passes are kept to a few; everything
+    at a crossing is computed at the crossings only.
+    """
+    n = re.shape[0]
+    two_pi = 2.0 * math.pi
+
+    # Phase crossovers (Im L changes sign). On the negative real axis they
+    # give the loop gain factor k = -1/Re L at which -1 would be hit;
+    # stability holds between the nearest k below and above 1 (the static
+    # gain counts too when finite)
+    r, c, g = _crossings(im)
+    rec = re[r, c] + g * (re[r, c + 1] - re[r, c])
+    neg = rec < 0
+    up = np.full(n, np.inf)
+    low = np.zeros(n)
+    with np.errstate(divide="ignore"):
+        k = -1.0 / rec[neg]
+        k0 = np.where(~integral & (L0 < 0), -1.0 / L0, np.nan)
+    np.minimum.at(up, r[neg][k > 1.0], k[k > 1.0])
+    np.maximum.at(low, r[neg][k < 1.0], k[k < 1.0])
+    up = np.where(k0 > 1.0, np.minimum(up, k0), up)
+    low = np.where(k0 < 1.0, np.maximum(low, k0), low)
+    with np.errstate(divide="ignore"):
+        gm_up = 20.0 * np.log10(up)
+        gm_low = 20.0 * np.log10(low)
+
+    # Nyquist: closed-loop RHP poles Z = P - (winding of 1+L over -inf..inf)
+    # / 2pi. By symmetry the winding is twice the one over 0..inf: the
+    # change of arg(1+L) plus 2pi per crossing of the negative real axis
+    # left of -1 (the phase crossovers again, signed by direction). An
+    # integrator adds the -pi of the small indentation around s = 0
+    ret_first = (1.0 + re[:, 0]) + 1j * im[:, 0]
+    ret_last = (1.0 + re[:, -1]) + 1j * im[:, -1]
+    wraps = np.zeros(n)
+    cut = rec < -1.0
+    np.add.at(wraps, r[cut], np.where(im[r[cut], c[cut]] > 0, two_pi, -two_pi))
+    winding = np.angle(ret_last) - np.angle(ret_first) + wraps
+    winding += np.where(integral, 0.0, np.angle(ret_first / (1.0 + L0 + 0j)))
+    closed_unstable = np.rint(unstable - winding / math.pi + 0.5 * integral).astype(int)
+
+    # Gain crossovers |L| = 1: phase margin and delay margin
+    mag2 = re * re + im * im
+    r, c, f = _crossings(np.log(mag2))
+    l0 = re[r, c] + 1j * im[r, c]
+    l1 = re[r, c + 1] + 1j * im[r, c + 1]
+    wc = np.exp(log_w[c] + f * (log_w[c + 1] - log_w[c]))
+    phc = np.angle(l0) + f * np.angle(l1 / l0)
+    to_minus_one = np.mod(phc + math.pi, two_pi)        # phase lag left before -1
+    pm = np.full(n, np.inf)
+    dm = np.full(n, np.inf)
+    wc_first = np.full(n, np.inf)
+    np.minimum.at(pm, r, np.minimum(to_minus_one, two_pi - to_minus_one))
+    np.minimum.at(dm, r, to_minus_one / wc)
+    np.minimum.at(wc_first, r, wc)
+
+    ms = 1.0 / np.sqrt(np.min(mag2 + 2.0 * re + 1.0, axis=1))
+    return {
+        "stable": closed_unstable == 0,
+        "closed_unstable": closed_unstable,
+        "pm_deg": np.degrees(pm),
+        "delay_margin_s": dm,
+        "wc": wc_first,
+        "gm_low_db": gm_low,
+        "gm_up_db": gm_up,
+        "ms": ms,
+    }
+
+
+def margins(Kp, Kd=0.0, Ki=0.0, Kw=0.0, params=PendulumParams(), delay=DELAY_S,
+            omega=None, chunk=CHUNK):
+    """
+    Stability margins for every gain combination (the gains broadcast
+    together): a dict of arrays of the broadcast shape.
+
+        stable           closed loop stable (Nyquist count, with the delay)
+        closed_unstable  closed-loop right-half-plane poles
+        pm_deg           phase margin, closest |L| = 1 crossing to -1
+        delay_margin_s   extra pure delay before instability
+        wc               lowest gain crossover, rad/s
+        gm_low_db        gain reduction to instability (negative dB, -inf if none)
+        gm_up_db         gain increase to instability (dB, inf if none)
+        ms               peak sensitivity max |1 / (1 + L)|
+
+    Margins of unstable rows are computed the same way but mean little. For
+    Ki != 0 see static_response(): "stable" then covers every pole but the
+    one int(theta) leaves at s = 0.
+    """
+    omega = frequency_grid() if omega is None else np.asarray(omega, dtype=float)
+    shape, K = _gain_rows(Kp, Kd, Ki, Kw)
+    basis, unstable = _basis(omega, params, delay)
+    basis_re, basis_im = np.ascontiguousarray(basis.real), np.ascontiguousarray(basis.imag)
+    p0_theta, dp0_theta, p0_wheel, origin_zero = static_response(params)
+    # L at omega = 0 per gain, and whether L keeps an integrator there
+    static = np.array([p0_theta, 0.0, dp0_theta if origin_zero else 0.0, p0_wheel])
+    log_w = np.log(omega)
+
+    out = {}
+    for i in range(0, len(K), chunk):
+        k = K[i:i + chunk]
+        integral = np.zeros(len(k), dtype=bool) if origin_zero else k[:, 2] != 0.0
+        block = _margins_block(k @ basis_re, k @ basis_im, k @ static, log_w, unstable, integral)
+        for name, values in block.items():
+            out.setdefault(name, []).append(values)
+    return {name: np.concatenate(parts).reshape(shape) for name, parts in out.items()}
+
+
+def margin_map(Kp_values, Kd_values, Ki=0.0, Kw=0.0, **kwargs):
+    """
+    margins() over the Kp x Kd grid (rows Kp, columns Kd) at fixed Ki, Kw.
+    """
+    Kp, Kd = np.meshgrid(np.asarray(Kp_values, dtype=float), np.asarray(Kd_values, dtype=float),
+                         indexing="ij")
+    return margins(Kp, Kd, Ki, Kw, **kwargs)
+
+
+def bode(Kp, Kd=0.0, Ki=0.0, Kw=0.0, omega=None, params=PendulumParams(), delay=DELAY_S):
+    """
+    (omega, |L| in dB, unwrapped phase of L in degrees), one row per gain set.
+    """
+    omega = frequency_grid() if omega is None else np.asarray(omega, dtype=float)
+    L = np.atleast_2d(loop_response(Kp, Kd, Ki, Kw, omega, params, delay))
+    return omega, 20.0 * np.log10(np.abs(L)), np.degrees(np.unwrap(np.angle(L), axis=-1))
+
+
+def nyquist(Kp, Kd=0.0, Ki=0.0, Kw=0.0, omega=None, params=PendulumParams(), delay=DELAY_S):
+    """
+    (omega, L(j*omega)) for positive frequencies, one row per gain set; the
+    negative half is the complex conjugate.
+    """
+    omega = frequency_grid() if omega is None else np.asarray(omega, dtype=float)
+    return omega, np.atleast_2d(loop_response(Kp, Kd, Ki, Kw, omega, params, delay))
+
+# =========================
+# ===== CROSS-CHECK =======
+# =========================
+
+def pade(delay, order=4):
+    """
+    State space (A, B, C, D) of the (order, order) Pade approximation of
+    e^(-s delay).
+    """
+    n = order
+    c = [math.factorial(2 * n - k) * math.factorial(n)
+         / (math.factorial(2 * n) * math.factorial(k) * math.factorial(n - k)) for k in range(n + 1)]
+    den = np.array([c[k] * delay ** k for k in range(n + 1)])          # ascending powers
+    num = np.array([(-1) ** k * c[k] * delay ** k for k in range(n + 1)])
+    den, num = den / den[-1], num / den[-1]
+    D = num[-1]
+    rem = num[:-1] - D * den[:-1]
+    A = np.zeros((n, n))
+    A[:-1, 1:] = np.eye(n - 1)
+    A[-1] = -den[:-1]
+    B = np.zeros((n, 1))
+    B[-1, 0] = 1.0
+    return A, B, rem[None, :], D
+
+
+def closed_loop_stable(Kp, Kd=0.0, Ki=0.0, Kw=0.0, params=PendulumParams(), delay=DELAY_S,
+                       order=4):
+    """
+    Stability from the closed-loop eigenvalues with a Pade delay, as an
+    independent check on the Nyquist count (1-D gain arrays). Judged like
+    margins(): with Ki != 0 the pole at s = 0 is left out.
+    """
+    Kp, Kd, Ki, Kw = _gain_rows(Kp, Kd, Ki, Kw)[1].T
+    A, B = linear_model(params)
+    Ad, Bd, Cd, Dd = pade(delay, order)
+    n = 4 + order                                    # theta, theta_dot, wheel, int(theta), delay
+    M = np.zeros((Kp.size, n, n))
+    K = np.stack([Kp, Kd, Kw], axis=1)               # u = -(K x + Ki int(theta))
+    # plant: x' = A x + B (Cd z + Dd u)
+    M[:, :3, :3] = A - Dd * B[:, 0][None, :, None] * K[:, None, :]
+    M[:, :3, 3] = -Dd * B[:, 0][None, :] * Ki[:, None]
+    M[:, :3, 4:] = B @ Cd
+    M[:, 3, 0] = 1.0
+    # delay: z' = Ad z + Bd u
+    M[:, 4:, :3] = -Bd[:, 0][None, :, None] * K[:, None, :]
+    M[:, 4:, 3] = -Bd[:, 0][None, :] * Ki[:, None]
+    M[:, 4:, 4:] = Ad
+    stable = np.empty(Kp.size, dtype=bool)
+    pi = Ki != 0.0
+    if pi.any():
+        ev = np.linalg.eigvals(M[pi])
+        if static_response(params)[3]:
+            # the s = 0 pole int(theta) is left with, see static_response()
+            ev[np.arange(len(ev)), np.argmin(np.abs(ev), axis=1)] = -1.0
+        stable[pi] = np.max(ev.real, axis=1) < 0
+    if not pi.all():
+        # no integrator: drop its state (a decoupled pole at 0)
+        M = np.delete(np.delete(M[~pi], 3, axis=1), 3, axis=2)
+        stable[~pi] = np.max(np.linalg.eigvals(M).real, axis=1) < 0
+    return stable
+
+
+if __name__ == "__main__":
+    import argparse
+    import time
+
+    from gains import load_gains
+    from lqr import pendulum_gains
+
+    parser = argparse.ArgumentParser(description="Loop margins of the balance controllers.")
+    parser.add_argument("--points", type=int, default=100, help="Kp and Kd values in the map")
+    parser.add_argument("--delay", type=float, default=DELAY_S, help="loop delay, s")
+    parser.add_argument("--save", default=None, help="write the map and Bode data to this .npz")
+    args = parser.parse_args()
+
+    params = PendulumParams()
+    delay = args.delay
+    k_lqr = pendulum_gains(params, dt=LOOP_DT)
+    g = load_gains("pd_wheel", Kp=-120.0, Kd=-20.0, Kw=10.0)
+    cases = {
+        "lqr pd_wheel": (k_lqr[0], k_lqr[1], 0.0, k_lqr[2]),
+        "lqr pd": (k_lqr[0], k_lqr[1], 0.0, 0.0),
+        "lqr pid Ki=Kp": (k_lqr[0], k_lqr[1], k_lqr[0], 0.0),
+        # AIMain's theta_dot stays 0 at LPF_ALPHA = 0, so its Kd never acts
+        "AIMain pd_wheel": (g["Kp"], g["Kd"] if AIMAIN_LPF_ALPHA else 0.0, 0.0, g["Kw"]),
+    }
+    print(f"Loop delay {delay * 1e3:.2f} ms, {OMEGA_POINTS} frequencies "
+          f"{OMEGA_MIN:g}..{OMEGA_MAX:g} rad/s")
+    for name, (kp, kd, ki, kw) in cases.items():
+        m = margins(kp, kd, ki, kw, params=params, delay=delay)
+        if not m["stable"]:
+            print(f"  {name:16s} (Kp {kp:8.3f} Ki {ki:8.3f} Kd {kd:7.3f} Kw {kw:7.4f}): "
+                  f"UNSTABLE, {m['closed_unstable']} closed-loop RHP poles")
+            continue
+        print(f"  {name:16s} (Kp {kp:8.3f} Ki {ki:8.3f} Kd {kd:7.3f} Kw {kw:7.4f}): "
+              f"PM {m['pm_deg']:5.1f} deg at {m['wc']:6.1f} rad/s | delay margin "
+              f"{m['delay_margin_s'] * 1e3:5.2f} ms | GM {m['gm_low_db']:6.1f} / "
+              f"+{m['gm_up_db']:5.1f} dB | Ms {m['ms']:.2f}")
+    if static_response(params)[3]:
+        print("  (Ki: int(theta) cancels against the plant's zero at s = 0, its pole there is not counted)")
+
+    # Kp x Kd map around the LQR design, wheel damping held at its value
+    kp_values = np.linspace(4.0 * k_lqr[0], 0.0, args.points)
+    kd_values = np.linspace(4.0 * k_lqr[1], 0.0, args.points)
+    t0 = time.perf_counter()
+    mp = margin_map(kp_values, kd_values, Kw=k_lqr[2], params=params, delay=delay)
+    wall = time.perf_counter() - t0
+    n = args.points ** 2
+    print(f"Kp x Kd map: {n} loops in {wall * 1e3:.0f} ms ({n / wall:,.0f} loops/s), "
+          f"{mp['stable'].mean() * 100:.1f}% stable")
+    dm = np.where(mp["stable"], mp["delay_margin_s"], np.nan)
+    robust = np.where(mp["ms"] <= 2.0, dm, np.nan)
+    best = np.unravel_index(np.nanargmax(robust), dm.shape)
+    print(f"  largest delay margin with Ms <= 2: {dm[best] * 1e3:.2f} ms at Kp {kp_values[best[0]]:.2f}, "
+          f"Kd {kd_values[best[1]]:.3f} (PM {mp['pm_deg'][best]:.1f} deg, Ms {mp['ms'][best]:.2f})")
+
+    # Delay-margin map, coarse: ' ' unstable, '.' < 1 ms, ':' < 2, '+' < 5, '#' >= 5 ms
+    print("  delay margin (rows Kp from {:.0f} to 0, columns Kd from {:.1f} to 0)".format(
+        kp_values[0], kd_values[0]))
+    step = max(1, args.points // 20)
+    for i in range(0, args.points, step):
+        row = "".join(" " if np.isnan(v) else ".:+#"[int(np.searchsorted([1e-3, 2e-3, 5e-3], v, "right"))]
+                      for v in dm[i, ::max(1, args.points // 60)])
+        print(f"  {kp_values[i]:8.2f} |{row}|")
+
+    # Cross-check the Nyquist stability count against Pade closed-loop eigenvalues
+    rng = np.random.default_rng(0)
+    m = 2000
+    kp = rng.uniform(4.0 * k_lqr[0], 0.0, m)
+    kd = rng.uniform(4.0 * k_lqr[1], 0.0, m)
+    ki = np.where(rng.random(m) < 0.5, rng.uniform(4.0 * k_lqr[0], 0.0, m), 0.0)
+    kw = rng.uniform(-0.05, 0.05, m)
+    nyq = margins(kp, kd, ki, kw, params=params, delay=delay)["stable"]
+    eig = closed_loop_stable(kp, kd, ki, kw, params=params, delay=delay)
+    print(f"Nyquist vs Pade eigenvalues on {m} random PD/PID/wheel gain sets: "
+          f"{np.mean(nyq == eig) * 100:.2f}% agree ({nyq.mean() * 100:.1f}% stable)")
+
+    if args.save:
+        omega, mag_db, phase_deg = bode(*np.array(list(cases.values())).T, params=params, delay=delay)
+        np.savez(args.save, kp=kp_values, kd=kd_values, omega=omega, bode_mag_db=mag_db,
+                 bode_phase_deg=phase_deg, cases=list(cases), **mp)
+        print(f"Wrote {args.save}")
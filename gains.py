@@ -0,0 +1,52 @@
+# Controller Gain Store
+# - tune_gains.py writes its best gains to GAINS_PATH as JSON:
+#     {"pd_wheel": {"Kp": ..., "Kd": ..., "Kw": ...}, "sliding": {"C": ...}, ...}
+# - Controllers call load_gains() with their hand-picked defaults, so they
+#   still run unchanged when no tuned file exists
+
+import json
+import os
+
+GAINS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "gains.json")
+
+
+def load_gains(controller, path=GAINS_PATH, **defaults):
+    """
+    Return the defaults updated with any tuned values stored for
+    `controller`. Unknown keys in the file are ignored.
+    """
+    gains = dict(defaults)
+    try:
+        with open(path) as f:
+            stored = json.load(f).get(controller, {})
+    except (OSError, ValueError):
+        return gains
+    for name in gains:
+        if name in stored:
+            gains[name] = float(stored[name])
+    return gains
+
+
+def has_tuned_gains(controller, path=GAINS_PATH):
+    """
+    True if the file holds tuned gains for `controller`.
+    """
+    try:
+        with open(path) as f:
+            return bool(json.load(f).get(controller))
+    except (OSError, ValueError):
+        return False
+
+
+def save_gains(controller, gains, path=GAINS_PATH):
+    """
+    Store gains for one controller, keeping entries for the others.
+    """
+    try:
+        with open(path) as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        data = {}
+    data[controller] = {k: float(v) for k, v in gains.items()}
+    with open(path, "w") as f:
+        json.dump(data, f, indent=2, sort_keys=True)
@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+# Online and Batch Identification of I_s, b and m*g*l
+# - Model (pendulum_sim.py sign convention, wheel torque reacts on the body):
+#       I_s*theta_ddot + b*theta_dot - m*g*l*sin(theta) = u,   u = -tau
+#   rewritten linear in p = (1/I_s, b/I_s, mgl/I_s) with theta_ddot as the
+#   output, so encoder noise lands on the output rather than the regressors:
+#       theta_ddot = p . (u, -theta_dot, sin(theta))
+# - Each regression sample spans two windows of `decimate` ticks and weights
+#   everything with the same triangular kernel: applied to theta_ddot that
+#   kernel is exactly the second difference of the window end angles, so
+#   u, theta_dot and sin(theta) are filtered identically and quantized
+#   encoder angles are usable without a separate estimator. The torque
+#   logged at a tick is the one applied until the next tick
+# - Wheel bearing friction (b_w * wheel rate) is not in the model and ends
+#   up partly in b
+# - OnlineIdentifier: recursive least squares with forgetting factor, O(1)
+#   plain-float work per sample, to run alongside a control loop
+# - fit_batch / fit_telemetry: the same regression over a whole log in one
+#   vectorized least-squares solve
+#
+# Usage: python identify.py                 (simulated excitation run)
+#        python identify.py telemetry.bin   (fit a recorded log)
+
+import math
+
+import numpy as np
+
+# =========================
+# ====== USER CONFIG ======
+# =========================
+
+FORGETTING = 0.999        # per regression sample; 1.0 = no forgetting
+DECIMATE = 20             # control ticks per regression sample
+P0 = 1e6                  # initial covariance scale (weak prior)
+TORQUE_SIGN = -1.0        # u = TORQUE_SIGN * commanded torque
+
+# =========================
+# ===== ONLINE (RLS) ======
+# =========================
+
+def _params_from(p):
+    if p[0] <= 0.0:
+        return {"I_s": math.nan, "b": math.nan, "mgl": math.nan}
+    I_s = 1.0 / p[0]
+    return {"I_s": I_s, "b": p[1] * I_s, "mgl": p[2] * I_s}
+
+
+class OnlineIdentifier:
+    """
+    Recursive least squares on (t, theta, tau) samples from the control loop.
+
+    update() is called every tick with the measured angle and the torque
+    just commanded (applied until the next tick); every `decimate` ticks it
+    closes a window and, with the window before it, does one 3-parameter
+    RLS step. estimates() gives I_s, b and m*g*l.
+    """
+    __slots__ = ("lam", "decimate", "torque_sign", "p", "P", "samples",
+                 "_weights", "_acc", "_count", "_prev", "_ends", "_last")
+
+    def __init__(self, lam=FORGETTING, decimate=DECIMATE, torque_sign=TORQUE_SIGN, p0=P0):
+        self.lam = lam
+        self.decimate = decimate
+        self.torque_sign = torque_sign
+        self.p = [0.0, 0.0, 0.0]
+        self.P = [[p0, 0.0, 0.0], [0.0, p0, 0.0], [0.0, 0.0, p0]]
+        self.samples = 0
+        self._weights = [(i + 0.5) / decimate for i in range(decimate)]   # rising kernel half
+        self._acc = [0.0] * 5   # u rising, u falling, sin rising, sin falling, theta sum
+        self._count = 0
+        self._prev = None       # (theta, tau) at the previous tick
+        self._ends = []         # up to 3 (t, theta) window end points
+        self._last = None       # sums of the previous window, divided by decimate
+
+    def update(self, t, theta, tau):
+        prev = self._prev
+        self._prev = (theta, tau)
+        if prev is None:
+            self._ends.append((t, theta))
+            return
+        # The interval since the previous tick: its torque and mid angle
+        u = self.torque_sign * prev[1]
+        mid = 0.5 * (prev[0] + theta)
+        s = math.sin(mid)
+        r = self._weights[self._count]
+        acc = self._acc
+        acc[0] += r * u
+        acc[1] += (1.0 - r) * u
+        acc[2] += r * s
+        acc[3] += (1.0 - r) * s
+        acc[4] += mid
+        self._count += 1
+        if self._count < self.decimate:
+            return
+
+        inv_d = 1.0 / self.decimate
+        cur = [a * inv_d for a in acc]
+        self._acc = [0.0] * 5
+        self._count = 0
+        ends = self._ends
+        ends.append((t, theta))
+        last, self._last = self._last, cur
+        if last is None:
+            return
+        (t0, th0), (t1, th1), (t2, th2) = ends
+        del ends[0]
+        h = 0.5 * (t2 - t0)
+        y = (th2 - 2.0 * th1 + th0) / (h * h)
+        self.step((last[0] + cur[1], -(cur[4] - last[4]) / h, last[2] + cur[3]), y)
+
+    def step(self, phi, y):
+        """
+        One RLS step with regressor phi (3 floats) and output y.
+        """
+        P, p, lam = self.P, self.p, self.lam
+        Pphi = [P[i][0] * phi[0] + P[i][1] * phi[1] + P[i][2] * phi[2] for i in range(3)]
+        denom = lam + phi[0] * Pphi[0] + phi[1] * Pphi[1] + phi[2] * Pphi[2]
+        k = [Pphi[0] / denom, Pphi[1] / denom, Pphi[2] / denom]
+        err = y - (p[0] * phi[0] + p[1] * phi[1] + p[2] * phi[2])
+        for i in range(3):
+            p[i] += k[i] * err
+        # P = (P - k (P phi)') / lam, P symmetric
+        inv_lam = 1.0 / lam
+        for i in range(3):
+            row = P[i]
+            ki = k[i]
+            for j in range(3):
+                row[j] = (row[j] - ki * Pphi[j]) * inv_lam
+        self.samples += 1
+
+    def estimates(self):
+        return _params_from(self.p)
+
+
+# =========================
+# ===== BATCH =============
+# =========================
+
+def regression_data(t, theta, tau, decimate=DECIMATE, torque_sign=TORQUE_SIGN):
+    """
+    (Phi, y) for a whole log, built exactly as OnlineIdentifier does.
+    """
+    t = np.asarray(t, dtype=float)
+    theta = np.asarray(theta, dtype=float)
+    tau = np.asarray(tau, dtype=float)
+    n = (len(t) - 1) // decimate                       # complete windows
+    N = n * decimate
+    u = torque_sign * tau[:N].reshape(n, decimate)      # applied over [t_k, t_k+1)
+    mid = 0.5 * (theta[:N] + theta[1:N + 1])
+    r = (np.arange(decimate) + 0.5) / decimate          # rising kernel half
+    s = np.sin(mid).reshape(n, decimate)
+    u_rise, u_fall = u @ r / decimate, u @ (1.0 - r) / decimate
+    s_rise, s_fall = s @ r / decimate, s @ (1.0 - r) / decimate
+    th_mean = mid.reshape(n, decimate).mean(axis=1)
+    tw, thw = t[0:N + 1:decimate], theta[0:N + 1:decimate]
+    h = 0.5 * (tw[2:] - tw[:-2])
+    y = (thw[2:] - 2.0 * thw[1:-1] + thw[:-2]) / h ** 2
+    Phi = np.column_stack([u_rise[:-1] + u_fall[1:], -(th_mean[1:] - th_mean[:-1]) / h,
+                           s_rise[:-1] + s_fall[1:]])
+    return Phi, y
+
+
+def fit_batch(t, theta, tau, decimate=DECIMATE, torque_sign=TORQUE_SIGN, lam=1.0):
+    """
+    Least-squares I_s, b, m*g*l over a whole log in one solve. lam < 1
+    weights samples like the online forgetting factor (newest = 1).
+    """
+    Phi, y = regression_data(t, theta, tau, decimate, torque_sign)
+    if lam < 1.0:
+        w = np.sqrt(lam ** np.arange(len(y) - 1, -1, -1))
+        Phi, y = Phi * w[:, None], y * w
+    p, *_ = np.linalg.lstsq(Phi, y, rcond=None)
+    return _params_from(p)
+
+
+def fit_telemetry(path, **kw):
+    """
+    fit_batch on a telemetry.py log (uses t, theta and tau_nm).
+    """
+    from telemetry import read_telemetry
+
+    log = read_telemetry(path)
+    return fit_batch(log["t"], log["theta"].astype(float), log["tau_nm"].astype(float), **kw)
+
+
+if __name__ == "__main__":
+    import sys
+    import time
+
+    if len(sys.argv) > 1:
+        est = fit_telemetry(sys.argv[1])
+        print(f"[ID] {sys.argv[1]}: I_s={est['I_s']:.5f} kg·m² | b={est['b']:.5f} N·m·s | "
+              f"m·g·l={est['mgl']:.4f} N·m")
+        sys.exit(0)
+
+    import pendulum_sim as sim
+    from excitation import multisine
+    from lqr import pendulum_gains
+
+    params = sim.PendulumParams()
+    dt = 0.001
+    n = 20000
+    K = pendulum_gains(params, dt=dt)
+    probe = multisine(n, dt, np.linspace(0.5, 20.0, 40), amplitude=1.0, seed=None)
+    step = 2.0 * math.pi / (255 * 64)          # "split" encoder resolution
+    plant = sim.Plant(params, theta0=0.02)
+    ident = OnlineIdentifier()
+    t_log = np.empty(n)
+    th_log = np.empty(n)
+    tau_log = np.empty(n)
+    tau = 0.0
+    cost = 0.0
+    for k in range(n):
+        t = k * dt
+        plant.set_torque(t, tau)
+        theta = round(plant.theta / step) * step
+        t0 = time.perf_counter()
+        ident.update(t, theta, plant.tau)
+        cost += time.perf_counter() - t0
+        t_log[k], th_log[k], tau_log[k] = t, theta, plant.tau
+        tau = -(K[0] * plant.theta + K[1] * plant.theta_dot + K[2] * plant.wheel_vel) + probe.next()
+
+    truth = {"I_s": params.I_s, "b": params.b, "mgl": params.mass * params.g * params.length}
+    online = ident.estimates()
+    t0 = time.perf_counter()
+    batch = fit_batch(t_log, th_log, tau_log)
+    t_batch = time.perf_counter() - t0
+    print(f"{n} ticks, LQR + multisine probe, quantized encoder angle")
+    for name in ("I_s", "b", "mgl"):
+        print(f"  {name:4s} truth {truth[name]:9.5f} | online {online[name]:9.5f} | batch {batch[name]:9.5f}")
+    print(f"online: {cost / n * 1e6:.2f} us/tick mean ({ident.samples} RLS steps) | "
+          f"batch: {t_batch * 1e3:.1f} ms for the whole log")
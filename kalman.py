@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+# Closed-Form 2-State Kalman Filter (theta, omega)
+# - Constant-velocity model, position measurement (same as new_Main.py had)
+# - KalmanFilter1D: scalar arithmetic on __slots__ floats, no NumPy arrays
+#   or matrix inverses per step
+# - kalman_batch: filters a whole trace, or many traces at once, in one call
+#
+# With F = [[1, dt], [0, 1]], H = [1, 0] and P kept symmetric
+# (p00, p01, p11), predict/update reduce to:
+#   predict:  p00 += dt*(2*p01 + dt*p11) + q_theta
+#             p01 += dt*p11
+#             p11 += q_omega
+#   update:   s = p00 + r,  k0 = p00/s,  k1 = p01/s
+#             p00 -= k0*p00,  p01 -= k0*p01,  p11 -= k1*p01
+#
+# Usage: python kalman.py   (benchmarks against the matrix version)
+
+# =========================
+# ===== IMPLEMENTATION ====
+# =========================
+
+class KalmanFilter1D:
+    """
+    Drop-in for the old new_Main.KalmanFilter1D: same constructor,
+    initialize/predict/update and theta/omega properties.
+    """
+    __slots__ = ("theta", "omega", "p00", "p01", "p11",
+                 "q_theta", "q_omega", "r_meas", "initialized")
+
+    def __init__(self, q_theta=1e-3, q_omega=5e-2, r_meas=1e-2):
+        self.theta = 0.0
+        self.omega = 0.0
+        self.p00 = 1.0
+        self.p01 = 0.0
+        self.p11 = 1.0
+        self.q_theta = q_theta
+        self.q_omega = q_omega
+        self.r_meas = r_meas
+        self.initialized = False
+
+    def initialize(self, theta0):
+        self.theta = theta0
+        self.omega = 0.0
+        self.initialized = True
+
+    def predict(self, dt):
+        if not self.initialized:
+            return
+        p01, p11 = self.p01, self.p11
+        self.theta += dt * self.omega
+        self.p00 += dt * (2.0 * p01 + dt * p11) + self.q_theta
+        self.p01 = p01 + dt * p11
+        self.p11 = p11 + self.q_omega
+
+    def update(self, z):
+        if not self.initialized:
+            self.initialize(z)
+            return
+        p00, p01 = self.p00, self.p01
+        s = p00 + self.r_meas
+        k0 = p00 / s
+        k1 = p01 / s
+        y = z - self.theta
+        self.theta += k0 * y
+        self.omega += k1 * y
+        self.p00 = p00 - k0 * p00
+        self.p01 = p01 - k0 * p01
+        self.p11 -= k1 * p01
+
+
+def kalman_batch(z, dt, q_theta=1e-3, q_omega=5e-2, r_meas=1e-2, theta0=None):
+    """
+    Filter measurement traces in one call.
+
+    z is (T,) for one trace or (M, T) for M traces; dt is a scalar, a (T,)
+    array shared by all traces, or (M, T). Each step is predict(dt[k]) then
+    update(z[k]), matching the controller loop; the filter starts initialized
+    at theta0 (default z[:, 0]) with P = I.
+    Returns (theta, omega) with the same shape as z.
+    """
+    import numpy as np      # only the batch path needs it; controllers import this module
+
+    z = np.asarray(z, dtype=float)
+    single = z.ndim == 1
+    z2 = z[None, :] if single else z
+    m, t_len = z2.shape
+    dt2 = np.broadcast_to(np.asarray(dt, dtype=float), (m, t_len))
+
+    theta = np.array(z2[:, 0] if theta0 is None else np.broadcast_to(theta0, (m,)), dtype=float)
+    omega = np.zeros(m)
+    p00 = np.ones(m)
+    p01 = np.zeros(m)
+    p11 = np.ones(m)
+    out_theta = np.empty((m, t_len))
+    out_omega = np.empty((m, t_len))
+
+    # Work buffers reused every step
+    s = np.empty(m)
+    k0 = np.empty(m)
+    k1 = np.empty(m)
+    y = np.empty(m)
+    tmp = np.empty(m)
+
+    for k in range(t_len):
+        h = dt2[:, k]
+        # predict
+        np.multiply(h, omega, out=tmp)
+        theta += tmp
+        np.multiply(h, p11, out=tmp)          # dt*p11
+        p00 += h * (2.0 * p01 + tmp) + q_theta
+        p01 += tmp
+        p11 += q_omega
+        # update
+        np.add(p00, r_meas, out=s)
+        np.divide(p00, s, out=k0)
+        np.divide(p01, s, out=k1)
+        np.subtract(z2[:, k], theta, out=y)
+        theta += k0 * y
+        omega += k1 * y
+        np.multiply(k1, p01, out=tmp)
+        p11 -= tmp
+        p00 -= k0 * p00
+        p01 -= k0 * p01
+        out_theta[:, k] = theta
+        out_omega[:, k] = omega
+
+    if single:
+        return out_theta[0], out_omega[0]
+    return out_theta, out_omega
+
+
+if __name__ == "__main__":
+    import time
+
+    import numpy as np
+
+    class MatrixKalmanFilter1D:
+        """The matrix version new_Main.py used before, kept as a reference."""
+
+        def __init__(self, q_theta=1e-3, q_omega=5e-2, r_meas=1e-2):
+            self.x = np.zeros((2, 1))
+            self.P = np.eye(2)
+            self.Q = np.array([[q_theta, 0], [0, q_omega]])
+            self.R = np.array([[r_meas]])
+            self.H = np.array([[1, 0]])
+            self.initialized = False
+
+        def initialize(self, theta0):
+            self.x[0, 0] = theta0
+            self.x[1, 0] = 0
+            self.initialized = True
+
+        def predict(self, dt):
+            F = np.array([[1, dt], [0, 1]])
+            self.x = F @ self.x
+            self.P = F @ self.P @ F.T + self.Q
+
+        def update(self, z):
+            z_vec = np.array([[z]])
+            S = self.H @ self.P @ self.H.T + self.R
+            K = self.P @ self.H.T @ np.linalg.inv(S)
+            self.x = self.x + K @ (z_vec - self.H @ self.x)
+            self.P = (np.eye(2) - K @ self.H) @ self.P
+
+    N_STEPS = 20000
+    DT = 0.001
+    rng = np.random.default_rng(0)
+    t = np.arange(N_STEPS) * DT
+    z = 0.2 * np.sin(2.0 * np.pi * 0.5 * t) + rng.normal(0.0, 0.01, N_STEPS)
+    z_list = z.tolist()
+
+    def run(cls):
+        kf = cls()
+        kf.initialize(z_list[0])
+        t0 = time.perf_counter()
+        for zk in z_list:
+            kf.predict(DT)
+            kf.update(zk)
+        per_step = (time.perf_counter() - t0) / N_STEPS
+        return kf, per_step
+
+    ref, ref_step = run(MatrixKalmanFilter1D)
+    fast, fast_step = run(KalmanFilter1D)
+    batch_theta, batch_omega = kalman_batch(z, DT)
+
+    t0 = time.perf_counter()
+    kalman_batch(np.tile(z, (1000, 1)), DT)
+    batch_step = (time.perf_counter() - t0) / (1000 * N_STEPS)
+
+    print(f"matrix KF      : {ref_step * 1e6:7.2f} us/step")
+    print(f"closed-form KF : {fast_step * 1e6:7.2f} us/step ({ref_step / fast_step:.0f}x faster)")
+    print(f"batch, 1000 tr : {batch_step * 1e6:7.3f} us/step/trace")
+    print(f"final theta diff, matrix vs closed-form: {abs(ref.x[0, 0] - fast.theta):.2e}, "
+          f"vs batch: {abs(ref.x[0, 0] - batch_theta[-1]):.2e}")
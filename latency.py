@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+# Per-Stage Latency Instrumentation for the Control Loop
+# - StageProfiler.mark(stage, t) times one pipeline stage with a single
+#   perf_counter_ns() call and one histogram increment
+# - Fixed-memory log-bucketed histograms (8 buckets per power of two,
+#   ≤12.5% bucket width) from 1 ns to ~17 s, so a 600 s run costs the same
+#   memory as a 1 s run
+# - Dumped at exit and on SIGUSR1: count, mean, p50/p99/p99.9/max per stage
+#
+# Usage in a controller:
+#     prof = StageProfiler(latency.PIPELINE_STAGES)
+#     install_dump_handlers(prof)
+#     ...each tick:
+#     t = prof.begin()
+#     raw = read_raw_angle();  t = prof.mark(latency.ENCODER, t)
+#     ...
+#     odrive.set_torque(u);    t = prof.mark(latency.CAN_SEND, t)
+#     prof.end_tick()
+
+import atexit
+import signal
+import sys
+import time
+from array import array
+
+# =========================
+# ====== USER CONFIG ======
+# =========================
+
+# Stages of the sense-estimate-control-actuate pipeline shared by the scripts
+PIPELINE_STAGES = ("encoder", "unwrap", "estimator", "velocity", "control", "can_send", "telemetry")
+ENCODER, UNWRAP, ESTIMATOR, VELOCITY, CONTROL, CAN_SEND, TELEMETRY = range(len(PIPELINE_STAGES))
+
+# =========================
+# ===== IMPLEMENTATION ====
+# =========================
+
+SUB_BITS = 3
+SUB = 1 << SUB_BITS
+MAX_BITS = 34                                  # 2**34 ns ≈ 17 s
+N_BUCKETS = (MAX_BITS - SUB_BITS) * SUB + SUB
+
+
+def bucket_index(ns):
+    """
+    Histogram bucket for a duration in ns: exact below 2*SUB, then SUB
+    buckets per power of two.
+    """
+    if ns < 2 * SUB:
+        return ns if ns > 0 else 0
+    shift = ns.bit_length() - SUB_BITS - 1
+    idx = shift * SUB + (ns >> shift)
+    return idx if idx < N_BUCKETS else N_BUCKETS - 1
+
+
+def bucket_upper(idx):
+    """
+    Exclusive upper bound of a bucket, in ns.
+    """
+    if idx < 2 * SUB:
+        return idx + 1
+    shift = idx // SUB - 1
+    return (SUB + idx % SUB + 1) << shift
+
+
+class LogHistogram:
+    """
+    Fixed-size log-bucketed histogram of ns durations.
+    """
+    __slots__ = ("counts", "n", "total", "max")
+
+    def __init__(self):
+        self.counts = array("Q", bytes(8 * N_BUCKETS))
+        self.n = 0
+        self.total = 0
+        self.max = 0
+
+    def record(self, ns):
+        self.counts[bucket_index(ns)] += 1
+        self.n += 1
+        self.total += ns
+        if ns > self.max:
+            self.max = ns
+
+    def percentile(self, p):
+        """
+        Upper bound of the bucket holding the p-th percentile, in ns.
+        """
+        if self.n == 0:
+            return 0
+        target = p / 100.0 * self.n
+        seen = 0
+        for idx, c in enumerate(self.counts):
+            seen += c
+            if c and seen >= target:
+                return min(bucket_upper(idx), self.max)
+        return self.max
+
+    def summary(self):
+        return {
+            "count": self.n,
+            "mean_us": self.total / self.n / 1e3 if self.n else 0.0,
+            "p50_us": self.percentile(50) / 1e3,
+            "p99_us": self.percentile(99) / 1e3,
+            "p999_us": self.percentile(99.9) / 1e3,
+            "max_us": self.max / 1e3,
+        }
+
+
+class StageProfiler:
+    """
+    One LogHistogram per named stage plus one for the whole tick.
+    """
+
+    def __init__(self, stages):
+        self.stages = tuple(stages)
+        self.hists = [LogHistogram() for _ in self.stages]
+        self.tick = LogHistogram()
+        self._tick_start = 0
+        self._now = time.perf_counter_ns
+
+    def begin(self):
+        t = self._now()
+        self._tick_start = t
+        return t
+
+    def mark(self, stage, t_start):
+        """
+        Record now - t_start against stage (index), return now so calls chain.
+        """
+        t = self._now()
+        self.hists[stage].record(t - t_start)
+        return t
+
+    def end_tick(self):
+        self.tick.record(self._now() - self._tick_start)
+
+    def report(self):
+        rows = [("stage", "count", "mean", "p50", "p99", "p99.9", "max")]
+        for name, hist in zip(self.stages + ("TICK",), self.hists + [self.tick]):
+            if hist.n == 0 and hist is not self.tick:
+                continue      # stage not instrumented in this loop
+            s = hist.summary()
+            rows.append((name, str(s["count"]),
+                         *(f"{s[k]:.1f}" for k in ("mean_us", "p50_us", "p99_us", "p999_us", "max_us"))))
+        widths = [max(len(r[i]) for r in rows) for i in range(len(rows[0]))]
+        lines = ["[LATENCY] per-stage times in us"]
+        for r in rows:
+            lines.append("  " + "  ".join(c.rjust(w) for c, w in zip(r, widths)))
+        return "\n".join(lines)
+
+    def dump(self, stream=None):
+        print(self.report(), file=stream or sys.stderr, flush=True)
+
+
+_atexit_dump = None      # the dump registered by install_dump_handlers, if any
+
+
+def install_dump_handlers(profiler, sig=getattr(signal, "SIGUSR1", None)):
+    """
+    Dump the profiler at interpreter exit and whenever `sig` arrives
+    (kill -USR1 <pid>). Signal handlers can only be set from the main thread.
+    Each call replaces the previous call's handlers, so a process that loads
+    a script several times (replay, sim rigs) dumps only the latest profiler.
+    """
+    global _atexit_dump
+    if _atexit_dump is not None:
+        atexit.unregister(_atexit_dump)
+    _atexit_dump = profiler.dump
+    atexit.register(_atexit_dump)
+    if sig is not None:
+        try:
+            signal.signal(sig, lambda signum, frame: profiler.dump())
+        except ValueError:
+            pass
+
+
+if __name__ == "__main__":
+    prof = StageProfiler(("sleep_100us", "sum_1k"))
+    for _ in range(2000):
+        t = prof.begin()
+        time.sleep(100e-6)
+        t = prof.mark(0, t)
+        sum(range(1000))
+        t = prof.mark(1, t)
+        prof.end_tick()
+    prof.dump(sys.stdout)
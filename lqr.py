@@ -0,0 +1,276 @@
+#!/usr/bin/env python3
+# LQR Gain Synthesis and Gain-Schedule Lookup Table
+# - Linear model of pendulum + wheel from physical parameters, states
+#   x = [theta, theta_dot, wheel_rate], input = motor torque (Nm, or A via Kt)
+#   (MATLAB A = [0 1; -g*m*l, -b/I_s] extended with the wheel)
+# - Continuous (CARE) and discrete (DARE) Riccati solvers in plain NumPy;
+#   SciPy's are used when installed
+# - Offline gain schedule over |theta|: the gravity term is linearized with
+#   the secant g*m*l*sin(theta)/theta, one LQR per grid point, stored in a
+#   dense table with O(1) interpolated lookup for the control loop
+#
+# Usage: python lqr.py   (builds gain_schedule.npz for AIMain.py)
+
+import math
+
+import numpy as np
+
+from pendulum_sim import PendulumParams
+
+# =========================
+# ====== USER CONFIG ======
+# =========================
+
+# Bryson's rule weights: 1 / (largest acceptable value)^2
+THETA_MAX = 0.05          # rad
+THETA_DOT_MAX = 1.0       # rad/s
+WHEEL_RATE_MAX = 200.0    # rad/s
+TORQUE_MAX = 2.0          # Nm
+
+SCHEDULE_THETA_MAX = 0.6  # rad, schedule covers |theta| in [0, this]
+SCHEDULE_POINTS = 1024
+SCHEDULE_PATH = "gain_schedule.npz"
+
+# =========================
+# ======== MODEL ==========
+# =========================
+
+def linear_model(params=PendulumParams(), theta0=0.0):
+    """
+    (A, B) for x = [theta, theta_dot, wheel_rate], u = motor torque in Nm,
+    with the gravity term linearized by the secant slope at theta0.
+    """
+    p = params
+    sinc = math.sin(theta0) / theta0 if theta0 != 0.0 else 1.0
+    k = p.g * p.mass * p.length * sinc
+    A = np.array([
+        [0.0, 1.0, 0.0],
+        [k / p.I_s, -p.b / p.I_s, p.b_w / p.I_s],
+        [-k / p.I_s, p.b / p.I_s, -p.b_w / p.I_w - p.b_w / p.I_s],
+    ])
+    B = np.array([[0.0], [-1.0 / p.I_s], [1.0 / p.I_w + 1.0 / p.I_s]])
+    return A, B
+
+
+def default_weights():
+    Q = np.diag([1.0 / THETA_MAX ** 2, 1.0 / THETA_DOT_MAX ** 2, 1.0 / WHEEL_RATE_MAX ** 2])
+    R = np.array([[1.0 / TORQUE_MAX ** 2]])
+    return Q, R
+
+
+def expm(M):
+    """
+    Matrix exponential by scaling and squaring with a Taylor series
+    (fine for the small, well-scaled matrices used here).
+    """
+    norm = np.linalg.norm(M, 1)
+    s = max(0, int(math.ceil(math.log2(norm))) + 1) if norm > 0.5 else 0
+    X = M / (2 ** s)
+    E = np.eye(M.shape[0])
+    term = np.eye(M.shape[0])
+    for k in range(1, 18):
+        term = term @ X / k
+        E = E + term
+    for _ in range(s):
+        E = E @ E
+    return E
+
+
+def c2d(A, B, dt):
+    """
+    Zero-order-hold discretization (Ad, Bd).
+    """
+    n, m = B.shape
+    M = np.zeros((n + m, n + m))
+    M[:n, :n] = A
+    M[:n, n:] = B
+    E = expm(M * dt)
+    return E[:n, :n], E[:n, n:]
+
+
+# =========================
+# ===== RICCATI / LQR =====
+# =========================
+
+def solve_care(A, B, Q, R):
+    """
+    Continuous algebraic Riccati equation A'P + PA - PBR^-1B'P + Q = 0,
+    from the stable invariant subspace of the Hamiltonian.
+    """
+    try:
+        from scipy.linalg import solve_continuous_are
+        return solve_continuous_are(A, B, Q, R)
+    except ImportError:
+        pass
+    n = A.shape[0]
+    G = B @ np.linalg.solve(R, B.T)
+    H = np.block([[A, -G], [-Q, -A.T]])
+    w, V = np.linalg.eig(H)
+    stable = V[:, w.real < 0]
+    U1, U2 = stable[:n], stable[n:]
+    P = np.real(U2 @ np.linalg.inv(U1))
+    return 0.5 * (P + P.T)
+
+
+def solve_dare(Ad, Bd, Q, R, tol=1e-12, max_iter=100):
+    """
+    Discrete algebraic Riccati equation by the structured doubling
+    algorithm (quadratic convergence).
+    """
+    try:
+        from scipy.linalg import solve_discrete_are
+        return solve_discrete_are(Ad, Bd, Q, R)
+    except ImportError:
+        pass
+    n = Ad.shape[0]
+    I = np.eye(n)
+    Ak = Ad.copy()
+    Gk = Bd @ np.linalg.solve(R, Bd.T)
+    Hk = Q.copy()
+    for _ in range(max_iter):
+        W = np.linalg.inv(I + Gk @ Hk)
+        A_next = Ak @ W @ Ak
+        G_next = Gk + Ak @ W @ Gk @ Ak.T
+        H_next = Hk + Ak.T @ Hk @ W @ Ak
+        done = np.linalg.norm(H_next - Hk, 1) <= tol * max(1.0, np.linalg.norm(H_next, 1))
+        Ak, Gk, Hk = A_next, G_next, H_next
+        if done:
+            break
+    return 0.5 * (Hk + Hk.T)
+
+
+def lqr(A, B, Q, R):
+    """
+    Continuous-time LQR gain K (u = -K x).
+    """
+    P = solve_care(A, B, Q, R)
+    return np.linalg.solve(R, B.T @ P)
+
+
+def dlqr(Ad, Bd, Q, R):
+    """
+    Discrete-time LQR gain K (u[k] = -K x[k]).
+    """
+    P = solve_dare(Ad, Bd, Q, R)
+    return np.linalg.solve(R + Bd.T @ P @ Bd, Bd.T @ P @ Ad)
+
+
+def pendulum_gains(params=PendulumParams(), dt=None, theta0=0.0, Q=None, R=None, units="Nm"):
+    """
+    LQR gains (k_theta, k_theta_dot, k_wheel) so that
+        tau = -(k_theta*theta + k_theta_dot*theta_dot + k_wheel*wheel_rate)
+    i.e. AIMain's (Kp, Kd, Kw). dt=None gives the continuous design, else the
+    discrete design for that loop period. units="A" divides by params.Kt.
+    """
+    if Q is None or R is None:
+        Q0, R0 = default_weights()
+        Q = Q0 if Q is None else Q
+        R = R0 if R is None else R
+    A, B = linear_model(params, theta0)
+    if dt is None:
+        K = lqr(A, B, Q, R)
+    else:
+        Ad, Bd = c2d(A, B, dt)
+        K = dlqr(Ad, Bd, Q, R)
+    K = K.ravel()
+    if units == "A":
+        K = K / params.Kt
+    return tuple(float(k) for k in K)
+
+
+# =========================
+# ===== GAIN SCHEDULE =====
+# =========================
+
+class GainSchedule:
+    """
+    Dense table of gains over |theta| with O(1) linear interpolation.
+    lookup() is pure Python on lists, cheap enough for every tick.
+    """
+    __slots__ = ("theta_max", "inv_step", "last", "_rows")
+
+    def __init__(self, theta_grid, table):
+        theta_grid = np.asarray(theta_grid, dtype=float)
+        self.theta_max = float(theta_grid[-1])
+        self.inv_step = (len(theta_grid) - 1) / self.theta_max
+        self.last = len(theta_grid) - 1
+        self._rows = [tuple(row) for row in np.asarray(table, dtype=float).tolist()]
+
+    def lookup(self, theta):
+        """
+        (k_theta, k_theta_dot, k_wheel) at |theta|, clamped to the table range.
+        """
+        pos = abs(theta) * self.inv_step
+        i = int(pos)
+        if i >= self.last:
+            return self._rows[self.last]
+        f = pos - i
+        a = self._rows[i]
+        b = self._rows[i + 1]
+        return (a[0] + f * (b[0] - a[0]),
+                a[1] + f * (b[1] - a[1]),
+                a[2] + f * (b[2] - a[2]))
+
+    def save(self, path=SCHEDULE_PATH):
+        grid = np.linspace(0.0, self.theta_max, self.last + 1)
+        np.savez(path, theta=grid, gains=np.array(self._rows))
+
+    @classmethod
+    def load(cls, path=SCHEDULE_PATH):
+        data = np.load(path)
+        return cls(data["theta"], data["gains"])
+
+
+def build_schedule(params=PendulumParams(), dt=None, theta_max=SCHEDULE_THETA_MAX,
+                   points=SCHEDULE_POINTS, Q=None, R=None, units="Nm"):
+    """
+    Solve one LQR per |theta| grid point (secant-linearized gravity).
+    """
+    grid = np.linspace(0.0, theta_max, points)
+    table = np.array([pendulum_gains(params, dt, th, Q, R, units) for th in grid])
+    return GainSchedule(grid, table)
+
+
+if __name__ == "__main__":
+    import time
+
+    import pendulum_sim as sim
+
+    params = PendulumParams()
+    A, B = linear_model(params)
+    ctrb = np.hstack([B, A @ B, A @ A @ B])
+    print(f"open-loop poles: {np.round(np.linalg.eigvals(A), 3)} | "
+          f"controllability rank {np.linalg.matrix_rank(ctrb)}")
+
+    K = pendulum_gains(params)
+    Kd_ = pendulum_gains(params, dt=0.001)
+    print(f"continuous LQR (Kp, Kd, Kw) = ({K[0]:.3f}, {K[1]:.3f}, {K[2]:.4f})")
+    print(f"discrete LQR @1 kHz         = ({Kd_[0]:.3f}, {Kd_[1]:.3f}, {Kd_[2]:.4f})")
+
+    t0 = time.perf_counter()
+    sched = build_schedule(params, dt=0.001)
+    print(f"schedule: {SCHEDULE_POINTS} points over |θ| ≤ {SCHEDULE_THETA_MAX} rad "
+          f"built in {time.perf_counter() - t0:.2f} s")
+    sched.save(SCHEDULE_PATH)
+    print(f"saved {SCHEDULE_PATH}")
+
+    n = 100000
+    t0 = time.perf_counter()
+    for i in range(n):
+        sched.lookup(i * 1e-5)
+    print(f"lookup: {(time.perf_counter() - t0) / n * 1e9:.0f} ns/call")
+
+    # Closed-loop check on the nonlinear simulator
+    x0 = sim.initial_states(1000, theta_span=0.3, theta_dot_span=0.5, seed=0)
+    rows = np.array(sched._rows)
+
+    def scheduled(t, x):
+        pos = np.minimum(np.abs(x[:, sim.THETA]) * sched.inv_step, sched.last)
+        i = np.minimum(pos.astype(int), sched.last - 1)
+        f = (pos - i)[:, None]
+        k = rows[i] + f * (rows[i + 1] - rows[i])
+        return -(k[:, 0] * x[:, sim.THETA] + k[:, 1] * x[:, sim.THETA_DOT]
+                 + k[:, 2] * x[:, sim.WHEEL_VEL])
+
+    res = sim.simulate(scheduled, x0, duration=5.0, params=params, record_every=100)
+    print(f"scheduled LQR on simulator: balanced {sim.success_mask(res).sum()}/{len(x0)}")
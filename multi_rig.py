@@ -0,0 +1,335 @@
+#!/usr/bin/env python3
+# Multi-Rig Runner
+# - Runs any number of pendulum rigs from one host. Each rig is a RigSpec
+#   (CAN bus, ODrive node id, I2C bus, encoder address, controller, gains)
+#   and gets its own controller task, estimator, telemetry file and estop;
+#   a fault or fall on one rig stops only that rig
+# - Rigs run as tasks on one event loop, or split across worker processes
+#   (one event loop each) with workers > 1
+# - Scaling benchmark: N simulated rigs paced in real (wall-clock) time,
+#   doubling N until the 1 kHz deadlines start slipping
+#
+# Usage: python multi_rig.py --bench [--seconds 3] [--i2c-us 120] [--workers 1]
+#        python multi_rig.py --hardware [--rig rig0 --rig rig1] [--seconds 60]   (rigs from RIGS)
+
+import asyncio
+import math
+from concurrent.futures import ProcessPoolExecutor
+from typing import NamedTuple
+
+from encoder import AS5048Reader, Unwrapper
+from gains import load_gains
+from kalman import KalmanFilter1D
+from odrive_can import wheel_feedback
+from scheduler import DeadlineScheduler
+from startup import odrive_ready, stable_rest
+from telemetry import Telemetry, FLAG_SATURATED, FLAG_ESTOP, FLAG_INVALID, FLAG_STALE
+
+# =========================
+# ====== USER CONFIG ======
+# =========================
+
+CONTROL_DT = 0.001          # s, per rig
+TORQUE_LIMIT_NM = 10.0
+FALLBACK_ANGLE = 0.6        # rad, a rig past this is e-stopped
+ZERO_SETTLE_S = 0.25        # held still this long before the zero reading
+# Stale (or not yet received) wheel feedback gates the wheel term off; older
+# than this, the rig is e-stopped
+WHEEL_STALE_ESTOP_S = 0.1
+
+# Rate estimator, in rad: r from the "split" format's 1/255-turn step
+# (step^2 / 12), q_omega from ~50 rad/s^2 of unmodelled acceleration per tick
+KF_Q_THETA = 1e-8
+KF_Q_OMEGA = 2.5e-3
+KF_R_MEAS = 5e-5
+
+RATE_BUDGET = 0.98          # benchmark: a rig count is sustained while every rig keeps 98% of its rate
+
+# =========================
+# ===== RIG SPEC ==========
+# =========================
+
+class RigSpec(NamedTuple):
+    name: str
+    can_bus: str = "can0"
+    node_id: int = 0
+    i2c_bus: int = 1
+    enc_addr: int = 0x40
+    controller: str = "lqr"          # one of CONTROLLERS
+    gains: dict = {}
+    enc_format: str = "split"
+    velocity_units: str = "turns_s"  # what odrive.velocity reports
+    telemetry: bool = True
+
+
+# Real rigs for --hardware: one entry per pendulum, with its CAN bus, ODrive
+# node id, I2C bus and encoder address  <-- edit for your setup
+RIGS = [
+    RigSpec("rig0", can_bus="can0", node_id=0, i2c_bus=1, enc_addr=0x40),
+    RigSpec("rig1", can_bus="can0", node_id=1, i2c_bus=1, enc_addr=0x41),
+]
+
+
+def _pd_wheel(gains):
+    g = load_gains("pd_wheel", **{"Kp": -120.0, "Kd": -20.0, "Kw": 10.0, **gains})
+    Kp, Kd, Kw = g["Kp"], g["Kd"], g["Kw"]
+    return lambda theta, theta_dot, wheel_rate: -(Kp * theta + Kd * theta_dot + Kw * wheel_rate)
+
+
+def _lqr(gains):
+    from lqr import pendulum_gains
+    Kp, Kd, Kw = pendulum_gains(dt=CONTROL_DT)
+    Kp, Kd, Kw = gains.get("Kp", Kp), gains.get("Kd", Kd), gains.get("Kw", Kw)
+    return lambda theta, theta_dot, wheel_rate: -(Kp * theta + Kd * theta_dot + Kw * wheel_rate)
+
+
+def _sliding(gains):
+    g = load_gains("sliding", **{"C": 3.0, **gains})
+    C, amplitude = g["C"], gains.get("amplitude", TORQUE_LIMIT_NM)
+    return lambda theta, theta_dot, wheel_rate: math.copysign(amplitude, theta + C * theta_dot)
+
+
+# name -> gains dict -> law(theta, theta_dot, wheel_rate) -> tau (Nm)
+CONTROLLERS = {
+    "pd_wheel": _pd_wheel,
+    "lqr": _lqr,
+    "sliding": _sliding,
+}
+
+# =========================
+# ===== PER-RIG TASK ======
+# =========================
+
+async def run_rig(spec, odrive, bus, seconds):
+    """
+    One rig's controller: zero at rest, then Kalman-filtered angle and rate
+    into the spec's law at CONTROL_DT until `seconds` pass or the rig falls.
+    Errors are caught and reported in the result dict with the rig's
+    scheduling stats; cancellation and Ctrl-C e-stop the rig and propagate.
+    """
+    law = CONTROLLERS[spec.controller](dict(spec.gains))
+    enc = AS5048Reader(bus, spec.enc_addr, spec.enc_format)
+    wheel_scale = 2.0 * math.pi if spec.velocity_units == "turns_s" else 1.0
+    telem = Telemetry(f"telemetry_{spec.name}.bin") if spec.telemetry else None
+    sched = DeadlineScheduler(CONTROL_DT)
+    result = {"name": spec.name, "fell": False, "error": None}
+
+    try:
+        odrive.clear_errors(identify=False)
+        odrive.initCanBus()
+        await odrive_ready(odrive)
+        odrive.set_controller_mode("torque_control")
+        rest = await stable_rest(enc.read, window_s=ZERO_SETTLE_S)
+        unwrap = Unwrapper(initial=rest)
+        kf = KalmanFilter1D(q_theta=KF_Q_THETA, q_omega=KF_Q_OMEGA, r_meas=KF_R_MEAS)
+        kf.initialize(0.0)
+        loop = asyncio.get_running_loop()
+        t_prev = loop.time()
+        wheel_held = 0.0
+        sched.start()
+
+        while sched.elapsed < seconds:
+            turns = enc.read()
+            t_now = loop.time()
+            dt = max(1e-4, t_now - t_prev)
+            t_prev = t_now
+            kf.predict(dt)
+            if turns is not None:       # invalid samples: predict only
+                kf.update(2.0 * math.pi * (unwrap.update(turns) - rest))
+            theta, theta_dot = kf.theta, kf.omega
+            wheel_vel, wheel_age, wheel_stale = wheel_feedback(odrive)
+            if not wheel_stale:
+                wheel_held = wheel_vel * wheel_scale
+            elif wheel_age > WHEEL_STALE_ESTOP_S:
+                odrive.estop()
+                result["error"] = f"wheel feedback {wheel_age * 1e3:.0f} ms old"
+                break
+            wheel_rate = wheel_held
+
+            tau = law(theta, theta_dot, 0.0 if wheel_stale else wheel_rate)
+            flags = FLAG_SATURATED if abs(tau) > TORQUE_LIMIT_NM else 0
+            if turns is None:
+                flags |= FLAG_INVALID
+            if wheel_stale:
+                flags |= FLAG_STALE
+            tau = max(-TORQUE_LIMIT_NM, min(TORQUE_LIMIT_NM, tau))
+
+            if abs(theta) > FALLBACK_ANGLE:
+                odrive.estop()
+                result["fell"] = True
+                if telem is not None:
+                    telem.log(t_now, theta, theta_dot, wheel_rate, 0.0, 0.0, dt, flags | FLAG_ESTOP)
+                break
+
+            odrive.set_torque(tau)
+            if telem is not None:
+                telem.log(t_now, theta, theta_dot, wheel_rate, tau, tau, dt, flags)
+            await sched.wait_next()
+    except Exception as e:      # isolate the fault to this rig
+        result["error"] = repr(e)
+        try:
+            odrive.estop()
+        except Exception:
+            pass
+    except BaseException:       # cancelled or interrupted: leave the rig stopped
+        try:
+            odrive.estop()
+        except Exception:
+            pass
+        raise
+    finally:
+        if telem is not None:
+            telem.close()
+    result.update(sched.stats())
+    result["invalid_samples"] = enc.invalid
+    return result
+
+
+async def run_rigs(specs, seconds, make_io):
+    """
+    Run every rig as its own task on this loop. make_io(spec) returns the
+    rig's (odrive, bus). Each ODrive's feedback loop runs alongside.
+    """
+    io = [make_io(spec) for spec in specs]
+    feedback = [asyncio.ensure_future(odrive.loop()) for odrive, _ in io]
+    try:
+        return await asyncio.gather(*(run_rig(spec, odrive, bus, seconds)
+                                       for spec, (odrive, bus) in zip(specs, io)))
+    finally:
+        for task in feedback:
+            task.cancel()
+        await asyncio.gather(*feedback, return_exceptions=True)
+
+
+# =========================
+# ===== HARDWARE I/O ======
+# =========================
+
+_BUSES = {}
+
+
+def hardware_io(spec):
+    """
+    Real ODrive on spec.can_bus/node_id; the SMBus handle is shared by every
+    rig on the same I2C bus number.
+    """
+    import pyodrivecan
+    import smbus
+
+    bus = _BUSES.get(spec.i2c_bus)
+    if bus is None:
+        bus = _BUSES[spec.i2c_bus] = smbus.SMBus(spec.i2c_bus)
+    return pyodrivecan.ODriveCAN(spec.node_id, canBusID=spec.can_bus), bus
+
+
+# =========================
+# ===== SIMULATED I/O =====
+# =========================
+
+def sim_io_factory(i2c_s=None, theta0=0.05):
+    """
+    make_io for rigs backed by sim_hardware's plant, paced in real time.
+    """
+    from sim_hardware import SimRig, RealClock, I2C_READ_S
+
+    clock = RealClock()
+
+    def make_io(spec):
+        rig = SimRig(theta0=theta0, encoding=spec.enc_format, velocity_units=spec.velocity_units)
+        rig.clock = clock
+        rig.bus.read_cost = I2C_READ_S if i2c_s is None else i2c_s
+        return rig.odrive, rig.bus
+    return make_io
+
+
+def _sim_worker(args):
+    specs, seconds, i2c_s = args
+    return asyncio.run(run_rigs(specs, seconds, sim_io_factory(i2c_s)))
+
+
+def _hardware_worker(args):
+    specs, seconds = args
+    return asyncio.run(run_rigs(specs, seconds, hardware_io))
+
+
+def _run_split(worker, specs, workers, *extra):
+    shares = [specs[i::workers] for i in range(workers)]
+    with ProcessPoolExecutor(workers) as pool:
+        parts = pool.map(worker, [(s, *extra) for s in shares if s])
+        return [r for part in parts for r in part]
+
+
+def run_sim_rigs(specs, seconds, i2c_s=None, workers=1):
+    """
+    Run simulated rigs in real time, across `workers` processes.
+    """
+    if workers <= 1:
+        return asyncio.run(run_rigs(specs, seconds, sim_io_factory(i2c_s)))
+    return _run_split(_sim_worker, specs, workers, seconds, i2c_s)
+
+
+def run_hardware_rigs(specs, seconds, workers=1):
+    """
+    Run real rigs (hardware_io), across `workers` processes.
+    """
+    if workers <= 1:
+        return asyncio.run(run_rigs(specs, seconds, hardware_io))
+    return _run_split(_hardware_worker, specs, workers, seconds)
+
+
+def scaling_benchmark(seconds=3.0, i2c_s=None, workers=1, max_rigs=256):
+    """
+    Double the number of simulated 1 kHz rigs until the slowest rig drops
+    below RATE_BUDGET of its target rate, i.e. deadlines are being skipped
+    rather than met late. Returns [(n_rigs, worst rate, miss fraction,
+    worst p99 lateness in us)].
+    """
+    rows = []
+    n = 1
+    while n <= max_rigs:
+        specs = [RigSpec(f"sim{i}", node_id=i, telemetry=False) for i in range(n)]
+        results = run_sim_rigs(specs, seconds, i2c_s, workers)
+        ticks = sum(r["ticks"] for r in results)
+        misses = sum(r["misses"] for r in results)
+        frac = misses / ticks if ticks else 1.0
+        worst = min(r["rate_hz"] for r in results)
+        rows.append((n, worst, frac, max(r["p99_us"] for r in results)))
+        if worst < RATE_BUDGET / CONTROL_DT:
+            break
+        n *= 2
+    return rows
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Run several rigs from one host.")
+    parser.add_argument("--bench", action="store_true", help="scaling benchmark on simulated rigs")
+    parser.add_argument("--hardware", action="store_true", help="run the real rigs in RIGS")
+    parser.add_argument("--rig", action="append", default=None,
+                        help="with --hardware: only this rig from RIGS (repeatable)")
+    parser.add_argument("--seconds", type=float, default=3.0)
+    parser.add_argument("--i2c-us", type=float, default=None,
+                        help="blocking time per encoder read (default: sim_hardware.I2C_READ_S)")
+    parser.add_argument("--workers", type=int, default=1)
+    args = parser.parse_args()
+    i2c_s = None if args.i2c_us is None else args.i2c_us * 1e-6
+
+    if args.bench:
+        print(f"[RIGS] {1 / CONTROL_DT:.0f} Hz per rig, {args.workers} worker(s), "
+              f"{args.seconds:.0f} s per step (includes the plant simulation's own CPU time)")
+        print("  rigs  min rate Hz  miss %  worst p99 us")
+        for n, rate, frac, p99 in scaling_benchmark(args.seconds, i2c_s, args.workers):
+            print(f"  {n:4d}  {rate:11.1f}  {100 * frac:6.2f}  {p99:12.0f}")
+    else:
+        if args.hardware:
+            specs = [s for s in RIGS if args.rig is None or s.name in args.rig]
+            if not specs:
+                parser.error(f"no rig named {args.rig} in RIGS")
+            results = run_hardware_rigs(specs, args.seconds, args.workers)
+        else:
+            specs = [RigSpec("sim0", node_id=0), RigSpec("sim1", node_id=1, controller="pd_wheel")]
+            results = run_sim_rigs(specs, args.seconds, i2c_s, args.workers)
+        for r in results:
+            print(f"[RIGS] {r['name']}: {r['ticks']} ticks at {r['rate_hz']:.1f} Hz | "
+                  f"misses {r['misses']} | fell={r['fell']} | error={r['error']}")
@@ -1,68 +1,28 @@
 import pyodrivecan
 import asyncio
-import math
-import numpy as np
-from datetime import datetime, timedelta
 import smbus
+from encoder import decode_table, Unwrapper
+from startup import StartupTimer, odrive_ready, stable_rest
+from scheduler import DeadlineScheduler
+import latency
+from latency import StageProfiler, install_dump_handlers
 
 
 ################ ENCODER ################
 bus = smbus.SMBus(1)
+TURNS = decode_table("12bit")
 
 def read_raw_angle():
     """Reads normalized angle in [0, 1)."""
     data = bus.read_i2c_block_data(0x40, 0xFE, 2)
-    raw = ((data[0] << 6) | (data[1] >> 2)) & 0x0FFF
-    return raw / 4096.0
+    return TURNS[(data[0] << 8) | data[1]]
 
 
 
 ################ KALMAN FILTER ################
 
-class KalmanFilter1D:
-    def __init__(self, q_theta=1e-3, q_omega=5e-2, r_meas=1e-2):
-        # states: theta, omega
-        self.x = np.zeros((2, 1))
-        self.P = np.eye(2)
-        self.Q = np.array([[q_theta, 0],
-                           [0, q_omega]])
-        self.R = np.array([[r_meas]])
-        self.H = np.array([[1, 0]])
-        self.initialized = False
-
-    def initialize(self, theta0):
-        self.x[0, 0] = theta0
-        self.x[1, 0] = 0
-        self.initialized = True
-
-    def predict(self, dt):
-        if not self.initialized:
-            return
-        F = np.array([[1, dt],
-                      [0, 1]])
-        self.x = F @ self.x
-        self.P = F @ self.P @ F.T + self.Q
-
-    def update(self, z):
-        if not self.initialized:
-            self.initialize(z)
-            return
-
-        z_vec = np.array([[z]])
-        S = self.H @ self.P @ self.H.T + self.R
-        K = self.P @ self.H.T @ np.linalg.inv(S)
-
-        self.x = self.x + K @ (z_vec - self.H @ self.x)
-        I = np.eye(2)
-        self.P = (I - K @ self.H) @ self.P
-
-    @property
-    def theta(self):
-        return float(self.x[0, 0])
-
-    @property
-    def omega(self):
-        return float(self.x[1, 0])
+# Closed-form scalar version, see kalman.py
+from kalman import KalmanFilter1D
 
 
 
@@ -71,7 +31,8 @@ class KalmanFilter1D:
 async def controller(odrive):
 
     odrive.set_controller_mode("torque_control")
-    stop_at = datetime.now() + timedelta(seconds=10000)
+    run_seconds = 10000
+    loop_dt = 0.001   # 1 kHz, on absolute deadlines
 
     # Gains (SAFE)
     Kp = 2.0
@@ -81,9 +42,8 @@ async def controller(odrive):
 
     rest_pos = read_raw_angle()
 
-    # Unwrap state
-    last_angle = rest_pos
-    hturns = 0
+    # Hysteresis unwrap (more robust)
+    unwrap = Unwrapper(threshold=0.6, initial=rest_pos)
 
     # Kalman filter
     kf = KalmanFilter1D(
@@ -96,12 +56,13 @@ async def controller(odrive):
     loop = asyncio.get_running_loop()
     last_t = loop.time()
 
-    # Hysteresis unwrap thresholds
-    unwrap_low = -0.6
-    unwrap_high = 0.6
+    prof = StageProfiler(latency.PIPELINE_STAGES)
+    install_dump_handlers(prof)
 
-    while datetime.now() < stop_at:
+    sched = DeadlineScheduler(loop_dt)
+    while sched.elapsed < run_seconds:
 
+        ts = prof.begin()
         now_t = loop.time()
         dt = now_t - last_t
         if dt <= 0:
@@ -110,16 +71,9 @@ async def controller(odrive):
 
         # --- Read Encoder ---
         angle = read_raw_angle()
-        diff = angle - last_angle
-
-        # Hysteresis unwrap (more robust)
-        if diff < unwrap_low:
-            hturns += 1
-        elif diff > unwrap_high:
-            hturns -= 1
-
-        raw_pos = angle + hturns
-        last_angle = angle
+        ts = prof.mark(latency.ENCODER, ts)
+        raw_pos = unwrap.update(angle)
+        ts = prof.mark(latency.UNWRAP, ts)
 
         # --- KF update ---
         kf.predict(dt)
@@ -127,19 +81,25 @@ async def controller(odrive):
 
         position = kf.theta
         velocity = kf.omega
+        ts = prof.mark(latency.ESTIMATOR, ts)
 
         # --- Control Law (safe) ---
         error = position - rest_pos
 
         u = Kp * error + Ki * 0 + Kd * 0
         u = max(min(u, max_torque), -max_torque)
+        ts = prof.mark(latency.CONTROL, ts)
 
         odrive.set_torque(u)
+        prof.mark(latency.CAN_SEND, ts)
+        prof.end_tick()
 
         # Debug print (OPTIONAL)
         # print(f"pos={position:.3f} vel={velocity:.3f} u={u:.3f}")
 
-        await asyncio.sleep(0)
+        await sched.wait_next()
+
+    print(sched.report())
 
 
 
@@ -148,19 +108,24 @@ async def controller(odrive):
 odrive = pyodrivecan.ODriveCAN(0)
 
 async def main():
+    timer = StartupTimer()
     odrive.clear_errors(identify=False)
-    await asyncio.sleep(0.5)
-
     odrive.initCanBus()
-    await asyncio.sleep(0.5)
+    feedback = asyncio.ensure_future(odrive.loop())
+    timer.mark("clear_errors + initCanBus")
+    await odrive_ready(odrive)
+    timer.mark("odrive feedback")
 
     print("Zero encoder position...")
+    await stable_rest(read_raw_angle)
+    timer.mark("encoder at rest")
     print(f"ODrive Start Pos: {odrive.position}")
 
     odrive.setAxisState("open_loop_control")
+    print(timer.report())
 
     await asyncio.gather(
-        odrive.loop(),
+        feedback,
         controller(odrive)
     )
 
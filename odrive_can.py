@@ -0,0 +1,486 @@
+#!/usr/bin/env python3
+# Cached, Staleness-Aware ODrive CAN Adapter
+# - Speaks ODrive CANSimple over python-can directly, as a drop-in for the
+#   parts of pyodrivecan.ODriveCAN the scripts use (clear_errors,
+#   initCanBus, loop, set_controller_mode, setAxisState, set_torque, estop,
+#   position, velocity)
+# - The cyclic Get_Encoder_Estimates and Heartbeat messages are consumed on
+#   python-can's Notifier thread into a cache stamped with the receive time;
+#   reading `velocity` never touches the bus, and `stale` / feedback() say
+#   how old the value is instead of it silently turning into 0.0
+# - set_torque skips frames that repeat the last one sent (within
+#   TORQUE_DEADBAND) and, with TX_MIN_INTERVAL_S > 0, coalesces commands
+#   that come faster than that into one frame carrying the newest value.
+#   A frame still goes out at least every TORQUE_REFRESH_S so the ODrive's
+#   input watchdog keeps seeing traffic
+# - bus_stats(): frames/s each way, suppressed/coalesced counts and the
+#   bus load from the frame bit lengths at CAN_BITRATE
+# - VirtualODrive: the drive's side of the protocol (cyclic feedback,
+#   heartbeat, torque in, a spinning wheel) on any python-can bus, so the
+#   adapter runs against python-can's in-process "virtual" interface with
+#   no hardware
+#
+# Usage in a script:
+#     from odrive_can import ODriveAdapter
+#     odrive = ODriveAdapter(0)                  # node 0 on can0
+#     ...
+#     if odrive.stale: ...                       # feedback older than STALE_AFTER_S
+#     vel, age, stale = wheel_feedback(odrive)   # same for any drive object
+#
+# Usage: python odrive_can.py   (adapter vs VirtualODrive on a virtual bus)
+
+import asyncio
+import struct
+import threading
+import time
+
+# =========================
+# ====== USER CONFIG ======
+# =========================
+
+CAN_CHANNEL = "can0"
+CAN_INTERFACE = "socketcan"
+CAN_BITRATE = 250000         # bit/s, must match the interface (`ip link ... bitrate`)
+
+FEEDBACK_PERIOD_S = 0.010    # ODrive encoder-estimate cyclic period (encoder_msg_rate_ms)
+STALE_AFTER_S = 0.025        # feedback older than this is stale (2.5 periods)
+
+TORQUE_DEADBAND = 0.0        # a command within this of the last frame is not resent (0 = exact repeats)
+TORQUE_REFRESH_S = 0.050     # ...but a frame goes out at least this often (input watchdog)
+TX_MIN_INTERVAL_S = 0.0      # >0: commands closer than this are coalesced into one frame
+
+# =========================
+# ===== PROTOCOL ==========
+# =========================
+
+# CANSimple command ids; arbitration id = node_id << 5 | cmd
+CMD_HEARTBEAT = 0x01
+CMD_ESTOP = 0x02
+CMD_SET_AXIS_STATE = 0x07
+CMD_ENCODER_ESTIMATES = 0x09
+CMD_SET_CONTROLLER_MODE = 0x0B
+CMD_SET_INPUT_TORQUE = 0x0E
+CMD_CLEAR_ERRORS = 0x18
+
+AXIS_STATES = {
+    "idle": 1,
+    "startup_sequence": 2,
+    "full_calibration_sequence": 3,
+    "motor_calibration": 4,
+    "encoder_index_search": 6,
+    "encoder_offset_calibration": 7,
+    "closed_loop_control": 8,
+}
+CONTROL_MODES = {"voltage_control": 0, "torque_control": 1, "velocity_control": 2, "position_control": 3}
+INPUT_MODE_PASSTHROUGH = 1
+
+_F32 = struct.Struct("<f")
+_U32 = struct.Struct("<I")
+_U8 = struct.Struct("<B")
+_TWO_F32 = struct.Struct("<ff")
+_TWO_U32 = struct.Struct("<II")
+_HEARTBEAT = struct.Struct("<IBBB")
+
+
+def frame_bits(n_bytes):
+    """
+    Bits on the wire for a standard-id data frame with worst-case stuffing.
+    """
+    return 47 + 8 * n_bytes + (34 + 8 * n_bytes - 1) // 4
+
+
+def _open_bus(channel, interface):
+    import can     # python-can, only needed once a bus is opened
+    return can.Bus(channel=channel, interface=interface)
+
+
+def _message(arbitration_id, data):
+    import can
+    return can.Message(arbitration_id=arbitration_id, data=data, is_extended_id=False)
+
+def estop_sender(node_id=0, channel=CAN_CHANNEL, interface=CAN_INTERFACE):
+    """
+    Open a bus of its own now and return a function that sends the node's
+    Estop frame on it: for a watchdog in another process or thread, which
+    should not share (or wait on) the controller's drive object.
+    """
+    bus = _open_bus(channel, interface)
+    msg = _message(node_id << 5 | CMD_ESTOP, b"")
+    return lambda: bus.send(msg)
+
+
+def wheel_feedback(odrive):
+    """
+    (velocity, age in s, stale) from any drive object: the adapter's
+    feedback() snapshot, or `velocity` for drivers without one
+    (pyodrivecan, the simulated rig), stale only while it is None.
+    """
+    feedback = getattr(odrive, "feedback", None)
+    if feedback is not None:
+        _, vel, age, stale = feedback()
+        return vel, age, stale
+    vel = odrive.velocity
+    return (vel, 0.0, False) if vel is not None else (None, float("inf"), True)
+
+# =========================
+# ===== ADAPTER ===========
+# =========================
+
+class ODriveAdapter:
+    """
+    One ODrive axis on a CAN bus.
+
+    `position` (turns) and `velocity` (turns/s) are the last cyclic
+    feedback, None until the first message. `feedback_time` is when it was
+    received (clock()), `stale` whether that is longer than stale_after
+    ago. `axis_error`/`axis_state` come from the heartbeat.
+
+    bus=None opens channel/interface in initCanBus(); pass a python-can bus
+    (e.g. interface="virtual") to share one or to test without hardware.
+    """
+
+    def __init__(self, node_id=0, channel=CAN_CHANNEL, interface=CAN_INTERFACE, bus=None,
+                 bitrate=CAN_BITRATE, stale_after=STALE_AFTER_S, deadband=TORQUE_DEADBAND,
+                 refresh=TORQUE_REFRESH_S, min_interval=TX_MIN_INTERVAL_S, clock=time.monotonic):
+        self.node_id = node_id
+        self.channel = channel
+        self.interface = interface
+        self.bus = bus
+        self.bitrate = bitrate
+        self.stale_after = stale_after
+        self.deadband = deadband
+        self.refresh = refresh
+        self.min_interval = min_interval
+        self.clock = clock
+        # (receive time, position, velocity): one tuple so the Notifier
+        # thread replaces it in a single store
+        self._feedback = (None, None, None)
+        self.axis_error = 0
+        self.axis_state = None
+        self.heartbeat_time = None
+        self._notifier = None
+        self._stopped = None
+        self._last_torque = None
+        self._t_last_tx = -float("inf")
+        self._pending = None
+        self._flush_handle = None
+        self.reset_stats()
+
+    # ---------- feedback cache ----------
+
+    @property
+    def position(self):
+        return self._feedback[1]
+
+    @property
+    def velocity(self):
+        return self._feedback[2]
+
+    @property
+    def feedback_time(self):
+        return self._feedback[0]
+
+    @property
+    def stale(self):
+        t = self._feedback[0]
+        return t is None or self.clock() - t > self.stale_after
+
+    def feedback(self):
+        """
+        (position, velocity, age in s, stale) from one consistent snapshot.
+        """
+        t, pos, vel = self._feedback
+        if t is None:
+            return None, None, float("inf"), True
+        age = self.clock() - t
+        return pos, vel, age, age > self.stale_after
+
+    def _on_message(self, msg):
+        # Notifier thread
+        if msg.arbitration_id >> 5 != self.node_id:
+            return
+        self.rx_frames += 1
+        self.rx_bits += frame_bits(len(msg.data))
+        cmd = msg.arbitration_id & 0x1F
+        if cmd == CMD_ENCODER_ESTIMATES:
+            pos, vel = _TWO_F32.unpack_from(msg.data)
+            self._feedback = (self.clock(), pos, vel)
+            self.feedback_msgs += 1
+        elif cmd == CMD_HEARTBEAT:
+            self.axis_error, self.axis_state, _, _ = _HEARTBEAT.unpack_from(msg.data)
+            self.heartbeat_time = self.clock()
+
+    # ---------- commands ----------
+
+    def _send(self, cmd, data=b""):
+        self.bus.send(_message(self.node_id << 5 | cmd, data))
+        self.tx_frames += 1
+        self.tx_bits += frame_bits(len(data))
+
+    def initCanBus(self):
+        if self.bus is None:
+            self.bus = _open_bus(self.channel, self.interface)
+        if self._notifier is None:
+            import can
+            self._notifier = can.Notifier(self.bus, [self._on_message])
+
+    def clear_errors(self, identify=False):
+        if self.bus is None:
+            self.initCanBus()
+        self._send(CMD_CLEAR_ERRORS, _U8.pack(1 if identify else 0))
+
+    def setAxisState(self, state):
+        self._send(CMD_SET_AXIS_STATE, _U32.pack(AXIS_STATES[state]))
+
+    def set_controller_mode(self, mode):
+        self._send(CMD_SET_CONTROLLER_MODE, _TWO_U32.pack(CONTROL_MODES[mode], INPUT_MODE_PASSTHROUGH))
+
+    def set_torque(self, torque):
+        """
+        Send Set_Input_Torque unless it would repeat the last frame within
+        the deadband and the refresh period, or (min_interval > 0) come too
+        soon after it, in which case the newest value is sent when the
+        interval is up.
+        """
+        self.torque_requests += 1
+        torque = float(torque)
+        now = self.clock()
+        last = self._last_torque
+        if last is not None and abs(torque - last) <= self.deadband and now - self._t_last_tx < self.refresh:
+            self.suppressed += 1
+            if self._pending is not None:     # back to the value on the wire
+                self._pending = None
+                self.coalesced += 1
+            return
+        wait = self._t_last_tx + self.min_interval - now
+        if wait > 0.0:
+            if self._pending is not None:
+                self.coalesced += 1
+            self._pending = torque
+            if self._flush_handle is None:
+                try:
+                    self._flush_handle = asyncio.get_running_loop().call_later(wait, self._flush)
+                except RuntimeError:      # no event loop: nothing to flush later, send now
+                    self._flush()
+            return
+        self._send_torque(torque, now)
+
+    def _send_torque(self, torque, now):
+        self._send(CMD_SET_INPUT_TORQUE, _F32.pack(torque))
+        self._last_torque = torque
+        self._t_last_tx = now
+
+    def _flush(self):
+        self._flush_handle = None
+        if self._pending is not None:
+            torque, self._pending = self._pending, None
+            self._send_torque(torque, self.clock())
+
+    def estop(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        self._pending = None
+        self._send(CMD_ESTOP)
+        self._last_torque = None
+
+    async def loop(self):
+        """
+        Keeps the Notifier receiving until close(); here so scripts can
+        gather it like pyodrivecan's loop().
+        """
+        self.initCanBus()
+        self._stopped = asyncio.Event()
+        await self._stopped.wait()
+
+    def close(self):
+        if self._notifier is not None:
+            self._notifier.stop()
+            self._notifier = None
+        if self._stopped is not None:
+            self._stopped.set()
+
+    # ---------- statistics ----------
+
+    def reset_stats(self):
+        self.tx_frames = 0
+        self.rx_frames = 0
+        self.tx_bits = 0
+        self.rx_bits = 0
+        self.torque_requests = 0
+        self.suppressed = 0
+        self.coalesced = 0
+        self.feedback_msgs = 0
+        self._t0 = self.clock()
+
+    def bus_stats(self):
+        """
+        Frames/s each way, torque frames saved, and bus load (fraction of
+        CAN_BITRATE, both directions) since reset_stats().
+        """
+        elapsed = self.clock() - self._t0
+        rate = 1.0 / elapsed if elapsed > 0 else 0.0
+        return {
+            "tx_frames_s": self.tx_frames * rate,
+            "rx_frames_s": self.rx_frames * rate,
+            "load": (self.tx_bits + self.rx_bits) * rate / self.bitrate,
+            "torque_requests": self.torque_requests,
+            "suppressed": self.suppressed,
+            "coalesced": self.coalesced,
+            "feedback_msgs": self.feedback_msgs,
+        }
+
+    def report(self):
+        s = self.bus_stats()
+        return (f"[CAN] tx {s['tx_frames_s']:.0f} frames/s | rx {s['rx_frames_s']:.0f} frames/s | "
+                f"load {100 * s['load']:.1f}% of {self.bitrate / 1e3:.0f} kbit/s | "
+                f"{s['suppressed']} suppressed, {s['coalesced']} coalesced of {s['torque_requests']} torque commands")
+
+# =========================
+# ===== VIRTUAL DRIVE =====
+# =========================
+
+class VirtualODrive:
+    """
+    The ODrive end of the bus for tests: sends encoder estimates every
+    feedback_period and a heartbeat every heartbeat_period from its own
+    thread, and spins a wheel of inertia i_w (kg·m²) with the torque it is
+    sent. silence(seconds) stops the cyclic messages for a while, as a
+    dropped cable or a busy bus would.
+    """
+
+    def __init__(self, bus, node_id=0, feedback_period=FEEDBACK_PERIOD_S,
+                 heartbeat_period=0.1, i_w=1e-4):
+        self.bus = bus
+        self.node_id = node_id
+        self.feedback_period = feedback_period
+        self.heartbeat_period = heartbeat_period
+        self.i_w = i_w
+        self.torque = 0.0
+        self.position = 0.0      # turns
+        self.velocity = 0.0      # turns/s
+        self.axis_state = AXIS_STATES["idle"]
+        self.axis_error = 0
+        self.torque_frames = 0
+        self.estopped = False
+        self._silent_until = 0.0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def silence(self, seconds):
+        self._silent_until = time.monotonic() + seconds
+
+    def _handle(self, msg):
+        if msg.arbitration_id >> 5 != self.node_id:
+            return
+        cmd = msg.arbitration_id & 0x1F
+        if cmd == CMD_SET_INPUT_TORQUE:
+            self.torque_frames += 1
+            if not self.estopped:
+                self.torque = _F32.unpack_from(msg.data)[0]
+        elif cmd == CMD_ESTOP:
+            self.estopped = True
+            self.torque = 0.0
+        elif cmd == CMD_SET_AXIS_STATE:
+            self.axis_state = _U32.unpack_from(msg.data)[0]
+        elif cmd == CMD_CLEAR_ERRORS:
+            self.axis_error = 0
+            self.estopped = False
+
+    def _run(self):
+        import math
+
+        t_prev = t_fb = t_hb = time.monotonic()
+        while not self._stop.is_set():
+            msg = self.bus.recv(timeout=0.0005)
+            if msg is not None:
+                self._handle(msg)
+            now = time.monotonic()
+            self.velocity += self.torque / self.i_w / (2.0 * math.pi) * (now - t_prev)
+            self.position += self.velocity * (now - t_prev)
+            t_prev = now
+            if now < self._silent_until:
+                t_fb = t_hb = now
+                continue
+            if now - t_fb >= self.feedback_period:
+                t_fb += self.feedback_period
+                self.bus.send(_message(self.node_id << 5 | CMD_ENCODER_ESTIMATES,
+                                       _TWO_F32.pack(self.position, self.velocity)))
+            if now - t_hb >= self.heartbeat_period:
+                t_hb += self.heartbeat_period
+                self.bus.send(_message(self.node_id << 5 | CMD_HEARTBEAT,
+                                       _HEARTBEAT.pack(self.axis_error, self.axis_state, 0, 0) + b"\0\0\0"))
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="virtual-odrive", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(1.0)
+            self._thread = None
+
+
+if __name__ == "__main__":
+    import math
+
+    import can
+
+    from scheduler import DeadlineScheduler
+    from startup import odrive_ready
+
+    CHANNEL = "odrive_can_demo"
+    drive = VirtualODrive(can.Bus(channel=CHANNEL, interface="virtual")).start()
+
+    def stepped(t):
+        # changes every 20 ms, like a slow outer loop or a saturated command
+        return 0.001 * (int(t / 0.02) % 5 - 2)
+
+    def swept(t):
+        # changes every tick
+        return 0.002 * math.sin(2 * math.pi * 3.0 * t)
+
+    async def run(command, seconds=2.0, **adapter_kwargs):
+        """
+        1 kHz loop sending command(t) as the torque. The drive goes silent
+        for 0.1 s at t = 1 s. Returns the adapter and how long the silence
+        took to show up as `stale`.
+        """
+        odrive = ODriveAdapter(0, bus=can.Bus(channel=CHANNEL, interface="virtual"), **adapter_kwargs)
+        feedback = asyncio.ensure_future(odrive.loop())
+        odrive.clear_errors()
+        await odrive_ready(odrive)
+        odrive.set_controller_mode("torque_control")
+        odrive.setAxisState("closed_loop_control")
+        odrive.reset_stats()
+
+        sched = DeadlineScheduler(0.001)
+        t_silent = detected = None
+        while sched.elapsed < seconds:
+            if t_silent is None and sched.elapsed >= 1.0:
+                drive.silence(0.1)
+                t_silent = odrive.clock()
+            if t_silent is not None and detected is None and odrive.stale:
+                detected = odrive.clock() - t_silent
+            odrive.set_torque(command(sched.elapsed))
+            await sched.wait_next()
+        odrive.set_torque(0.0)
+        odrive.close()
+        await feedback
+        odrive.bus.shutdown()
+        return odrive, detected
+
+    for label, command, kwargs in (("stepped, every frame", stepped, {"deadband": -1.0}),
+                                   ("stepped, suppress repeats", stepped, {}),
+                                   ("swept, every frame", swept, {}),
+                                   ("swept, coalesce 5 ms", swept, {"min_interval": 0.005})):
+        odrive, detected = asyncio.run(run(command, **kwargs))
+        print(f"{label:26s} {odrive.report()}")
+        print(f"{'':26s} feedback silenced for 100 ms: stale after {detected * 1e3:.1f} ms "
+              f"(STALE_AFTER_S {odrive.stale_after * 1e3:.0f} ms)")
+    drive.stop()
+    drive.bus.shutdown()
+    print(f"drive received {drive.torque_frames} torque frames in total")
@@ -0,0 +1,322 @@
+#!/usr/bin/env python3
+# Batched Reaction-Wheel Pendulum Simulator
+# - Integrates N pendulum+wheel states at once as an (N x 4) array
+# - Fixed-step RK4 with zero-order-hold torque (like the real loop)
+# - Vectorized control callback: controller(t, x) -> tau[N] in Nm
+#
+# Model follows MatLabDerivations/InvPendulumDerivations.m:
+#     I_s*thdd + b*thd - g*m*l*theta = T
+# with sin(theta) instead of theta, and T = -(motor torque) since the wheel
+# pushes back on the body. The wheel is tracked relative to the body, which
+# is what odrive.velocity reports:
+#     I_w*(thdd + wdd) = tau - b_w*wv
+
+import math
+from typing import NamedTuple
+
+import numpy as np
+
+# =========================
+# ====== MODEL CONFIG =====
+# =========================
+
+# State layout (columns of the N x 4 state array)
+THETA = 0        # pendulum angle, rad, 0 = upright
+THETA_DOT = 1    # pendulum rate, rad/s
+WHEEL_POS = 2    # wheel angle relative to body, rad
+WHEEL_VEL = 3    # wheel rate relative to body, rad/s
+N_STATES = 4
+
+
+class PendulumParams(NamedTuple):
+    """
+    Physical parameters. Defaults are the rig constants from chatgpt.py
+    (MASS, LENGTH, Kt); I_s is the point-mass estimate m*l^2 plus the wheel.
+
+    Any field may also be an array of shape (N,) to simulate N different
+    plants in one batch.
+    """
+    mass: float = 0.7            # kg
+    length: float = 0.178        # m, pivot to center of mass
+    I_s: float = 0.025           # kg*m^2, whole pendulum about the pivot
+    b: float = 0.005             # N*m*s/rad, pivot friction
+    I_w: float = 1.0e-3          # kg*m^2, reaction wheel
+    b_w: float = 1.0e-4          # N*m*s/rad, wheel bearing friction
+    Kt: float = 0.08             # Nm/A, motor torque constant
+    g: float = 9.81              # m/s^2
+    torque_limit: float = 10.0   # Nm, actuator saturation (AIMain TORQUE_LIMIT_NM)
+
+
+# The MATLAB workspace numbers (InvPendulumWorkspace.m), for comparison
+MATLAB_PARAMS = PendulumParams(mass=4.0, length=0.3, I_s=5.0, b=0.1)
+
+# AIMain.controller's LPF_ALPHA: theta_dot = (1-a)*theta_dot + a*difference,
+# so at 0 its theta_dot never leaves 0 and the Kd term is never applied
+AIMAIN_LPF_ALPHA = 0.0
+
+
+class SimResult(NamedTuple):
+    t: np.ndarray          # (K,) sample times
+    x: np.ndarray          # (K, N, 4) states
+    tau: np.ndarray        # (K, N) applied (saturated) torque
+    fall_time: np.ndarray  # (N,) first time |theta| > fall_angle, inf if never
+
+
+# =========================
+# ===== IMPLEMENTATION ====
+# =========================
+
+def derivatives(x, tau, p):
+    """
+    State derivative for an (N x 4) state array and (N,) motor torque.
+    """
+    theta_dot = x[:, THETA_DOT]
+    wheel_vel = x[:, WHEEL_VEL]
+
+    tau_net = tau - p.b_w * wheel_vel
+    theta_ddot = (p.g * p.mass * p.length * np.sin(x[:, THETA])
+                  - p.b * theta_dot - tau_net) / p.I_s
+    wheel_ddot = tau_net / p.I_w - theta_ddot
+
+    dx = np.empty_like(x)
+    dx[:, THETA] = theta_dot
+    dx[:, THETA_DOT] = theta_ddot
+    dx[:, WHEEL_POS] = wheel_vel
+    dx[:, WHEEL_VEL] = wheel_ddot
+    return dx
+
+
+def rk4_step(x, tau, dt, p):
+    """
+    One fixed RK4 step with torque held constant over the step.
+    """
+    k1 = derivatives(x, tau, p)
+    k2 = derivatives(x + (0.5 * dt) * k1, tau, p)
+    k3 = derivatives(x + (0.5 * dt) * k2, tau, p)
+    k4 = derivatives(x + dt * k3, tau, p)
+    return x + (dt / 6.0) * (k1 + 2.0 * k2 + 2.0 * k3 + k4)
+
+
+class Plant:
+    """
+    A single pendulum in plain floats, for stepping tick by tick from the
+    hardware stand-ins where per-call NumPy overhead would dominate.
+    Same equations as derivatives(); torque is held between set_torque calls.
+    """
+    __slots__ = ("p", "theta", "theta_dot", "wheel_pos", "wheel_vel",
+                 "t", "tau", "max_step", "_k_grav")
+
+    def __init__(self, params=PendulumParams(), theta0=0.0, theta_dot0=0.0,
+                 max_step=0.001):
+        self.p = params
+        self.theta = theta0
+        self.theta_dot = theta_dot0
+        self.wheel_pos = 0.0
+        self.wheel_vel = 0.0
+        self.t = 0.0
+        self.tau = 0.0
+        self.max_step = max_step
+        self._k_grav = params.g * params.mass * params.length
+
+    def _accel(self, theta, theta_dot, wheel_vel):
+        p = self.p
+        tau_net = self.tau - p.b_w * wheel_vel
+        theta_ddot = (self._k_grav * math.sin(theta) - p.b * theta_dot - tau_net) / p.I_s
+        return theta_ddot, tau_net / p.I_w - theta_ddot
+
+    def _rk4(self, h):
+        th, thd, wp, wv = self.theta, self.theta_dot, self.wheel_pos, self.wheel_vel
+        a1, b1 = self._accel(th, thd, wv)
+        a2, b2 = self._accel(th + 0.5 * h * thd, thd + 0.5 * h * a1, wv + 0.5 * h * b1)
+        thd2, wv2 = thd + 0.5 * h * a1, wv + 0.5 * h * b1
+        a3, b3 = self._accel(th + 0.5 * h * thd2, thd + 0.5 * h * a2, wv + 0.5 * h * b2)
+        thd3, wv3 = thd + 0.5 * h * a2, wv + 0.5 * h * b2
+        a4, b4 = self._accel(th + h * thd3, thd + h * a3, wv + h * b3)
+        thd4, wv4 = thd + h * a3, wv + h * b3
+        self.theta = th + h / 6.0 * (thd + 2.0 * thd2 + 2.0 * thd3 + thd4)
+        self.theta_dot = thd + h / 6.0 * (a1 + 2.0 * a2 + 2.0 * a3 + a4)
+        self.wheel_pos = wp + h / 6.0 * (wv + 2.0 * wv2 + 2.0 * wv3 + wv4)
+        self.wheel_vel = wv + h / 6.0 * (b1 + 2.0 * b2 + 2.0 * b3 + b4)
+
+    def advance_to(self, t):
+        """
+        Integrate from self.t up to time t in steps of at most max_step.
+        """
+        remaining = t - self.t
+        if remaining <= 0.0:
+            return
+        n = max(1, math.ceil(remaining / self.max_step - 1e-9))
+        h = remaining / n
+        for _ in range(n):
+            self._rk4(h)
+        self.t = t
+
+    def set_torque(self, t, tau):
+        """
+        Integrate up to t with the old torque, then hold the new (clipped) one.
+        """
+        self.advance_to(t)
+        limit = self.p.torque_limit
+        self.tau = limit if tau > limit else -limit if tau < -limit else tau
+
+
+def initial_states(n, theta_span=0.2, theta_dot_span=0.0, seed=None):
+    """
+    Uniformly spread initial conditions around upright, wheel at rest.
+    """
+    rng = np.random.default_rng(seed)
+    x0 = np.zeros((n, N_STATES))
+    x0[:, THETA] = rng.uniform(-theta_span, theta_span, n)
+    x0[:, THETA_DOT] = rng.uniform(-theta_dot_span, theta_dot_span, n)
+    return x0
+
+
+def simulate(controller, x0, dt=0.001, duration=5.0, params=PendulumParams(),
+             record_every=1, fall_angle=math.pi / 2):
+    """
+    Run every row of x0 through the same controller in lock step.
+
+    controller(t, x) gets the float time and the (N x 4) state and must return
+    N torques in Nm (a scalar broadcasts). Torque is clipped to
+    params.torque_limit and held for one step of dt, like the real loop.
+    Only every record_every-th step is kept to bound memory for large N.
+    """
+    x = np.array(x0, dtype=float, copy=True)
+    if x.ndim == 1:
+        x = x[None, :]
+    n = x.shape[0]
+    steps = int(round(duration / dt))
+    n_rec = steps // record_every + 1
+
+    t_hist = np.empty(n_rec)
+    x_hist = np.empty((n_rec, n, N_STATES))
+    tau_hist = np.zeros((n_rec, n))
+    fall_time = np.full(n, np.inf)
+    limit = params.torque_limit
+
+    t_hist[0] = 0.0
+    x_hist[0] = x
+    rec = 1
+    tau = np.zeros(n)
+    for k in range(steps):
+        t = k * dt
+        tau = np.clip(np.broadcast_to(controller(t, x), (n,)), -limit, limit)
+        x = rk4_step(x, tau, dt, params)
+
+        fell = (np.abs(x[:, THETA]) > fall_angle) & np.isinf(fall_time)
+        if fell.any():
+            fall_time[fell] = t + dt
+
+        if (k + 1) % record_every == 0:
+            t_hist[rec] = t + dt
+            x_hist[rec] = x
+            tau_hist[rec] = tau
+            rec += 1
+
+    return SimResult(t_hist[:rec], x_hist[:rec], tau_hist[:rec], fall_time)
+
+
+# =========================
+# ====== CONTROLLERS ======
+# =========================
+
+def pd_wheel_controller(Kp=-120.0, Kd=-20.0, Kw=10.0, lpf_alpha=AIMAIN_LPF_ALPHA, dt=0.001):
+    """
+    Vectorized AIMain.controller law:
+        tau = -(Kp*theta + Kd*theta_dot + Kw*wheel_rate)
+    with theta_dot estimated as AIMain does, a finite difference per dt
+    through its low-pass of weight lpf_alpha. At AIMain's 0 the estimate
+    stays 0, so Kd does nothing, as on the rig. lpf_alpha=None uses the
+    true theta_dot instead (an ideal rate sensor). The per-tick Kp/Kd creep
+    by |theta| in AIMain is left out since it grows without bound. The
+    estimator is kept per run, so build one per batch.
+    """
+    if lpf_alpha is None:
+        def control(t, x):
+            return -(Kp * x[:, THETA] + Kd * x[:, THETA_DOT] + Kw * x[:, WHEEL_VEL])
+        return control
+    if lpf_alpha == 0.0:
+        def control(t, x):
+            return -(Kp * x[:, THETA] + Kw * x[:, WHEEL_VEL])
+        return control
+
+    state = {}
+
+    def control(t, x):
+        theta = x[:, THETA]
+        if not state:
+            state["theta_dot"] = np.zeros_like(theta)
+            state["theta_prev"] = theta.copy()
+        raw = (theta - state["theta_prev"]) / dt
+        state["theta_dot"] = (1.0 - lpf_alpha) * state["theta_dot"] + lpf_alpha * raw
+        state["theta_prev"] = theta.copy()
+        return -(Kp * theta + Kd * state["theta_dot"] + Kw * x[:, WHEEL_VEL])
+    return control
+
+
+def pid_wheel_controller(K1=6.0, K2=3.0, K3=4.0, K1v=6.0, K2v=3.0, K3v=4.0, dt=0.001):
+    """
+    Main2.py's law, u1 + u2: a PID on the pendulum angle plus a PID
+    on the wheel rate (Main.py is the same with K1v..K3v = 0):
+        tau = -(K1*e + K2*int(e) + K3*de/dt) - (K1v*w + K2v*int(w) + K3v*dw/dt)
+    The integrals and differences are kept per run, so build one per batch.
+    """
+    state = {}
+
+    def control(t, x):
+        e = x[:, THETA]
+        w = x[:, WHEEL_VEL]
+        if not state:
+            state["int_e"] = np.zeros_like(e)
+            state["int_w"] = np.zeros_like(w)
+            state["e_prev"] = e.copy()
+            state["w_prev"] = w.copy()
+        state["int_e"] += e * dt
+        state["int_w"] += w * dt
+        de = (e - state["e_prev"]) / dt
+        dw = (w - state["w_prev"]) / dt
+        state["e_prev"] = e.copy()
+        state["w_prev"] = w.copy()
+        return (-(K1 * e + K2 * state["int_e"] + K3 * de)
+                - (K1v * w + K2v * state["int_w"] + K3v * dw))
+    return control
+
+
+def sliding_mode_controller(C=3.0, amplitude=10.0):
+    """
+    SlidingModeTest.py law: tau = amplitude * sign(theta + C*theta_dot).
+    """
+    def control(t, x):
+        return amplitude * np.sign(x[:, THETA] + C * x[:, THETA_DOT])
+    return control
+
+
+def success_mask(result, theta_tol=0.05):
+    """
+    Runs that never fell and end within theta_tol of upright.
+    """
+    final_theta = result.x[-1, :, THETA]
+    return np.isinf(result.fall_time) & (np.abs(final_theta) < theta_tol)
+
+
+if __name__ == "__main__":
+    import time
+
+    N_RUNS = 2000
+    x0 = initial_states(N_RUNS, theta_span=0.3, theta_dot_span=0.5, seed=0)
+
+    # AIMain gains as-is, then with a wheel-damping gain the 1 kHz loop can
+    # actually sustain (Kw/I_w*dt must stay well inside the RK4/ZOH limit);
+    # each with AIMain's theta_dot estimate and with the true rate
+    for gains, alpha in [((-120.0, -20.0, 10.0), AIMAIN_LPF_ALPHA), ((-120.0, -20.0, 10.0), None),
+                         ((-120.0, -20.0, 0.01), AIMAIN_LPF_ALPHA), ((-120.0, -20.0, 0.01), None)]:
+        t0 = time.perf_counter()
+        res = simulate(pd_wheel_controller(*gains, lpf_alpha=alpha), x0, dt=0.001, duration=5.0,
+                       record_every=100)
+        wall = time.perf_counter() - t0
+
+        ok = success_mask(res)
+        rate = "true theta_dot" if alpha is None else f"LPF_ALPHA {alpha:g}"
+        print(f"Kp, Kd, Kw = {gains}, {rate} | {N_RUNS} runs x 5.0 s in {wall:.2f} s "
+              f"({N_RUNS * 5.0 / wall:.0f}x real time) | "
+              f"balanced {ok.sum()}/{N_RUNS}")
@@ -0,0 +1,281 @@
+#!/usr/bin/env python3
+# Latency-Compensated State Prediction
+# - The controller's inputs are older than the torque they produce: the
+#   encoder sample is taken before the estimator, law and CAN send run,
+#   and the ODrive's wheel velocity arrives in cyclic messages up to a
+#   feedback period old
+# - FeedbackStamp: capture time of the cyclic velocity feedback, from the
+#   values alone (a new value = a new message), so it replays exactly
+# - LatencyPredictor: brings the wheel rate from its own capture time up to
+#   the encoder sample using the torque actually applied in between, then
+#   propagates the whole state (theta, theta_dot, wheel_rate) to the
+#   expected set_torque time with the exact ZOH discretization of lqr.py's
+#   model. The expected time is now + an EWMA of the measured
+#   predict -> set_torque latency (+ a fixed actuation delay)
+# - Trade-off: the propagation is only as good as theta_dot, so feed it a
+#   real rate estimate (discretize.ModelKalmanFilter, not a difference
+#   filtered to nothing). At 1 kHz the horizon is under a period and the
+#   predicted theta is worse than the measured one (the demo below: 0.209
+#   vs 0.170 mrad RMS at 0.9 ms latency); theta_dot and the wheel rate
+#   improve, and at 5 ms loops and slower theta does too
+#
+# Usage in a controller:
+#     pred = LatencyPredictor(wheel_scale=2 * math.pi)    # odrive.velocity in turns/s
+#     stamp = FeedbackStamp()
+#     ...
+#     theta_c, theta_dot_c, wheel_c = pred.predict(theta, theta_dot, t_sample,
+#                                                  wheel_raw, stamp.update(wheel_raw, now), now)
+#     odrive.set_torque(law(theta_c, theta_dot_c, wheel_c))
+#     pred.actuated(loop.time(), tau_nm)
+#
+# Usage: python predict.py   (balance vs pipeline latency, with and without prediction)
+
+from collections import deque
+
+from discretize import discretize
+from lqr import linear_model
+from pendulum_sim import PendulumParams
+
+# =========================
+# ====== USER CONFIG ======
+# =========================
+
+FEEDBACK_PERIOD_S = 0.010    # ODrive cyclic encoder-estimate period
+LATENCY_ALPHA = 0.05         # EWMA weight of each new predict -> set_torque latency
+ACTUATION_DELAY_S = 0.0      # fixed delay after set_torque returns (CAN frame, current loop)
+PREDICT_QUANTUM = 10e-6      # s, prediction horizons are rounded to this
+MAX_HORIZON_S = 0.02         # longer horizons are clipped (a stall, not latency)
+TORQUE_HISTORY = 64          # applied torques kept for the wheel-rate catch-up
+
+# =========================
+# ===== IMPLEMENTATION ====
+# =========================
+
+class FeedbackStamp:
+    """
+    Capture time of a cyclic feedback value: the `now` at which a changed
+    value was first seen, so at most one controller tick late. The same
+    value for longer than a period is taken as repeated messages (a wheel
+    at rest), not as a stalled bus, and the stamp moves on by whole periods.
+    """
+    __slots__ = ("period", "value", "t")
+
+    def __init__(self, period=FEEDBACK_PERIOD_S):
+        self.period = period
+        self.value = None
+        self.t = 0.0
+
+    def update(self, value, now):
+        if value != self.value:
+            self.value = value
+            self.t = now
+        elif now - self.t >= self.period:
+            self.t += self.period * int((now - self.t) / self.period)
+        return self.t
+
+
+class LatencyPredictor:
+    """
+    Propagates the measured state to the time the next torque takes effect.
+
+    predict() takes theta/theta_dot captured at t_sample, the wheel rate in
+    the ODrive's units (wheel_scale converts to rad/s) captured at t_wheel,
+    and the current time; it returns the predicted (theta, theta_dot,
+    wheel_rate), the wheel rate again in the ODrive's units. actuated() must
+    follow every set_torque with the time it returned and the torque sent
+    in Nm: it is both the input held over the prediction horizon and the
+    measurement of the send latency.
+    """
+    __slots__ = ("params", "wheel_scale", "alpha", "extra_delay", "quantum",
+                 "inv_quantum", "max_horizon", "a_w", "b_w", "send_latency",
+                 "tau", "_mats", "_history", "_impulse", "_t_applied",
+                 "_t_wheel", "_j_wheel", "_t_pred", "_t_act", "predictions",
+                 "_sum_horizon", "_max_horizon", "_sum_wheel_age", "_sum_residual")
+
+    def __init__(self, params=PendulumParams(), wheel_scale=1.0, alpha=LATENCY_ALPHA,
+                 extra_delay=ACTUATION_DELAY_S, quantum=PREDICT_QUANTUM,
+                 max_horizon=MAX_HORIZON_S):
+        self.params = params
+        self.wheel_scale = wheel_scale
+        self.alpha = alpha
+        self.extra_delay = extra_delay
+        self.quantum = quantum
+        self.inv_quantum = 1.0 / quantum
+        self.max_horizon = max_horizon
+        A, B = linear_model(params)
+        self.a_w = tuple(float(v) for v in A[2])     # wheel-rate row
+        self.b_w = float(B[2, 0])
+        self.send_latency = 0.0
+        self.tau = 0.0
+        self._mats = {}
+        # (time applied, impulse integral of torque up to then, torque)
+        self._history = deque(maxlen=TORQUE_HISTORY)
+        self._impulse = 0.0
+        self._t_applied = None
+        self._t_wheel = None
+        self._j_wheel = 0.0
+        self._t_pred = 0.0
+        self._t_act = 0.0
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.predictions = 0
+        self._sum_horizon = 0.0
+        self._max_horizon = 0.0
+        self._sum_wheel_age = 0.0
+        self._sum_residual = 0.0
+
+    def _load(self, ticks):
+        Ad, Bd, _ = discretize(ticks * self.quantum, self.params, quantum=self.quantum)
+        mats = self._mats[ticks] = tuple(float(v) for v in Ad.ravel()) + tuple(float(v) for v in Bd[:, 0])
+        return mats
+
+    def _impulse_at(self, t):
+        """
+        Integral of the applied torque from the first actuation up to t.
+        """
+        if t >= self._t_applied:
+            return self._impulse + self.tau * (t - self._t_applied)
+        for t_i, j_i, tau_i in reversed(self._history):
+            if t_i <= t:
+                return j_i + tau_i * (t - t_i)
+        return self._history[0][1]   # older than the history: clip
+
+    def predict(self, theta, theta_dot, t_sample, wheel_raw, t_wheel, now):
+        w = wheel_raw * self.wheel_scale
+
+        # Wheel rate: from its capture up to the encoder sample. The torque
+        # term is exact for the torques applied in between; the small
+        # coupling to theta is taken at the newer sample
+        age = t_sample - t_wheel
+        if age > 0.0 and self._t_applied is not None:
+            if t_wheel != self._t_wheel:
+                self._t_wheel = t_wheel
+                self._j_wheel = self._impulse_at(t_wheel)
+            a0, a1, a2 = self.a_w
+            w += (a0 * theta + a1 * theta_dot + a2 * w) * age \
+                + self.b_w * (self._impulse_at(t_sample) - self._j_wheel)
+
+        # Whole state: from the encoder sample to the expected actuation,
+        # with the torque now applied held until the new one lands
+        t_act = now + self.send_latency + self.extra_delay
+        h = t_act - t_sample
+        if h > self.max_horizon:
+            h = self.max_horizon
+        self._t_pred = now
+        self._t_act = t_act
+        self.predictions += 1
+        self._sum_horizon += h
+        if h > self._max_horizon:
+            self._max_horizon = h
+        self._sum_wheel_age += t_act - t_wheel
+
+        ticks = int(h * self.inv_quantum + 0.5)
+        if ticks > 0:
+            m = self._mats.get(ticks) or self._load(ticks)
+            tau = self.tau
+            theta, theta_dot, w = (
+                m[0] * theta + m[1] * theta_dot + m[2] * w + m[9] * tau,
+                m[3] * theta + m[4] * theta_dot + m[5] * w + m[10] * tau,
+                m[6] * theta + m[7] * theta_dot + m[8] * w + m[11] * tau,
+            )
+        return theta, theta_dot, w / self.wheel_scale
+
+    def actuated(self, t_sent, tau_nm):
+        t = t_sent + self.extra_delay
+        if self._t_applied is not None:
+            self._impulse += self.tau * (t - self._t_applied)
+        self._t_applied = t
+        self.tau = tau_nm
+        self._history.append((t, self._impulse, tau_nm))
+        self.send_latency += self.alpha * ((t_sent - self._t_pred) - self.send_latency)
+        self._sum_residual += abs(t - self._t_act)
+
+    def stats(self):
+        """
+        Mean/max prediction horizon (the delay compensated), mean wheel-rate
+        age at actuation, the learned send latency and the mean residual
+        |actual - expected actuation time| (the delay left uncompensated).
+        """
+        n = max(1, self.predictions)
+        return {
+            "horizon_us": self._sum_horizon / n * 1e6,
+            "horizon_max_us": self._max_horizon * 1e6,
+            "wheel_age_ms": self._sum_wheel_age / n * 1e3,
+            "send_latency_us": self.send_latency * 1e6,
+            "residual_us": self._sum_residual / n * 1e6,
+        }
+
+    def report(self):
+        s = self.stats()
+        return (f"[PREDICT] horizon {s['horizon_us']:.0f} us (max {s['horizon_max_us']:.0f}) | "
+                f"wheel rate age {s['wheel_age_ms']:.2f} ms | send latency {s['send_latency_us']:.0f} us | "
+                f"uncompensated {s['residual_us']:.1f} us")
+
+
+if __name__ == "__main__":
+    import math
+
+    from lqr import pendulum_gains
+    from pendulum_sim import Plant
+
+    params = PendulumParams()
+    STEP = 2 * math.pi / (255 * 64)          # "split" encoder resolution
+
+    def run(dt, latency, predict, seconds=5.0, theta0=0.05):
+        """
+        Loop at period dt: the encoder is sampled at the tick, the ODrive
+        velocity is the last 10 ms feedback message, and the torque lands
+        `latency` after the sample. Returns (RMS theta after 1 s, RMS error
+        of the state the law used vs the true state when its torque landed
+        over the whole run, fell, predictor).
+        """
+        K = pendulum_gains(params, dt=dt)
+        plant = Plant(params, theta0=theta0)
+        pred = LatencyPredictor(params) if predict else None
+        stamp = FeedbackStamp()
+        theta_prev, theta_dot = theta0, 0.0
+        wheel, t_fb = 0.0, -1.0
+        sq, err, n = 0.0, [0.0, 0.0, 0.0], 0
+        for k in range(1, int(seconds / dt)):
+            t = k * dt
+            plant.advance_to(t)
+            if t >= t_fb + FEEDBACK_PERIOD_S - 1e-9:
+                t_fb = t
+                wheel = plant.wheel_vel
+            theta = round(plant.theta / STEP) * STEP
+            theta_dot = 0.5 * theta_dot + 0.5 * (theta - theta_prev) / dt
+            theta_prev = theta
+            x = theta, theta_dot, wheel
+            if pred is not None:
+                x = pred.predict(theta, theta_dot, t, wheel, stamp.update(wheel, t), t)
+            tau = max(-10.0, min(10.0, -(K[0] * x[0] + K[1] * x[1] + K[2] * x[2])))
+            plant.set_torque(t + latency, tau)
+            if pred is not None:
+                pred.actuated(t + latency, tau)
+            if abs(plant.theta) > 0.5:
+                return float("nan"), None, True, pred
+            for i, true in enumerate((plant.theta, plant.theta_dot, plant.wheel_vel)):
+                err[i] += (x[i] - true) ** 2
+            if t >= 1.0:
+                sq += plant.theta ** 2
+                n += 1
+        return math.sqrt(sq / n), [math.sqrt(e / k) for e in err], False, pred
+
+    print("1 kHz loop from theta0 = 0.05 rad, RMS error of the state used vs the state when the torque lands")
+    print("  latency | measured: theta mrad  theta_dot rad/s  wheel rad/s | predicted: theta  theta_dot  wheel")
+    for latency in (0.0, 0.2e-3, 0.5e-3, 0.9e-3):
+        cells = []
+        for predict in (False, True):
+            _, e, fell, pred = run(0.001, latency, predict)
+            cells.append("fell" if fell else f"{e[0] * 1e3:8.3f} {e[1]:10.3f} {e[2]:10.3f}")
+        print(f"  {latency * 1e3:4.1f} ms | {cells[0]:>40s} | {cells[1]:>30s}")
+    print(pred.report())
+
+    print("Slower loops, torque landing 0.9 periods after the sample: RMS theta")
+    for dt in (0.002, 0.005, 0.010, 0.020):
+        cells = []
+        for predict in (False, True):
+            rms, _, fell, pred = run(dt, 0.9 * dt, predict)
+            cells.append("fell" if fell else f"{rms * 1e3:.3f} mrad")
+        print(f"  {dt * 1e3:4.0f} ms loop | measured {cells[0]:>11s} | predicted {cells[1]:>11s}")
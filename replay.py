@@ -0,0 +1,461 @@
+#!/usr/bin/env python3
+# Record-and-Replay of Raw Controller Inputs
+# - Recorder: proxies around the encoder bus and the ODrive log every raw
+#   input a controller sees (I2C bytes, odrive.velocity/position, the
+#   adapter's feedback() snapshots) and every command it sends, timestamped
+#   with loop.time(), as 17-byte records
+# - Replay: feeds a recording back through any controller script on the
+#   virtual clock at full speed. The n-th encoder read gets the n-th
+#   recorded bytes and the clock jumps to its recorded time; velocity and
+#   position are the latest recorded values at that time, and the n-th
+#   feedback() call gets the n-th recorded snapshot
+# - Command streams of two replays can be diffed tick for tick, and a
+#   corpus of recordings can be replayed across a process pool
+#
+# File layout: HEADER (MAGIC) then records  kind u8 | t f64 | value f64
+#
+# Usage: python replay.py record AIMain.py session.rec --seconds 5   (on the simulated rig)
+#        python replay.py run AIMain.py session.rec
+#        python replay.py diff AIMain.py Main.py session.rec
+#        python replay.py corpus AIMain.py recordings/*.rec
+#        python replay.py check AIMain.py   (record + replay with both drivers, exit 1 unless exact)
+
+import asyncio
+import bisect
+import math
+import struct
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from sim_hardware import SimRig, VirtualClock, RigStopped
+
+# =========================
+# ===== FILE FORMAT =======
+# =========================
+
+MAGIC = b"PENDREC1"
+RECORD = struct.Struct("<Bdd")
+
+# Event kinds
+I2C_READ = 1      # value = the bytes read, big-endian (≤ 6 bytes fit a float64 exactly)
+VELOCITY = 2      # value = odrive.velocity as read
+POSITION = 3      # value = odrive.position as read
+TORQUE = 4        # value = set_torque argument
+ESTOP = 5
+# One feedback() call, as four consecutive records
+FB_POSITION = 6   # NaN = None
+FB_VELOCITY = 7   # NaN = None
+FB_AGE = 8        # s, inf before the first message
+FB_STALE = 9      # 0.0 / 1.0
+
+
+def _loop_time():
+    try:
+        return asyncio.get_running_loop().time()
+    except RuntimeError:
+        import time
+        return time.monotonic()
+
+
+# =========================
+# ======= RECORDING =======
+# =========================
+
+class Recorder:
+    """
+    Appends raw events to a buffered binary file.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._f = open(path, "wb", buffering=1 << 20)
+        self._f.write(MAGIC)
+        self._pack = RECORD.pack
+        self.events = 0
+
+    def log(self, kind, value):
+        self._f.write(self._pack(kind, _loop_time(), value))
+        self.events += 1
+
+    def close(self):
+        if not self._f.closed:
+            self._f.close()
+
+
+class RecordingBus:
+    """
+    smbus.SMBus proxy that logs each 2-byte read.
+    """
+
+    def __init__(self, bus, recorder):
+        self._bus = bus
+        self._rec = recorder
+
+    def read_i2c_block_data(self, addr, reg, length):
+        data = self._bus.read_i2c_block_data(addr, reg, length)
+        self._rec.log(I2C_READ, int.from_bytes(bytes(data), "big"))
+        return data
+
+    def __getattr__(self, name):
+        # Hide smbus2's i2c_rdwr so every read goes through the method above
+        if name == "i2c_rdwr":
+            raise AttributeError(name)
+        return getattr(self._bus, name)
+
+
+class RecordingODrive:
+    """
+    ODriveCAN proxy that logs feedback reads and commands.
+    """
+
+    def __init__(self, odrive, recorder):
+        self._odrive = odrive
+        self._rec = recorder
+
+    @property
+    def velocity(self):
+        v = self._odrive.velocity
+        self._rec.log(VELOCITY, float("nan") if v is None else v)
+        return v
+
+    @property
+    def position(self):
+        p = self._odrive.position
+        self._rec.log(POSITION, float("nan") if p is None else p)
+        return p
+
+    def set_torque(self, torque):
+        self._rec.log(TORQUE, torque)
+        return self._odrive.set_torque(torque)
+
+    def estop(self):
+        self._rec.log(ESTOP, 0.0)
+        return self._odrive.estop()
+
+    def _feedback(self, feedback):
+        pos, vel, age, stale = feedback()
+        log = self._rec.log
+        log(FB_POSITION, float("nan") if pos is None else pos)
+        log(FB_VELOCITY, float("nan") if vel is None else vel)
+        log(FB_AGE, age)
+        log(FB_STALE, 1.0 if stale else 0.0)
+        return pos, vel, age, stale
+
+    def __getattr__(self, name):
+        attr = getattr(self._odrive, name)
+        if name == "feedback":
+            # Only drives that have feedback() (the CAN adapter) get one here
+            return lambda: self._feedback(attr)
+        return attr
+
+
+def record_sim(script, path, seconds=None, **rig_kwargs):
+    """
+    Record a script running on the simulated rig (sim_hardware.py), e.g. to
+    build a corpus without hardware. Returns the run summary.
+    """
+    from sim_hardware import rig_for_script
+
+    rig, module = rig_for_script(script, **rig_kwargs)
+    rec = Recorder(path)
+    module.bus = RecordingBus(rig.bus, rec)
+    if hasattr(module, "make_encoder"):
+        module.enc = module.make_encoder()    # AIMain's encoder driver holds the bus
+    try:
+        return rig.run(lambda odrive: module.controller(RecordingODrive(odrive, rec)), seconds)
+    finally:
+        rec.close()
+
+
+def load_recording(path):
+    """
+    Recording as a NumPy structured array with fields kind, t, value.
+    """
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not a controller recording")
+        dtype = np.dtype([("kind", "u1"), ("t", "<f8"), ("value", "<f8")])
+        return np.fromfile(f, dtype=dtype)
+
+
+# =========================
+# ======== REPLAY =========
+# =========================
+
+class ReplayBus:
+    """
+    Serves recorded encoder bytes in order and moves the clock to each
+    read's recorded time. Stops the run when the recording is used up.
+    """
+
+    def __init__(self, rig, t, raw):
+        self.rig = rig
+        self.t = t.tolist()
+        self.raw = raw.astype(int).tolist()
+        self.reads = 0
+
+    def read_i2c_block_data(self, addr, reg, length):
+        n = self.reads
+        if n >= len(self.raw):
+            raise RigStopped("recording exhausted")
+        self.reads = n + 1
+        clock = self.rig.clock
+        if self.t[n] > clock.now:
+            clock.now = self.t[n]
+        # A shorter read than was recorded gets the trailing (angle) bytes
+        return list((self.raw[n] & ((1 << (8 * length)) - 1)).to_bytes(length, "big"))
+
+    def close(self):
+        pass
+
+
+class ReplayODrive:
+    """
+    Serves the recorded feedback that was current at the replay clock and
+    collects the commands the controller sends. A recording with
+    feedback() snapshots gets a feedback() serving them in call order.
+    """
+
+    def __init__(self, rig, vel_t, vel, pos_t, pos, snapshots=()):
+        self.rig = rig
+        self._vel_t, self._vel = vel_t.tolist(), vel.tolist()
+        self._pos_t, self._pos = pos_t.tolist(), pos.tolist()
+        self._snapshots = snapshots
+        self.feedback_calls = 0
+        if snapshots:
+            self.feedback = self._feedback
+        self.commands = []      # (tick, t, torque)
+        self.estopped = False
+        self.torque_frames = 0
+        self.running = True
+
+    def _at(self, times, values):
+        i = bisect.bisect_right(times, self.rig.clock.now) - 1
+        v = values[i] if i >= 0 else (values[0] if values else 0.0)
+        return None if v != v else v        # recorded NaN = no feedback yet
+
+    @property
+    def velocity(self):
+        return self._at(self._vel_t, self._vel)
+
+    @property
+    def position(self):
+        return self._at(self._pos_t, self._pos)
+
+    def _feedback(self):
+        # Past the end of the recording the last snapshot repeats
+        snap = self._snapshots[min(self.feedback_calls, len(self._snapshots) - 1)]
+        self.feedback_calls += 1
+        return snap
+
+    def report(self):
+        return f"[REPLAY] {self.feedback_calls} of {len(self._snapshots)} feedback snapshots served"
+
+    def set_torque(self, torque):
+        self.torque_frames += 1
+        self.commands.append((self.rig.bus.reads, self.rig.clock.now, float(torque)))
+
+    def estop(self):
+        self.estopped = True
+
+    def clear_errors(self, identify=False):
+        pass
+
+    def initCanBus(self):
+        pass
+
+    def setAxisState(self, state):
+        pass
+
+    def set_controller_mode(self, mode):
+        pass
+
+    async def loop(self):
+        while True:
+            await asyncio.sleep(3600.0)
+
+
+class ReplayRig(SimRig):
+    """
+    SimRig whose bus and ODrive serve a recording instead of a plant.
+    """
+
+    def __init__(self, recording, quiet=True):
+        rec = load_recording(recording) if isinstance(recording, str) else recording
+        self.clock = VirtualClock()
+        self.quiet = quiet
+        self.held = False
+        i2c = rec[rec["kind"] == I2C_READ]
+        vel = rec[rec["kind"] == VELOCITY]
+        pos = rec[rec["kind"] == POSITION]
+        self.recorded_commands = rec[rec["kind"] == TORQUE]
+        self.bus = ReplayBus(self, i2c["t"], i2c["value"])
+        self.odrive = ReplayODrive(self, vel["t"], vel["value"], pos["t"], pos["value"],
+                                   _snapshots(rec))
+
+    def advance(self):
+        pass
+
+    def summary(self):
+        return {
+            "encoder_reads": self.bus.reads,
+            "torque_frames": self.odrive.torque_frames,
+            "estopped": self.odrive.estopped,
+        }
+
+
+def _snapshots(rec):
+    """
+    The recorded feedback() results as (pos, vel, age, stale) tuples.
+    """
+    fields = [rec["value"][rec["kind"] == kind].tolist()
+              for kind in (FB_POSITION, FB_VELOCITY, FB_AGE, FB_STALE)]
+    return [(None if p != p else p, None if v != v else v, age, bool(stale))
+            for p, v, age, stale in zip(*fields)]
+
+
+def command_stream(odrive):
+    """
+    Last command of each tick as (ticks, t, torque) arrays.
+    """
+    if not odrive.commands:
+        return np.zeros(0, int), np.zeros(0), np.zeros(0)
+    cmds = np.array(odrive.commands)
+    ticks = cmds[:, 0].astype(int)
+    last = np.r_[ticks[1:] != ticks[:-1], True]
+    return ticks[last], cmds[last, 1], cmds[last, 2]
+
+
+def replay(script, recording, seconds=None):
+    """
+    Run a controller script over a recording. Returns (ticks, t, torque).
+    """
+    rig = ReplayRig(recording)
+    module = rig.load_script(script)
+    rig.run(module.controller, seconds)
+    return command_stream(rig.odrive)
+
+
+def replay_vs_recorded(script, recording):
+    """
+    Replay a recording through the script that made it. Returns (summary,
+    (ticks, t, torque), commands compared, max |difference| from the
+    recorded commands), which is 0 for an exact replay.
+    """
+    rig = ReplayRig(recording)
+    module = rig.load_script(script)
+    summary = rig.run(module.controller)
+    recorded = rig.recorded_commands["value"]
+    replayed = np.array([c[2] for c in rig.odrive.commands])
+    n = min(len(recorded), len(replayed))
+    worst = float(np.abs(recorded[:n] - replayed[:n]).max()) if n else 0.0
+    if len(recorded) != len(replayed):
+        worst = math.inf
+    return summary, command_stream(rig.odrive), n, worst
+
+
+def check_exact(script, seconds=2.0, theta0=0.05):
+    """
+    Record the script on the simulated rig with each drive stand-in (plain
+    velocity, and the CAN adapter's feedback()) and replay it. Returns
+    [(driver, commands compared, max |difference|)].
+    """
+    import os
+    import tempfile
+
+    rows = []
+    for driver, adapter in (("pyodrivecan", False), ("adapter", True)):
+        fd, path = tempfile.mkstemp(suffix=".rec")
+        os.close(fd)
+        try:
+            record_sim(script, path, seconds, theta0=theta0, adapter=adapter)
+            _, _, n, worst = replay_vs_recorded(script, path)
+        finally:
+            os.unlink(path)
+        rows.append((driver, n, worst))
+    return rows
+
+
+def diff_streams(a, b, tol=1e-9):
+    """
+    Compare two command streams on the ticks both produced.
+    Returns (common ticks, max |difference|, first tick differing by > tol).
+    """
+    ticks_a, _, tau_a = a
+    ticks_b, _, tau_b = b
+    common, ia, ib = np.intersect1d(ticks_a, ticks_b, return_indices=True)
+    if len(common) == 0:
+        return 0, 0.0, None
+    d = np.abs(tau_a[ia] - tau_b[ib])
+    bad = np.nonzero(d > tol)[0]
+    return len(common), float(d.max()), (int(common[bad[0]]) if len(bad) else None)
+
+
+def _replay_job(args):
+    script, path = args
+    ticks, t, tau = replay(script, path)
+    return path, len(ticks), float(np.abs(tau).max()) if len(tau) else 0.0
+
+
+def replay_corpus(script, paths, workers=None):
+    """
+    Replay every recording through one script in a process pool.
+    Returns [(path, ticks, max |torque|)].
+    """
+    with ProcessPoolExecutor(workers) as pool:
+        return list(pool.map(_replay_job, [(script, p) for p in paths]))
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Record and replay raw controller inputs.")
+    sub = parser.add_subparsers(dest="mode", required=True)
+    p = sub.add_parser("record", help="record a script on the simulated rig")
+    p.add_argument("script")
+    p.add_argument("recording")
+    p.add_argument("--seconds", type=float, default=5.0)
+    p.add_argument("--theta0", type=float, default=0.05)
+    p = sub.add_parser("run", help="replay a recording through a script")
+    p.add_argument("script")
+    p.add_argument("recording")
+    p = sub.add_parser("diff", help="diff two scripts' command streams on one recording")
+    p.add_argument("script_a")
+    p.add_argument("script_b")
+    p.add_argument("recording")
+    p.add_argument("--tol", type=float, default=1e-9)
+    p = sub.add_parser("check", help="record and replay a script with both drivers, must be exact")
+    p.add_argument("script")
+    p.add_argument("--seconds", type=float, default=2.0)
+    p = sub.add_parser("corpus", help="replay many recordings in a process pool")
+    p.add_argument("script")
+    p.add_argument("recordings", nargs="+")
+    p.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+
+    if args.mode == "record":
+        summary = record_sim(args.script, args.recording, args.seconds, theta0=args.theta0)
+        print(f"[REPLAY] recorded {summary['virtual_s']:.1f} s of {args.script} -> {args.recording} | "
+              f"{summary['encoder_reads']} encoder reads, {summary['torque_frames']} commands")
+    elif args.mode == "run":
+        summary, (ticks, t, tau), n, worst = replay_vs_recorded(args.script, args.recording)
+        print(f"[REPLAY] {args.script}: {len(ticks)} ticks, {summary['virtual_s']:.2f} s virtual in "
+              f"{summary['wall_s']:.2f} s wall ({summary['speedup']:.0f}x) | "
+              f"max |cmd| = {np.abs(tau).max() if len(tau) else 0.0:.3f} | "
+              f"vs recorded commands: max |Δ| = {worst:.3g} over {n}")
+    elif args.mode == "check":
+        exact = True
+        for driver, n, worst in check_exact(args.script, args.seconds):
+            print(f"[REPLAY] {args.script} with {driver}: max |Δ| = {worst:.3g} over {n} commands")
+            exact = exact and n > 0 and worst == 0.0
+        raise SystemExit(0 if exact else 1)
+    elif args.mode == "diff":
+        a = replay(args.script_a, args.recording)
+        b = replay(args.script_b, args.recording)
+        n, worst, first = diff_streams(a, b, args.tol)
+        print(f"[REPLAY] {n} common ticks | max |Δcmd| = {worst:.6g} | "
+              f"first divergence: {'none' if first is None else f'tick {first}'}")
+    else:
+        for path, n, peak in replay_corpus(args.script, args.recordings, args.workers):
+            print(f"[REPLAY] {path}: {n} ticks, max |cmd| = {peak:.3f}")
@@ -0,0 +1,360 @@
+#!/usr/bin/env python3
+# Monte Carlo Robustness Under Parameter Uncertainty
+# - Draws plants around PendulumParams() from UNCERTAINTY (mass, length,
+#   inertias, damping, and the motor Kt the drive really has vs the one the
+#   torque commands assume) plus an initial condition, one seeded draw per
+#   sample
+# - Simulates every controller on every sample, batched per chunk in
+#   pendulum_sim (parameter fields as arrays) and spread over a process pool
+# - Reports success probability (95% Wilson interval), performance
+#   percentiles and which parameters the failures lean on. A run succeeds
+#   when it does not fall, settles into ±SETTLE_TOL and stays there for the
+#   last SETTLE_HOLD_S, and ends within SUCCESS_TOL; a run that never
+#   settles has settle_s = inf
+# - Results are cached on disk (SQLite), one row per sample keyed by a hash
+#   of (controller, gains, parameter sample, seed, simulation settings):
+#   re-running after a change only simulates the samples it affects, e.g.
+#   more samples, or one controller's gains
+#
+# Usage: python robustness.py                         (all controllers, SAMPLES each)
+#        python robustness.py pd_wheel lqr --samples 2000 --workers 8
+#        python robustness.py --no-cache
+
+import hashlib
+import json
+import math
+import os
+import sqlite3
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import pendulum_sim as sim
+
+# =========================
+# ====== USER CONFIG ======
+# =========================
+
+SAMPLES = 500
+SEED = 0
+EPISODE_S = 3.0            # simulated seconds per sample
+SIM_DT = 0.001             # matches CONTROL_DT
+THETA0_SPAN = 0.1          # rad, initial angle drawn from ±span
+THETA_DOT0_SPAN = 0.3      # rad/s
+SUCCESS_TOL = 0.05         # rad, |theta| at the end of a successful run
+SETTLE_TOL = 0.02          # rad, band counted as settled (as in tune_gains.py)
+SETTLE_HOLD_S = 0.5        # s, a successful run stays in the band at least this long
+CHUNK = 64                 # samples per worker job
+CACHE_PATH = "robustness_cache.sqlite"
+
+# Uncertainty around PendulumParams():
+#   ("rel", a)       uniform, nominal * (1 ± a)
+#   ("log", a)       log-uniform, nominal / a .. nominal * a
+#   ("range", a, b)  uniform, a .. b
+# Kt is the motor's true torque constant; the commands assume the nominal
+# one (chatgpt.py: "If unknown, assume Kt ≈ 0.08"), so the applied torque
+# is scaled by Kt / nominal Kt
+UNCERTAINTY = {
+    "mass": ("rel", 0.15),
+    "length": ("rel", 0.10),
+    "I_s": ("rel", 0.30),
+    "b": ("log", 3.0),
+    "I_w": ("rel", 0.10),
+    "b_w": ("log", 3.0),
+    "Kt": ("range", 0.06, 0.10),
+}
+
+NOMINAL = sim.PendulumParams()
+KEY_VERSION = 3            # bump when the simulation or metrics change meaning
+
+# Per-sample results, in cache column order
+METRICS = ("success", "fall_time", "settle_s", "rms_theta", "peak_tau", "sat_frac", "final_wheel")
+
+# =========================
+# ===== SAMPLING ==========
+# =========================
+
+def draw_samples(n, seed=SEED, uncertainty=UNCERTAINTY):
+    """
+    n samples, each {"params": {name: value}, "x0": [theta, theta_dot],
+    "seed": [seed, i]}. Sample i depends only on (seed, i), so asking for
+    more samples keeps the first ones.
+    """
+    samples = []
+    for i in range(n):
+        rng = np.random.default_rng([seed, i])
+        params = {}
+        for name, spec in uncertainty.items():
+            nominal = getattr(NOMINAL, name)
+            u = rng.random()
+            if spec[0] == "rel":
+                value = nominal * (1.0 + spec[1] * (2.0 * u - 1.0))
+            elif spec[0] == "log":
+                value = nominal * spec[1] ** (2.0 * u - 1.0)
+            elif spec[0] == "range":
+                value = spec[1] + (spec[2] - spec[1]) * u
+            else:
+                raise ValueError(f"unknown distribution {spec[0]!r} for {name}")
+            params[name] = float(value)
+        x0 = [float(rng.uniform(-THETA0_SPAN, THETA0_SPAN)),
+              float(rng.uniform(-THETA_DOT0_SPAN, THETA_DOT0_SPAN))]
+        samples.append({"params": params, "x0": x0, "seed": [seed, i]})
+    return samples
+
+
+def settings():
+    """
+    Everything besides the sample that changes a result.
+    """
+    return {"episode_s": EPISODE_S, "dt": SIM_DT, "success_tol": SUCCESS_TOL,
+            "settle_tol": SETTLE_TOL, "settle_hold_s": SETTLE_HOLD_S,
+            "nominal": NOMINAL._asdict(), "version": KEY_VERSION}
+
+
+def sample_key(controller, gains, sample, config):
+    blob = json.dumps([controller, [float(g) for g in gains], sample, config], sort_keys=True)
+    return hashlib.sha256(blob.encode()).hexdigest()
+
+# =========================
+# ===== CONTROLLERS =======
+# =========================
+
+def controller_gains(controller):
+    """
+    Gains each controller runs with: the tuned ones from gains.json where
+    present (as the scripts load them), else the script defaults; "lqr" is
+    pd_wheel with lqr.py's design for the nominal plant.
+    """
+    from gains import load_gains
+    from tune_gains import CONTROLLERS
+
+    if controller == "lqr":
+        from lqr import pendulum_gains
+        return tuple(float(k) for k in pendulum_gains(NOMINAL, dt=SIM_DT))
+    names, defaults = CONTROLLERS[controller][:2]
+    g = load_gains(controller, **dict(zip(names, defaults)))
+    return tuple(g[n] for n in names)
+
+
+def controller_names():
+    from tune_gains import CONTROLLERS
+    return tuple(CONTROLLERS) + ("lqr",)
+
+
+def _law(controller, gains, dt):
+    from tune_gains import CONTROLLERS
+    if controller == "lqr":
+        return sim.pd_wheel_controller(*gains, dt=dt)
+    return CONTROLLERS[controller][3](tuple(gains), dt)
+
+# =========================
+# ===== SIMULATION ========
+# =========================
+
+def simulate_samples(controller, gains, samples, config):
+    """
+    Metric rows (METRICS order) for a batch of samples, simulated in one
+    lock-step pendulum_sim run.
+    """
+    n = len(samples)
+    fields = {name: np.array([s["params"][name] for s in samples]) for name in UNCERTAINTY}
+    params = NOMINAL._replace(**fields)
+    x0 = np.zeros((n, sim.N_STATES))
+    x0[:, sim.THETA] = [s["x0"][0] for s in samples]
+    x0[:, sim.THETA_DOT] = [s["x0"][1] for s in samples]
+
+    law = _law(controller, gains, config["dt"])
+    kt_scale = np.broadcast_to(params.Kt / NOMINAL.Kt, (n,))
+
+    def applied(t, x):
+        return kt_scale * law(t, x)
+
+    duration = config["episode_s"]
+    with np.errstate(over="ignore", invalid="ignore"):
+        res = sim.simulate(applied, x0, dt=config["dt"], duration=duration, params=params)
+    theta = np.abs(res.x[:, :, sim.THETA])
+    fell = np.isfinite(res.fall_time)
+    outside = theta > config["settle_tol"]
+    last_out = np.where(outside.any(axis=0), outside.shape[0] - np.argmax(outside[::-1], axis=0), 0)
+    # Still outside the band at the end (or fell): never settled
+    settled = ~fell & (last_out < len(res.t))
+    settle = np.where(settled, res.t[np.minimum(last_out, len(res.t) - 1)], np.inf)
+    success = (settled & (settle <= duration - config["settle_hold_s"])
+               & (theta[-1] < config["success_tol"]))
+    rms = np.sqrt(np.mean(res.x[:, :, sim.THETA] ** 2, axis=0))
+    tau = np.abs(res.tau[1:])
+    peak = tau.max(axis=0)
+    sat = np.mean(tau >= NOMINAL.torque_limit * (1.0 - 1e-9), axis=0)
+    wheel = np.abs(res.x[-1, :, sim.WHEEL_VEL])
+    cols = (success.astype(float), res.fall_time, settle, rms, peak, sat, wheel)
+    return [tuple(float(c[i]) for c in cols) for i in range(n)]
+
+
+def _chunk_job(args):
+    return simulate_samples(*args)
+
+# =========================
+# ===== CACHE =============
+# =========================
+
+class ResultCache:
+    """
+    Per-sample results on disk: an SQLite table keyed by sample_key(), one
+    REAL column per metric. Written only by the parent process.
+    """
+
+    def __init__(self, path=CACHE_PATH):
+        self.path = path
+        self.db = sqlite3.connect(path)
+        cols = ", ".join(f"{m} REAL" for m in METRICS)
+        self.db.execute(f"CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, {cols})")
+
+    def get_many(self, keys):
+        found = {}
+        for i in range(0, len(keys), 500):
+            part = keys[i:i + 500]
+            marks = ",".join("?" * len(part))
+            for row in self.db.execute(f"SELECT key, {', '.join(METRICS)} FROM results "
+                                       f"WHERE key IN ({marks})", part):
+                found[row[0]] = row[1:]
+        return found
+
+    def put_many(self, rows):
+        marks = ",".join("?" * (len(METRICS) + 1))
+        with self.db:
+            self.db.executemany(f"INSERT OR REPLACE INTO results VALUES ({marks})",
+                                [(k,) + tuple(v) for k, v in rows])
+
+    def close(self):
+        self.db.close()
+
+
+def evaluate(controllers, samples, workers=None, cache=None):
+    """
+    {controller: (gains, metrics array (n_samples, len(METRICS)))}, with
+    cached samples read back and the rest simulated in CHUNK-sized jobs on
+    a process pool. Returns also (cached, simulated) counts.
+    """
+    config = settings()
+    workers = workers or os.cpu_count() or 1
+    plan = {}
+    jobs = []
+    for controller in controllers:
+        gains = controller_gains(controller)
+        keys = [sample_key(controller, gains, s, config) for s in samples]
+        found = cache.get_many(keys) if cache is not None else {}
+        todo = [i for i, k in enumerate(keys) if k not in found]
+        plan[controller] = (gains, keys, found)
+        for j in range(0, len(todo), CHUNK):
+            idx = todo[j:j + CHUNK]
+            jobs.append((controller, idx, (controller, gains, [samples[i] for i in idx], config)))
+
+    if jobs:
+        if workers > 1 and len(jobs) > 1:
+            with ProcessPoolExecutor(min(workers, len(jobs))) as pool:
+                outputs = list(pool.map(_chunk_job, [job[2] for job in jobs]))
+        else:
+            outputs = [_chunk_job(job[2]) for job in jobs]
+    else:
+        outputs = []
+
+    new = {c: {} for c in controllers}
+    for (controller, idx, _), rows in zip(jobs, outputs):
+        keys = plan[controller][1]
+        for i, row in zip(idx, rows):
+            new[controller][keys[i]] = row
+    if cache is not None:
+        cache.put_many([kv for c in controllers for kv in new[c].items()])
+
+    results = {}
+    cached = simulated = 0
+    for controller in controllers:
+        gains, keys, found = plan[controller]
+        rows = [found[k] if k in found else new[controller][k] for k in keys]
+        cached += len(found)
+        simulated += len(new[controller])
+        results[controller] = (gains, np.array(rows, dtype=float).reshape(len(keys), len(METRICS)))
+    return results, cached, simulated
+
+# =========================
+# ===== REPORTING =========
+# =========================
+
+def wilson(successes, n, z=1.96):
+    """
+    95% Wilson score interval for a success probability.
+    """
+    if n == 0:
+        return 0.0, 1.0
+    p = successes / n
+    denom = 1.0 + z * z / n
+    centre = (p + z * z / (2 * n)) / denom
+    half = z * math.sqrt(p * (1 - p) / n + z * z / (4 * n * n)) / denom
+    return max(0.0, centre - half), min(1.0, centre + half)
+
+
+def sensitivity(samples, success):
+    """
+    {parameter: correlation of its (log) value with success}; the sign says
+    which direction hurts, the size how much the failures depend on it.
+    """
+    out = {}
+    if success.all() or not success.any():
+        return out
+    for name in UNCERTAINTY:
+        v = np.log([s["params"][name] for s in samples])
+        if v.std() > 0:
+            out[name] = float(np.corrcoef(v, success.astype(float))[0, 1])
+    return out
+
+
+def summarize(controller, gains, rows, samples):
+    m = {name: rows[:, i] for i, name in enumerate(METRICS)}
+    success = m["success"] > 0.5
+    n, k = len(rows), int(success.sum())
+    lo, hi = wilson(k, n)
+    lines = [f"{controller:10s} gains {tuple(round(g, 4) for g in gains)} | "
+             f"success {k}/{n} = {100 * k / n:.1f}% (95% CI {100 * lo:.1f}-{100 * hi:.1f}%) | "
+             f"fell {int(np.isfinite(m['fall_time']).sum())}"]
+    if k:
+        for name, scale, unit in (("settle_s", 1e3, "ms"), ("rms_theta", 1e3, "mrad"),
+                                  ("peak_tau", 1.0, "Nm"), ("sat_frac", 100.0, "%"),
+                                  ("final_wheel", 1.0, "rad/s")):
+            p5, p50, p95 = np.percentile(m[name][success] * scale, [5, 50, 95])
+            lines.append(f"    {name:11s} p5 {p5:9.2f}  p50 {p50:9.2f}  p95 {p95:9.2f} {unit}  (successful runs)")
+    sens = sensitivity(samples, success)
+    if sens:
+        worst = sorted(sens.items(), key=lambda kv: -abs(kv[1]))[:3]
+        lines.append("    failures follow " + ", ".join(
+            f"{'high' if r < 0 else 'low'} {name} (r={r:+.2f})" for name, r in worst))
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Monte Carlo robustness of the controllers.")
+    parser.add_argument("controllers", nargs="*", default=None, help="default: all")
+    parser.add_argument("--samples", type=int, default=SAMPLES)
+    parser.add_argument("--seed", type=int, default=SEED)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--cache", default=CACHE_PATH)
+    parser.add_argument("--no-cache", action="store_true")
+    args = parser.parse_args()
+
+    controllers = args.controllers or controller_names()
+    samples = draw_samples(args.samples, args.seed)
+    cache = None if args.no_cache else ResultCache(args.cache)
+    t0 = time.perf_counter()
+    try:
+        results, cached, simulated = evaluate(controllers, samples, args.workers, cache)
+    finally:
+        if cache is not None:
+            cache.close()
+    wall = time.perf_counter() - t0
+    print(f"[MC] {len(samples)} samples x {len(controllers)} controllers | {simulated} simulated, "
+          f"{cached} from cache | {wall:.1f} s")
+    for controller in controllers:
+        gains, rows = results[controller]
+        print(summarize(controller, gains, rows, samples))
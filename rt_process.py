@@ -0,0 +1,457 @@
+#!/usr/bin/env python3
+# Process-Isolated Control Loop with Shared-Memory Exchange
+# - The sense-control-actuate loop (AIMain's law) and odrive.loop() run in
+#   their own process, optionally pinned to a CPU with a real-time priority
+# - A supervisor process owns logging, console output and operator commands;
+#   nothing it does can delay a control tick
+# - One multiprocessing.shared_memory block carries:
+#     header  int64[8]       counters, command word, gain seqlock, status
+#     gains   float64[4]     Kp, Kd, Kw, use_schedule (supervisor -> loop)
+#     ring    float64[N, 8]  per-tick state, same fields as a telemetry record
+#                            (loop -> supervisor)
+# - Each region has a single writer: the ring publishes its count after the
+#   row is written, gains use a seqlock (odd sequence = update in progress)
+#
+# Usage: python rt_process.py --sim 10 [--cpu 2] [--priority 50]
+#        (AIMain.py with RUN_MODE = "process" uses the same supervisor)
+
+import asyncio
+import math
+import multiprocessing as mp
+import os
+import signal
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from gains import load_gains
+from odrive_can import wheel_feedback
+from telemetry import FLAG_SATURATED, FLAG_INVALID, FLAG_STALE
+
+# =========================
+# ====== USER CONFIG ======
+# =========================
+
+RING_CAPACITY = 1 << 14     # ≈16 s of ticks at 1 kHz before the supervisor must drain
+SCRIPT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "AIMain.py")
+
+# Header slots
+WRITE_COUNT = 0      # ring records published
+COMMAND = 1          # supervisor -> loop, one of CMD_*
+GAIN_SEQ = 2         # gains seqlock sequence
+STATUS = 3           # loop -> supervisor, one of STATUS_*
+MISSES = 4           # deadline misses so far
+PID = 5
+HEADER_SLOTS = 8
+
+CMD_RUN, CMD_STOP, CMD_ESTOP = 0, 1, 2
+STATUS_STARTING, STATUS_RUNNING, STATUS_DONE, STATUS_ESTOPPED = 0, 1, 2, 3
+
+# Ring record columns (order of Telemetry.log's arguments)
+RING_FIELDS = ("t", "theta", "theta_dot", "wheel_rate", "tau_nm", "drive_cmd", "dt", "flags")
+
+# =========================
+# ===== SHARED MEMORY =====
+# =========================
+
+class SharedBlock:
+    """
+    NumPy views of the header, gains and ring inside one shared memory block.
+    """
+
+    def __init__(self, shm, capacity):
+        self.shm = shm
+        self.capacity = capacity
+        buf = shm.buf
+        self.header = np.ndarray((HEADER_SLOTS,), dtype=np.int64, buffer=buf, offset=0)
+        self.gains = np.ndarray((4,), dtype=np.float64, buffer=buf, offset=8 * HEADER_SLOTS)
+        self.ring = np.ndarray((capacity, len(RING_FIELDS)), dtype=np.float64, buffer=buf,
+                               offset=8 * (HEADER_SLOTS + 4))
+
+    @staticmethod
+    def nbytes(capacity):
+        return 8 * (HEADER_SLOTS + 4 + capacity * len(RING_FIELDS))
+
+    @classmethod
+    def create(cls, capacity=RING_CAPACITY):
+        shm = shared_memory.SharedMemory(create=True, size=cls.nbytes(capacity))
+        block = cls(shm, capacity)
+        block.header[:] = 0
+        block.gains[:] = 0.0
+        return block
+
+    @classmethod
+    def attach(cls, name, capacity):
+        # The spawned child shares the supervisor's resource tracker, so the
+        # block is unlinked once, by the supervisor's close()
+        return cls(shared_memory.SharedMemory(name=name), capacity)
+
+    def close(self):
+        # Drop the views before the buffer they point into
+        self.header = self.gains = self.ring = None
+        self.shm.close()
+
+
+# =========================
+# ===== CONTROL PROCESS ===
+# =========================
+
+def configure_realtime(cpu=None, priority=None):
+    """
+    Pin this process to one CPU and raise its scheduling priority
+    (SCHED_FIFO, falling back to a lower nice value). Returns a short
+    description of what was applied.
+    """
+    applied = []
+    if cpu is not None:
+        try:
+            os.sched_setaffinity(0, {cpu})
+            applied.append(f"cpu {cpu}")
+        except (AttributeError, OSError) as e:
+            applied.append(f"cpu {cpu} failed ({e})")
+    if priority is not None:
+        try:
+            os.sched_setscheduler(0, os.SCHED_FIFO, os.sched_param(priority))
+            applied.append(f"SCHED_FIFO {priority}")
+        except (AttributeError, OSError):
+            try:
+                os.nice(-min(19, max(1, priority // 5)))
+                applied.append(f"nice {os.nice(0)}")
+            except OSError as e:
+                applied.append(f"priority {priority} failed ({e})")
+    return ", ".join(applied) or "default scheduling"
+
+
+async def rt_controller(ai, odrive, block):
+    """
+    AIMain's control loop with the console, telemetry and gain store moved
+    out: state goes to the ring, gains and commands come from the block.
+    Without a schedule the gains are held fixed (no per-tick |θ| creep).
+    AIMain's watchdog (stalls, |θ| > WATCHDOG_ANGLE) guards it as it does
+    inline.
+    """
+    from encoder import Unwrapper
+    from startup import StartupTimer, odrive_ready, stable_rest
+    from scheduler import DeadlineScheduler
+
+    header, gains, ring = block.header, block.gains, block.ring
+    capacity = block.capacity
+
+    schedule = None
+    if gains[3] != 0.0:
+        try:
+            from lqr import GainSchedule
+            schedule = GainSchedule.load(ai.GAIN_SCHEDULE_PATH)
+        except (ImportError, OSError):
+            pass
+    Kp, Kd, Kw = float(gains[0]), float(gains[1]), float(gains[2])
+    seen_seq = int(header[GAIN_SEQ])
+    LPF_ALPHA = 0
+
+    timer = StartupTimer()
+    await odrive_ready(odrive)
+    odrive.set_controller_mode("torque_control")
+    timer.mark("odrive ready")
+    rest_turns = await stable_rest(ai.read_raw_angle_turns)
+    unwrap = Unwrapper(initial=rest_turns)
+    timer.mark("rest reading")
+    print(f"[RT] {timer.report()}")
+
+    theta = 0.0
+    theta_prev = 0.0
+    theta_dot = 0.0
+    wheel_held = 0.0    # last fresh wheel rate (drive units), logged while stale
+    torque_limit_nm = ai.TORQUE_LIMIT_NM
+    torque_limit_drive = ai.to_drive_units(torque_limit_nm)
+    scale = 2.0 * math.pi / ai.GEAR_RATIO
+
+    loop = asyncio.get_running_loop()
+    t_prev = loop.time()
+    sched = DeadlineScheduler(ai.CONTROL_DT)
+    header[STATUS] = STATUS_RUNNING
+    n = 0
+
+    wd = ai.make_watchdog(odrive)
+    if wd is not None:
+        wd.arm()
+    try:
+        while sched.elapsed < ai.RUN_SECONDS:
+            command = header[COMMAND]
+            if command != CMD_RUN:
+                if command == CMD_ESTOP:
+                    odrive.estop()
+                    header[STATUS] = STATUS_ESTOPPED
+                break
+
+            # Gain update: read only between two equal, even sequence numbers
+            seq = header[GAIN_SEQ]
+            if seq != seen_seq and not seq & 1:
+                g = gains.tolist()
+                if header[GAIN_SEQ] == seq:
+                    Kp, Kd, Kw = g[0], g[1], g[2]
+                    if g[3] == 0.0:
+                        schedule = None
+                    seen_seq = seq
+
+            raw_turns = ai.read_raw_angle_turns()
+            t_now = loop.time()
+            t_sample = ai.sample_time()
+            dt = max(1e-4, t_sample - t_prev)
+            if raw_turns is not None:
+                theta = scale * (unwrap.update(raw_turns) - rest_turns)
+                t_prev = t_sample
+                raw_theta_dot = (theta - theta_prev) / dt
+                theta_dot = (1.0 - LPF_ALPHA) * theta_dot + LPF_ALPHA * raw_theta_dot
+                theta_prev = theta
+
+            # Heartbeat + angle limit; the watchdog e-stops on its own
+            if wd is not None and wd.beat(theta):
+                print(f"[RT] Watchdog fired | θ={theta:+.3f} rad. E-stopped.")
+                header[STATUS] = STATUS_ESTOPPED
+                break
+
+            # Stale wheel feedback: wheel term gated off, e-stop once too old
+            wheel_vel, wheel_age, wheel_stale = wheel_feedback(odrive)
+            if not wheel_stale:
+                wheel_held = float(wheel_vel)
+            elif wheel_age > ai.WHEEL_STALE_ESTOP_S:
+                print(f"[RT] Wheel feedback {wheel_age * 1e3:.0f} ms old > "
+                      f"{ai.WHEEL_STALE_ESTOP_S * 1e3:.0f} ms. E-stop.")
+                odrive.estop()
+                header[STATUS] = STATUS_ESTOPPED
+                break
+            wheel_rate = ai.from_velocity_units(wheel_held)
+
+            if schedule is not None:
+                Kp, Kd, Kw = schedule.lookup(theta)
+            tau_cmd_nm = -(Kp * theta + Kd * theta_dot + (0.0 if wheel_stale else Kw * wheel_rate))
+            flags = FLAG_SATURATED if abs(tau_cmd_nm) > torque_limit_nm else 0
+            if raw_turns is None:
+                flags |= FLAG_INVALID
+            if wheel_stale:
+                flags |= FLAG_STALE
+            tau_cmd_nm = max(-torque_limit_nm, min(torque_limit_nm, tau_cmd_nm))
+            drive_cmd = max(-torque_limit_drive, min(torque_limit_drive, ai.to_drive_units(tau_cmd_nm)))
+
+            if abs(theta) > ai.FALLBACK_ANGLE:
+                odrive.estop()
+                header[STATUS] = STATUS_ESTOPPED
+                break
+
+            odrive.set_torque(drive_cmd)
+
+            ring[n % capacity] = (t_now, theta, theta_dot, wheel_rate, tau_cmd_nm, drive_cmd, dt, flags)
+            n += 1
+            header[WRITE_COUNT] = n
+            header[MISSES] = sched.misses
+
+            await sched.wait_next()
+    finally:
+        if wd is not None:
+            wd.stop()
+
+    if header[STATUS] == STATUS_RUNNING:
+        header[STATUS] = STATUS_DONE
+    print(f"[RT] {sched.report()}")
+    if wd is not None:
+        print(f"[RT] {wd.report()}")
+
+
+async def _run_hardware(ai, block):
+    if ai.ODRIVE_DRIVER == "adapter":
+        from odrive_can import ODriveAdapter
+        odrive = ODriveAdapter(ai.ODRIVE_BUS_ID)
+    else:
+        import pyodrivecan
+        odrive = pyodrivecan.ODriveCAN(ai.ODRIVE_BUS_ID)
+    odrive.clear_errors(identify=False)
+    odrive.initCanBus()
+    feedback = asyncio.ensure_future(odrive.loop())
+    try:
+        await rt_controller(ai, odrive, block)
+    except BaseException:
+        # Whatever ends the loop early (a signal, a crash) leaves the wheel
+        # under the last torque: e-stop before unwinding
+        odrive.estop()
+        block.header[STATUS] = STATUS_ESTOPPED
+        raise
+    finally:
+        feedback.cancel()
+
+
+def control_process(shm_name, capacity, cpu=None, priority=None, sim_seconds=None, theta0=0.05):
+    """
+    Entry point of the control process. With sim_seconds the loop drives
+    the simulated rig (sim_hardware.py) instead of the hardware.
+
+    Ctrl-C on the terminal reaches the whole process group; the child
+    ignores it and leaves shutdown to the supervisor's CMD_ESTOP.
+    """
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    block = SharedBlock.attach(shm_name, capacity)
+    block.header[PID] = os.getpid()
+    print(f"[RT] control process {os.getpid()}: {configure_realtime(cpu, priority)}")
+    try:
+        if sim_seconds is not None:
+            from sim_hardware import rig_for_script
+            rig, ai = rig_for_script(SCRIPT_PATH, theta0=theta0)
+            rig.run(lambda odrive: rt_controller(ai, odrive, block), sim_seconds)
+        else:
+            import importlib.util
+            spec = importlib.util.spec_from_file_location("AIMain", SCRIPT_PATH)
+            ai = importlib.util.module_from_spec(spec)
+            spec.loader.exec_module(ai)
+            asyncio.run(_run_hardware(ai, block))
+    finally:
+        if block.header[STATUS] in (STATUS_STARTING, STATUS_RUNNING):
+            block.header[STATUS] = STATUS_DONE
+        block.close()
+
+
+# =========================
+# ====== SUPERVISOR =======
+# =========================
+
+class RTSupervisor:
+    """
+    Starts the control process and talks to it through shared memory.
+    Every method here is safe to call at any pace from the supervisor.
+    """
+
+    def __init__(self, capacity=RING_CAPACITY, cpu=None, priority=None,
+                 sim_seconds=None, theta0=0.05, use_schedule=True):
+        self.block = SharedBlock.create(capacity)
+        g = load_gains("pd_wheel", Kp=-120.0, Kd=-20.0, Kw=10.0)
+        self.block.gains[:] = (g["Kp"], g["Kd"], g["Kw"], 1.0 if use_schedule else 0.0)
+        self._args = (self.block.shm.name, capacity, cpu, priority, sim_seconds, theta0)
+        self.process = None
+        self.read_count = 0
+        self.lost = 0
+
+    def start(self):
+        ctx = mp.get_context("spawn")
+        # Not daemonic, so the loop can start AIMain's process-mode watchdog;
+        # close() still stops it
+        self.process = ctx.Process(target=control_process, args=self._args,
+                                   name="rt-control", daemon=False)
+        self.process.start()
+        return self
+
+    @property
+    def alive(self):
+        return self.process is not None and self.process.is_alive()
+
+    @property
+    def status(self):
+        return int(self.block.header[STATUS])
+
+    @property
+    def misses(self):
+        return int(self.block.header[MISSES])
+
+    def set_gains(self, Kp, Kd, Kw):
+        """
+        Replace the gains (and turn off the schedule) from the next tick on.
+        """
+        header, gains = self.block.header, self.block.gains
+        header[GAIN_SEQ] += 1
+        gains[:] = (Kp, Kd, Kw, 0.0)
+        header[GAIN_SEQ] += 1
+
+    def stop(self):
+        self.block.header[COMMAND] = CMD_STOP
+
+    def estop(self):
+        self.block.header[COMMAND] = CMD_ESTOP
+
+    def read_new(self):
+        """
+        Ring records published since the last call, as a (k, 8) array in
+        RING_FIELDS order. Records overwritten before they were read are
+        counted in `lost`.
+        """
+        header, ring, cap = self.block.header, self.block.ring, self.block.capacity
+        end = int(header[WRITE_COUNT])
+        start = max(self.read_count, end - cap)
+        self.lost += start - self.read_count
+        idx = np.arange(start, end) % cap
+        rows = ring[idx]
+        # Rows the writer lapped while we were copying are not trustworthy
+        overrun = int(header[WRITE_COUNT]) - cap - start
+        if overrun > 0:
+            rows = rows[overrun:]
+            self.lost += overrun
+        self.read_count = end
+        return rows
+
+    def join(self, timeout=None):
+        if self.process is not None:
+            self.process.join(timeout)
+
+    def close(self):
+        if self.alive:
+            self.stop()
+            self.join(2.0)
+            if self.alive:
+                self.process.terminate()
+        self.block.close()
+        self.block.shm.unlink()
+
+    def run_console(self, telemetry=None, poll_s=0.01):
+        """
+        Drain the ring into telemetry until the control process exits.
+        Ctrl-C sends an e-stop.
+        """
+        try:
+            while True:
+                running = self.alive
+                for r in self.read_new().tolist():
+                    if telemetry is not None:
+                        telemetry.log(*r[:7], int(r[7]))
+                if not running:
+                    break
+                time.sleep(poll_s)
+        except KeyboardInterrupt:
+            print("KeyboardInterrupt: e-stop")
+            self.estop()
+            self.join(2.0)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Run AIMain's control loop in its own process.")
+    parser.add_argument("--sim", type=float, default=None, metavar="SECONDS",
+                        help="drive the simulated rig for this many virtual seconds")
+    parser.add_argument("--cpu", type=int, default=None)
+    parser.add_argument("--priority", type=int, default=None)
+    args = parser.parse_args()
+
+    sup = RTSupervisor(cpu=args.cpu, priority=args.priority, sim_seconds=args.sim).start()
+    records = 0
+    worst_theta = 0.0
+    retuned = False
+    try:
+        while True:
+            running = sup.alive
+            rows = sup.read_new()
+            if len(rows):
+                records += len(rows)
+                worst_theta = max(worst_theta, float(np.abs(rows[:, 1]).max()))
+                if not retuned and rows[-1, 0] > 4.0:
+                    # Operator-style gain update mid-run: continuous LQR gains
+                    from lqr import pendulum_gains
+                    sup.set_gains(*pendulum_gains())
+                    retuned = True
+            if not running:
+                break
+            time.sleep(0.05)
+    except KeyboardInterrupt:
+        print("KeyboardInterrupt: e-stop")
+        sup.estop()
+        sup.join(2.0)
+    finally:
+        print(f"[SUP] {records} ticks received, {sup.lost} lost | status {sup.status} | "
+              f"misses {sup.misses} | max |θ| {worst_theta:.3f} rad")
+        sup.close()
@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+# Deadline-Based Fixed-Rate Scheduler for asyncio Control Loops
+# - Ticks land on absolute deadlines t0 + k*period, so compute time is not
+#   added on top of the sleep the way `await asyncio.sleep(CONTROL_DT)` does
+# - Hybrid wait: asyncio.sleep() until SPIN_S before the deadline, then spin
+#   on asyncio.sleep(0) so odrive.loop() still runs while we spin
+# - Records lateness of every tick: achieved rate, jitter percentiles and
+#   deadline misses
+# - Uses loop.time(), so it runs unchanged on sim_hardware's virtual clock
+#
+# Usage in a controller:
+#     sched = DeadlineScheduler(CONTROL_DT)
+#     while sched.elapsed < RUN_SECONDS:
+#         ...one control step...
+#         await sched.wait_next()
+#     print(sched.report())
+
+import asyncio
+from array import array
+
+# =========================
+# ====== USER CONFIG ======
+# =========================
+
+SPIN_S = 0.0011          # spin this long before each deadline: epoll rounds every
+                         # timeout up to a whole ms, so the sleep must end >= 1 ms early
+STUCK_YIELDS = 3         # clock unchanged across this many yields: virtual clock, jump
+HISTORY = 1 << 16        # ticks of lateness kept for percentiles
+
+# =========================
+# ===== IMPLEMENTATION ====
+# =========================
+
+class DeadlineScheduler:
+    """
+    Fixed-rate pacing on absolute monotonic deadlines.
+
+    A tick whose wake-up is later than miss_frac*period counts as a miss.
+    If a tick overruns by whole periods those deadlines are skipped (counted
+    in `skipped`) rather than fired back-to-back to catch up.
+    """
+
+    def __init__(self, period, spin_s=SPIN_S, miss_frac=0.5, history=HISTORY):
+        self.period = period
+        self.spin_s = spin_s
+        self.miss_after = miss_frac * period
+        self.history = history
+        self.lateness = array("d", bytes(8 * history))   # ring of wake-up lateness, s
+
+        self.ticks = 0
+        self.misses = 0
+        self.skipped = 0
+        self.max_late = 0.0
+        self._loop = None
+        self._t0 = None
+        self._deadline = None
+
+    def start(self):
+        """
+        Anchor the deadline grid at the current loop time. Called lazily by
+        elapsed / wait_next if not called explicitly.
+        """
+        self._loop = asyncio.get_running_loop()
+        self._t0 = self._loop.time()
+        self._deadline = self._t0 + self.period
+        return self
+
+    @property
+    def elapsed(self):
+        if self._t0 is None:
+            self.start()
+        return self._loop.time() - self._t0
+
+    async def wait_next(self):
+        """
+        Wait for the next deadline and record how late we woke up.
+        """
+        if self._deadline is None:
+            self.start()
+        loop = self._loop
+        deadline = self._deadline
+
+        remaining = deadline - loop.time()
+        if remaining > self.spin_s:
+            await asyncio.sleep(remaining - self.spin_s)
+        now = loop.time()
+        stuck = 0
+        while now < deadline:
+            await asyncio.sleep(0)
+            later = loop.time()
+            if later == now:
+                stuck += 1
+                if stuck >= STUCK_YIELDS:
+                    # Clock does not move across yields (virtual clock): jump.
+                    # A real clock never gets here, where a sleep this short
+                    # would be rounded up to a whole ms
+                    await asyncio.sleep(deadline - now)
+                    later = loop.time()
+            else:
+                stuck = 0
+            now = later
+
+        late = now - deadline
+        self.lateness[self.ticks % self.history] = late
+        self.ticks += 1
+        if late > self.max_late:
+            self.max_late = late
+        if late > self.miss_after:
+            self.misses += 1
+        if late >= self.period:
+            missed = int(late // self.period)
+            self.skipped += missed
+            deadline += missed * self.period
+        self._deadline = deadline + self.period
+
+    def stats(self):
+        n = min(self.ticks, self.history)
+        lat = sorted(self.lateness[:n])
+
+        def pct(p):
+            return lat[min(n - 1, int(p / 100.0 * n))] if n else 0.0
+
+        elapsed = self.elapsed if self._t0 is not None else 0.0
+        return {
+            "ticks": self.ticks,
+            "rate_hz": self.ticks / elapsed if elapsed > 0 else 0.0,
+            "target_hz": 1.0 / self.period,
+            "p50_us": pct(50) * 1e6,
+            "p99_us": pct(99) * 1e6,
+            "p999_us": pct(99.9) * 1e6,
+            "max_us": self.max_late * 1e6,
+            "misses": self.misses,
+            "skipped": self.skipped,
+        }
+
+    def report(self):
+        s = self.stats()
+        return (f"[SCHED] {s['ticks']} ticks | {s['rate_hz']:.1f}/{s['target_hz']:.0f} Hz | "
+                f"lateness p50={s['p50_us']:.0f} us p99={s['p99_us']:.0f} us "
+                f"p99.9={s['p999_us']:.0f} us max={s['max_us']:.0f} us | "
+                f"misses={s['misses']} skipped={s['skipped']}")
+
+
+if __name__ == "__main__":
+    async def demo():
+        sched = DeadlineScheduler(0.001)
+        while sched.elapsed < 2.0:
+            await sched.wait_next()
+        print(sched.report())
+
+    asyncio.run(demo())
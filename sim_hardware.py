@@ -0,0 +1,505 @@
+#!/usr/bin/env python3
+# Virtual-Clock Hardware Harness
+# - Stand-ins for smbus.SMBus and pyodrivecan.ODriveCAN backed by the plant
+#   model in pendulum_sim.py
+# - Event loop whose clock is virtual: sleeps complete instantly, timers fire
+#   in order, and time only moves by simulated sleeps and bus transactions
+# - Loads the unmodified scripts (AIMain.py, Main.py, new_Main.py, ...) with
+#   the stand-ins injected and runs their controller(odrive) coroutine
+#
+# Usage: python sim_hardware.py AIMain.py --seconds 600
+
+import asyncio
+import contextlib
+import datetime as _dt
+import importlib.util
+import math
+import os
+import selectors
+import sys
+import time as _time
+import types
+from pathlib import Path
+
+import random
+
+from encoder import FORMATS, DIAG_OCF, DIAG_COF, DIAG_COMP_LOW
+from pendulum_sim import Plant, PendulumParams
+
+# =========================
+# ====== USER CONFIG ======
+# =========================
+
+# Virtual cost of each hardware transaction, in seconds
+I2C_READ_S = 120e-6      # 2-byte AS5048 read at 400 kHz incl. addressing
+I2C_BYTE_S = 22.5e-6     # each further data byte (9 clocks at 400 kHz)
+CAN_FRAME_S = 0.0        # set_torque is fire-and-forget on the real bus
+
+# ODrive cyclic feedback (encoder estimates) period, seconds
+FEEDBACK_PERIOD_S = 0.010
+# Age past which SimAdapterODrive.feedback() reports stale (odrive_can.STALE_AFTER_S)
+STALE_AFTER_S = 0.025
+
+ENC_I2C_ADDR = 0x40
+ENC_REG_RAW = 0xFE
+
+# Wall-clock date the virtual clock starts at (only datetime.now() sees it)
+VIRTUAL_EPOCH = _dt.datetime(2000, 1, 1)
+
+# =========================
+# ===== VIRTUAL CLOCK =====
+# =========================
+
+class RigStopped(Exception):
+    """
+    Raised by a stand-in to end a run early (e.g. a replay ran out of data).
+    """
+
+
+class VirtualClock:
+    """
+    Monotonic virtual time in seconds. Only advances when told to.
+    """
+    __slots__ = ("now",)
+
+    def __init__(self, start=0.0):
+        self.now = start
+
+    def advance(self, dt):
+        if dt > 0.0:
+            self.now += dt
+
+
+class RealClock:
+    """
+    VirtualClock's interface on the real monotonic clock, for runs paced in
+    real time: `now` is seconds since creation and advance() busy-waits, as
+    the bus transaction it stands for would block.
+    """
+    __slots__ = ("_t0",)
+
+    def __init__(self):
+        self._t0 = _time.monotonic()
+
+    @property
+    def now(self):
+        return _time.monotonic() - self._t0
+
+    def advance(self, dt):
+        end = _time.monotonic() + dt
+        while _time.monotonic() < end:
+            pass
+
+
+class _VirtualSelector(selectors.BaseSelector):
+    """
+    Wraps a real selector so the loop's self-pipe keeps working, but instead
+    of blocking for `timeout` it polls and jumps the virtual clock forward.
+    """
+
+    def __init__(self, clock):
+        self._clock = clock
+        self._real = selectors.DefaultSelector()
+
+    def register(self, fileobj, events, data=None):
+        return self._real.register(fileobj, events, data)
+
+    def unregister(self, fileobj):
+        return self._real.unregister(fileobj)
+
+    def modify(self, fileobj, events, data=None):
+        return self._real.modify(fileobj, events, data)
+
+    def select(self, timeout=None):
+        if timeout is None:
+            # Nothing scheduled: only real I/O (e.g. an executor) can wake us
+            return self._real.select(None)
+        events = self._real.select(0)
+        if not events:
+            self._clock.advance(timeout)
+        return events
+
+    def close(self):
+        self._real.close()
+
+    def get_map(self):
+        return self._real.get_map()
+
+
+class VirtualClockEventLoop(asyncio.SelectorEventLoop):
+    """
+    asyncio loop whose time() is the virtual clock, so asyncio.sleep() and
+    loop.time() run as fast as the CPU allows but in deterministic order.
+    """
+
+    def __init__(self, clock):
+        super().__init__(selector=_VirtualSelector(clock))
+        self.clock = clock
+
+    def time(self):
+        return self.clock.now
+
+
+def virtual_time_module(clock, wall_start=None):
+    """
+    Drop-in for the parts of the `time` module the scripts use.
+    """
+    if wall_start is None:
+        wall_start = VIRTUAL_EPOCH.timestamp()
+    ns = types.SimpleNamespace()
+    ns.time = lambda: wall_start + clock.now
+    ns.monotonic = lambda: clock.now
+    ns.perf_counter = lambda: clock.now
+    ns.monotonic_ns = lambda: int(clock.now * 1e9)
+    ns.perf_counter_ns = ns.monotonic_ns
+    ns.sleep = clock.advance
+    return ns
+
+
+def virtual_datetime_class(clock, epoch=VIRTUAL_EPOCH):
+    """
+    datetime subclass whose now() follows the virtual clock.
+    """
+    class VirtualDatetime(_dt.datetime):
+        @classmethod
+        def now(cls, tz=None):
+            return epoch + _dt.timedelta(seconds=clock.now)
+    return VirtualDatetime
+
+
+# =========================
+# ===== ENCODER (I2C) =====
+# =========================
+
+class SimSMBus:
+    """
+    Stand-in for smbus.SMBus serving the AS5048 registers 0xFA..0xFF (AGC,
+    diagnostics, magnitude, angle). The angle is the plant angle plus a fixed
+    mounting offset encoded in one of encoder.FORMATS. A read costs
+    I2C_READ_S plus I2C_BYTE_S per byte beyond two, of virtual time.
+
+    With dropout > 0 that fraction of reads see a magnet-field dropout:
+    CORDIC overflow in diagnostics and a garbage angle.
+    """
+
+    def __init__(self, rig, encoding="split", offset_turns=0.25, read_cost=I2C_READ_S,
+                 dropout=0.0, seed=0):
+        self.rig = rig
+        self.encode = FORMATS[encoding][1]
+        self.offset_turns = offset_turns
+        self.read_cost = read_cost
+        self.dropout = dropout
+        self._rng = random.Random(seed)
+        self.reads = 0
+        self.dropouts = 0
+
+    def read_i2c_block_data(self, addr, reg, length):
+        rig = self.rig
+        rig.clock.advance(self.read_cost + max(0, length - 2) * I2C_BYTE_S)
+        rig.advance()
+        self.reads += 1
+        turns = (self.offset_turns + rig.plant.theta / (2.0 * math.pi)) % 1.0
+        hi, lo = self.encode(turns)
+        agc, diag, magnitude = 0x80, DIAG_OCF, 0x1F00
+        if self.dropout and self._rng.random() < self.dropout:
+            self.dropouts += 1
+            agc, diag, magnitude = 0xFF, DIAG_OCF | DIAG_COF | DIAG_COMP_LOW, 0x0040
+            hi, lo = self._rng.randrange(256), self._rng.randrange(256)
+        image = [agc, diag, magnitude >> 6, magnitude & 0x3F, hi, lo]
+        start = reg - 0xFA
+        if not 0 <= start < len(image):
+            return [0] * length
+        data = image[start:start + length]
+        return data + [0] * (length - len(data))
+
+    def close(self):
+        pass
+
+
+# =========================
+# ======== ODRIVE =========
+# =========================
+
+class SimODrive:
+    """
+    Stand-in for pyodrivecan.ODriveCAN driving the wheel of the plant.
+
+    velocity/position are what the last cyclic feedback message carried, as
+    on the real bus: None until loop() has delivered the first one, then
+    refreshed every FEEDBACK_PERIOD_S.
+    """
+
+    def __init__(self, rig, velocity_units="turns_s", torque_scale=1.0,
+                 feedback_period=FEEDBACK_PERIOD_S, send_cost=CAN_FRAME_S):
+        self.rig = rig
+        self.velocity_units = velocity_units
+        self.torque_scale = torque_scale   # Nm per commanded unit (Kt if "A")
+        self.feedback_period = feedback_period
+        self.send_cost = send_cost
+        self.velocity = None
+        self.position = None
+        self.controller_mode = None
+        self.axis_state = None
+        self.estopped = False
+        self.torque_frames = 0
+        self.running = True
+
+    def _refresh_feedback(self):
+        plant = self.rig.plant
+        self.rig.advance()
+        vel = plant.wheel_vel
+        if self.velocity_units == "turns_s":
+            vel /= 2.0 * math.pi
+        self.velocity = vel
+        self.position = plant.wheel_pos / (2.0 * math.pi)
+
+    def clear_errors(self, identify=False):
+        self.estopped = False
+
+    def initCanBus(self):
+        pass
+
+    def setAxisState(self, state):
+        self.axis_state = state
+
+    def set_controller_mode(self, mode):
+        self.controller_mode = mode
+
+    def set_torque(self, torque):
+        rig = self.rig
+        rig.clock.advance(self.send_cost)
+        self.torque_frames += 1
+        if self.estopped:
+            return
+        rig.release()
+        rig.plant.set_torque(rig.clock.now, float(torque) * self.torque_scale)
+
+    def estop(self):
+        self.estopped = True
+        self.rig.plant.set_torque(self.rig.clock.now, 0.0)
+
+    async def loop(self):
+        while self.running:
+            self._refresh_feedback()
+            await asyncio.sleep(self.feedback_period)
+
+
+class SimAdapterODrive(SimODrive):
+    """
+    SimODrive with odrive_can.ODriveAdapter's feedback(): each cyclic
+    message is stamped on the rig clock, so the age and stale flag the
+    scripts see follow the simulated bus.
+    """
+
+    def __init__(self, rig, stale_after=STALE_AFTER_S, **kwargs):
+        super().__init__(rig, **kwargs)
+        self.stale_after = stale_after
+        self.feedback_time = None
+
+    def _refresh_feedback(self):
+        super()._refresh_feedback()
+        self.feedback_time = self.rig.clock.now
+
+    def feedback(self):
+        t = self.feedback_time
+        if t is None:
+            return None, None, math.inf, True
+        age = self.rig.clock.now - t
+        return self.position, self.velocity, age, age > self.stale_after
+
+    def report(self):
+        return f"[CAN] simulated adapter, {self.torque_frames} torque frames"
+
+
+# =========================
+# ========= RIG ===========
+# =========================
+
+class SimRig:
+    """
+    One simulated rig: virtual clock, plant, encoder bus and ODrive.
+
+    With hold=True the pendulum is "held by hand" exactly upright through the
+    scripts' startup and zeroing, and released at theta0 on the first torque
+    command; otherwise it starts at theta0 and falls freely from t = 0.
+
+    With real_time=True the rig runs on the real clock and a normal event
+    loop (RealClock), so the scripts' pacing is measured as it would be on
+    hardware; the plant is still integrated in the scripts' thread.
+    """
+
+    real_time = False
+
+    def __init__(self, params=PendulumParams(), theta0=0.05, encoding="split",
+                 velocity_units="turns_s", torque_scale=1.0, quiet=True, hold=True,
+                 real_time=False):
+        self.real_time = real_time
+        self.clock = RealClock() if real_time else VirtualClock()
+        self.plant = Plant(params, theta0=0.0 if hold else theta0)
+        self.theta0 = theta0
+        self.held = hold
+        self.bus = SimSMBus(self, encoding=encoding)
+        self.odrive = SimODrive(self, velocity_units=velocity_units,
+                                torque_scale=torque_scale)
+        self.quiet = quiet
+
+    def advance(self):
+        """
+        Bring the plant up to the current virtual time.
+        """
+        if self.held:
+            self.plant.t = self.clock.now
+        else:
+            self.plant.advance_to(self.clock.now)
+
+    def release(self):
+        """
+        Let go of the pendulum at theta0.
+        """
+        self.advance()
+        if self.held:
+            self.held = False
+            self.plant.theta = self.theta0
+
+    def fake_modules(self):
+        smbus = types.ModuleType("smbus")
+        smbus.SMBus = lambda *args, **kwargs: self.bus
+        pyodrivecan = types.ModuleType("pyodrivecan")
+        pyodrivecan.ODriveCAN = lambda *args, **kwargs: self.odrive
+        return {"smbus": smbus, "pyodrivecan": pyodrivecan}
+
+    def patch_clock(self, module):
+        """
+        Point a script's `time` / `datetime` globals at the virtual clock.
+        """
+        if self.real_time:
+            return
+        vtime = virtual_time_module(self.clock)
+        vdatetime = virtual_datetime_class(self.clock)
+        for name, val in list(vars(module).items()):
+            if val is _time:
+                setattr(module, name, vtime)
+            elif val is _dt.datetime:
+                setattr(module, name, vdatetime)
+
+    def load_script(self, path):
+        """
+        Import a controller script with the stand-ins in place of smbus and
+        pyodrivecan. The script's own __main__ block is not run.
+        """
+        path = Path(path)
+        saved = {name: sys.modules.get(name) for name in ("smbus", "pyodrivecan")}
+        sys.modules.update(self.fake_modules())
+        try:
+            spec = importlib.util.spec_from_file_location(f"_simrig_{path.stem}", path)
+            module = importlib.util.module_from_spec(spec)
+            with self._stdout():
+                spec.loader.exec_module(module)
+        finally:
+            for name, mod in saved.items():
+                if mod is None:
+                    sys.modules.pop(name, None)
+                else:
+                    sys.modules[name] = mod
+        self.patch_clock(module)
+        # A watchdog process would need a CAN bus of its own and the real clock;
+        # the simulated drive has neither, so it watches from a thread here
+        if getattr(module, "WATCHDOG", "") == "process":
+            module.WATCHDOG = "thread"
+        return module
+
+    @contextlib.contextmanager
+    def _stdout(self):
+        if not self.quiet:
+            yield
+            return
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            yield
+
+    async def _drive(self, controller, seconds):
+        feedback = asyncio.ensure_future(self.odrive.loop())
+        try:
+            await asyncio.wait_for(controller(self.odrive), seconds)
+        except (asyncio.TimeoutError, RigStopped):
+            pass
+        finally:
+            self.odrive.running = False
+            feedback.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await feedback
+
+    def run(self, controller, seconds=None):
+        """
+        Run controller(odrive) against the plant on a virtual-clock loop until
+        it returns or `seconds` of virtual time pass. Returns a summary dict.
+        """
+        loop = asyncio.new_event_loop() if self.real_time else VirtualClockEventLoop(self.clock)
+        wall0 = _time.perf_counter()
+        try:
+            with self._stdout():
+                loop.run_until_complete(self._drive(controller, seconds))
+        finally:
+            loop.close()
+        self.advance()
+        wall = _time.perf_counter() - wall0
+        summary = {
+            "virtual_s": self.clock.now,
+            "wall_s": wall,
+            "speedup": self.clock.now / wall if wall > 0 else math.inf,
+        }
+        summary.update(self.summary())
+        return summary
+
+    def summary(self):
+        return {
+            "encoder_reads": self.bus.reads,
+            "torque_frames": self.odrive.torque_frames,
+            "estopped": self.odrive.estopped,
+            "theta": self.plant.theta,
+        }
+
+
+def rig_for_script(module_path, adapter=None, **kwargs):
+    """
+    Build a rig whose encoder/velocity/torque units match what a script
+    expects, then load it. Returns (rig, module). adapter=True gives the
+    rig a SimAdapterODrive; by default it does when the script sets
+    ODRIVE_DRIVER = "adapter".
+    """
+    name = Path(module_path).stem
+    kwargs.setdefault("encoding", "12bit" if name == "new_Main" else "split")
+    rig = SimRig(**kwargs)
+    module = rig.load_script(module_path)
+    if adapter is None:
+        adapter = getattr(module, "ODRIVE_DRIVER", "") == "adapter"
+    if adapter:
+        rig.odrive = SimAdapterODrive(rig, torque_scale=rig.odrive.torque_scale)
+    # AIMain-style unit config
+    if hasattr(module, "VELOCITY_UNITS"):
+        rig.odrive.velocity_units = module.VELOCITY_UNITS
+    if getattr(module, "TORQUE_UNITS", "Nm") == "A":
+        rig.odrive.torque_scale = module.KT_NM_PER_A
+    return rig, module
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Run a controller script headless on the simulated plant.")
+    parser.add_argument("script", help="e.g. AIMain.py")
+    parser.add_argument("--seconds", type=float, default=None,
+                        help="virtual seconds to run (default: until the controller returns)")
+    parser.add_argument("--theta0", type=float, default=0.05, help="initial angle, rad")
+    parser.add_argument("--dropout", type=float, default=0.0,
+                        help="fraction of encoder reads hit by a magnet-field dropout")
+    parser.add_argument("--verbose", action="store_true", help="show the script's own prints")
+    args = parser.parse_args()
+
+    rig, module = rig_for_script(args.script, theta0=args.theta0, quiet=not args.verbose)
+    rig.bus.dropout = args.dropout
+    summary = rig.run(module.controller, args.seconds)
+    print(f"[SIM] {args.script}: {summary['virtual_s']:.1f} s virtual in "
+          f"{summary['wall_s']:.2f} s wall ({summary['speedup']:.0f}x) | "
+          f"{summary['encoder_reads']} encoder reads | "
+          f"{summary['torque_frames']} torque frames | "
+          f"estop={summary['estopped']} | final θ={summary['theta']:+.3f} rad")
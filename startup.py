@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+# Readiness-Driven Startup
+# - Waits on what the fixed sleeps were standing in for: ODrive feedback
+#   arriving after clear_errors/initCanBus, the first valid encoder sample,
+#   and a rest reading that has stopped moving. Each wait returns as soon
+#   as its condition holds and has a timeout
+# - StartupTimer collects a phase-by-phase breakdown, printed once the
+#   controller is about to start
+# - Waits use asyncio.sleep, so they run unchanged on sim_hardware's
+#   virtual clock
+#
+# Usage in a script:
+#     timer = StartupTimer()
+#     odrive.clear_errors(identify=False)
+#     odrive.initCanBus()
+#     feedback = asyncio.ensure_future(odrive.loop())
+#     timer.mark("clear_errors + initCanBus")
+#     await odrive_ready(odrive);             timer.mark("odrive feedback")
+#     rest = await stable_rest(read_raw_angle); timer.mark("rest reading")
+#     print(timer.report())
+
+import asyncio
+import time
+
+# =========================
+# ====== USER CONFIG ======
+# =========================
+
+POLL_S = 0.002               # how often readiness conditions are re-checked
+ODRIVE_TIMEOUT_S = 2.0       # no feedback by then: warn and carry on
+ENCODER_TIMEOUT_S = 1.0      # no valid sample by then: StartupError
+REST_WINDOW_S = 0.25         # rest = this long without moving more than REST_TOL_TURNS
+REST_TOL_TURNS = 0.002       # ≈0.7°, a few counts of the coarsest encoder format
+REST_TIMEOUT_S = 10.0        # never still: warn and use the latest reading
+
+# =========================
+# ===== IMPLEMENTATION ====
+# =========================
+
+class StartupError(RuntimeError):
+    """
+    A readiness condition that startup cannot do without never held.
+    """
+
+
+class StartupTimer:
+    """
+    Phase-by-phase startup timing. mark(name) closes the phase that began
+    at the previous mark (or at construction).
+
+    The clock is loop.time() inside a running event loop (so the virtual
+    clock in simulation) and perf_counter() otherwise. The first entry is
+    the CPU time the process had used before the timer was created, which
+    is mostly interpreter start-up and imports.
+    """
+
+    def __init__(self):
+        self.phases = [("imports (CPU)", time.process_time())]
+        self._t = self._now()
+
+    @staticmethod
+    def _now():
+        try:
+            return asyncio.get_running_loop().time()
+        except RuntimeError:
+            return time.perf_counter()
+
+    def mark(self, name):
+        now = self._now()
+        self.phases.append((name, now - self._t))
+        self._t = now
+        return now
+
+    @property
+    def total(self):
+        return sum(dt for _, dt in self.phases)
+
+    def report(self):
+        parts = " | ".join(f"{name} {dt * 1e3:.1f} ms" for name, dt in self.phases)
+        return f"[STARTUP] {parts} | total {self.total * 1e3:.1f} ms"
+
+
+async def wait_until(predicate, timeout, poll=POLL_S):
+    """
+    Poll predicate() until it is true (returns True) or `timeout` seconds
+    pass (returns False).
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while not predicate():
+        if loop.time() >= deadline:
+            return False
+        await asyncio.sleep(poll)
+    return True
+
+
+def odrive_has_feedback(odrive):
+    """
+    True once the ODrive's cyclic messages have been received: encoder
+    estimates present and, where the driver reports it, no axis error.
+    """
+    if getattr(odrive, "position", None) is None or getattr(odrive, "velocity", None) is None:
+        return False
+    return not getattr(odrive, "axis_error", 0)
+
+
+async def odrive_ready(odrive, timeout=ODRIVE_TIMEOUT_S):
+    """
+    Wait for ODrive feedback after clear_errors/initCanBus. odrive.loop()
+    must already be running. Returns False (after a warning) on timeout,
+    leaving it to the script to carry on as it did with a fixed sleep.
+    """
+    ok = await wait_until(lambda: odrive_has_feedback(odrive), timeout)
+    if not ok:
+        print(f"[STARTUP] no ODrive feedback after {timeout:.1f} s, continuing")
+    return ok
+
+
+async def first_sample(read, timeout=ENCODER_TIMEOUT_S, poll=POLL_S):
+    """
+    First reading from read() that is not None (None = invalid sample).
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while True:
+        value = read()
+        if value is not None:
+            return value
+        if loop.time() >= deadline:
+            raise StartupError(f"no valid encoder sample within {timeout:.1f} s")
+        await asyncio.sleep(poll)
+
+
+async def stable_rest(read, window_s=REST_WINDOW_S, tol_turns=REST_TOL_TURNS,
+                      timeout=REST_TIMEOUT_S, poll=POLL_S):
+    """
+    Rest reading in turns [0, 1): returns once the readings have stayed
+    within tol_turns of a reference for window_s (unwrapped, so a rest
+    position at the 0/1 seam is fine). Returns the latest reading.
+    """
+    from encoder import Unwrapper
+
+    loop = asyncio.get_running_loop()
+    raw = await first_sample(read, poll=poll)
+    unwrap = Unwrapper(initial=raw)
+    ref = unwrap.update(raw)
+    still_since = loop.time()
+    deadline = still_since + timeout
+    while True:
+        await asyncio.sleep(poll)
+        sample = read()
+        now = loop.time()
+        if sample is not None:
+            raw = sample
+            value = unwrap.update(raw)
+            if abs(value - ref) > tol_turns:
+                ref, still_since = value, now       # moved: start over
+        if now - still_since >= window_s:
+            return raw
+        if now >= deadline:
+            print(f"[STARTUP] not still within {timeout:.1f} s, using the latest reading")
+            return raw
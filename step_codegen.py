@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+# Generated, Specialized Controller Step
+# - The model is built in SymPy from the same equation as
+#   InvPendulumDerivations.m (with sin(theta) instead of theta):
+#       Tau - b*theta_dot + g*m*l*sin(theta) = I_s*theta_ddot
+#   where Tau is the torque on the body, i.e. minus the motor torque
+# - A controller is a symbolic law for the motor torque in
+#   (theta, theta_dot, wheel_rate); "feedback_lin" is solved from the model
+#   rather than transcribed by hand
+# - build_step() substitutes the parameters and gains, resolves the
+#   velocity units, torque units and limit, and emits one flat pure-Python
+#   function: no string comparisons, one clamp, every constant inlined
+#
+# Usage in a controller:
+#     step = build_step("pd_wheel", gains, torque_units=TORQUE_UNITS, ...)
+#     wheel_rate, tau_nm, drive_cmd, saturated = step(theta, theta_dot, odrive.velocity)
+#
+# Usage: python step_codegen.py [controller]   (print the source, benchmark vs AIMain's path)
+
+import math
+
+import sympy as sp
+from sympy.printing.pycode import PythonCodePrinter
+
+from pendulum_sim import PendulumParams
+
+# =========================
+# ====== USER CONFIG ======
+# =========================
+
+# feedback_lin: closed-loop theta dynamics theta_ddot = -WN^2 theta - 2 ZETA WN theta_dot
+FEEDBACK_LIN_WN = 20.0      # rad/s
+FEEDBACK_LIN_ZETA = 0.8
+FEEDBACK_LIN_KW = 0.0       # Nm/(rad/s), wheel-rate damping added on top
+
+# =========================
+# ===== SYMBOLIC MODEL ====
+# =========================
+
+theta, theta_dot, theta_ddot, wheel_rate = sp.symbols("theta theta_dot theta_ddot wheel_rate", real=True)
+Tau, b, I_s, g, m, l = sp.symbols("Tau b I_s g m l", real=True)
+
+
+def model_equation():
+    """
+    InvPendulumDerivations.m's eqn1 with the gravity term kept nonlinear.
+    """
+    return sp.Eq(Tau - b * theta_dot + g * m * l * sp.sin(theta), I_s * theta_ddot)
+
+
+def model_values(params=PendulumParams()):
+    return {b: params.b, I_s: params.I_s, g: params.g, m: params.mass, l: params.length}
+
+
+def _linear_law(Kp, Kd, Kw):
+    return -(Kp * theta + Kd * theta_dot + Kw * wheel_rate)
+
+
+def _pd_wheel(gains, params):
+    from gains import load_gains
+
+    g_ = load_gains("pd_wheel", **{"Kp": -120.0, "Kd": -20.0, "Kw": 10.0, **gains})
+    return _linear_law(g_["Kp"], g_["Kd"], g_["Kw"])
+
+
+def _lqr(gains, params):
+    from lqr import pendulum_gains
+
+    Kp, Kd, Kw = pendulum_gains(params, dt=gains.get("dt"))
+    return _linear_law(gains.get("Kp", Kp), gains.get("Kd", Kd), gains.get("Kw", Kw))
+
+
+def _feedback_lin(gains, params):
+    wn = gains.get("wn", FEEDBACK_LIN_WN)
+    zeta = gains.get("zeta", FEEDBACK_LIN_ZETA)
+    Kw = gains.get("Kw", FEEDBACK_LIN_KW)
+    target = -wn ** 2 * theta - 2.0 * zeta * wn * theta_dot
+    body_torque = sp.solve(model_equation().subs(theta_ddot, target), Tau)[0]
+    return (-body_torque - Kw * wheel_rate).subs(model_values(params))
+
+
+# name -> (gains dict, params) -> motor torque in Nm as a SymPy expression
+CONTROLLERS = {
+    "pd_wheel": _pd_wheel,
+    "lqr": _lqr,
+    "feedback_lin": _feedback_lin,
+}
+
+# =========================
+# ===== CODE GENERATION ===
+# =========================
+
+class _Printer(PythonCodePrinter):
+    """
+    Python printer that writes floats with full precision (repr) and calls
+    math functions by bare name, bound in the step's globals.
+    """
+
+    def __init__(self):
+        super().__init__({"fully_qualified_modules": False})
+
+    def _print_Float(self, expr):
+        return repr(float(expr))
+
+    def _print_Rational(self, expr):
+        return repr(float(expr))
+
+
+def _numeric(expr):
+    return expr.xreplace({n: sp.Float(float(n), 20) for n in expr.atoms(sp.Number)})
+
+
+def generate_source(controller="pd_wheel", gains=None, params=PendulumParams(),
+                    velocity_units="rad_s", torque_units="Nm", kt=0.060,
+                    torque_limit_nm=10.0, name="step"):
+    """
+    Source of step(theta, theta_dot, wheel_raw) ->
+    (wheel_rate, tau_nm, drive_cmd, saturated) for the given configuration.
+    """
+    if velocity_units not in ("rad_s", "turns_s"):
+        raise ValueError("VELOCITY_UNITS must be 'rad_s' or 'turns_s'")
+    if torque_units not in ("Nm", "A"):
+        raise ValueError("TORQUE_UNITS must be 'Nm' or 'A'")
+    law = _numeric(CONTROLLERS[controller](dict(gains or {}), params))
+    printer = _Printer()
+    temps, (tau_expr,) = sp.cse([law], symbols=sp.numbered_symbols("_x"))
+    limit = repr(float(torque_limit_nm))
+
+    lines = [f"def {name}(theta, theta_dot, wheel_raw):",
+             f'    """{controller}: {velocity_units} in, {torque_units} out, |tau| <= {limit} Nm"""']
+    if velocity_units == "turns_s":
+        lines.append(f"    wheel_rate = wheel_raw * {2.0 * math.pi!r}")
+    else:
+        lines.append("    wheel_rate = wheel_raw")
+    for sym, expr in temps:
+        lines.append(f"    {sym} = {printer.doprint(expr)}")
+    lines += [
+        f"    tau = {printer.doprint(tau_expr)}",
+        f"    if tau > {limit}:",
+        f"        return wheel_rate, {limit}, {_drive(limit, torque_units, kt)}, True",
+        f"    if tau < -{limit}:",
+        f"        return wheel_rate, -{limit}, {_drive('-' + limit, torque_units, kt)}, True",
+        f"    return wheel_rate, tau, {_drive('tau', torque_units, kt)}, False",
+    ]
+    return "\n".join(lines) + "\n"
+
+
+def _drive(value, torque_units, kt):
+    if torque_units == "Nm":
+        return value
+    if value == "tau":
+        return f"tau / {float(kt)!r}"
+    return repr(float(value) / kt)
+
+
+def build_step(controller="pd_wheel", gains=None, params=PendulumParams(), **config):
+    """
+    Compile the generated step. The function carries its source as
+    `step.source`.
+    """
+    source = generate_source(controller, gains, params, **config)
+    namespace = {"sin": math.sin, "cos": math.cos, "sqrt": math.sqrt}
+    exec(compile(source, f"<step_codegen:{controller}>", "exec"), namespace)
+    step = namespace[config.get("name", "step")]
+    step.source = source
+    return step
+
+
+if __name__ == "__main__":
+    import random
+    import sys
+    import timeit
+    from pathlib import Path
+
+    from sim_hardware import SimRig
+
+    controller = sys.argv[1] if len(sys.argv) > 1 else "pd_wheel"
+
+    # AIMain's own helpers and configuration, loaded with the sim stand-ins
+    ai = SimRig().load_script(Path(__file__).resolve().parent / "AIMain.py")
+    config = dict(velocity_units=ai.VELOCITY_UNITS, torque_units=ai.TORQUE_UNITS,
+                  kt=ai.KT_NM_PER_A, torque_limit_nm=ai.TORQUE_LIMIT_NM)
+    from gains import load_gains
+    gd = load_gains("pd_wheel", Kp=-120, Kd=-20, Kw=10)
+    Kp, Kd, Kw = gd["Kp"], gd["Kd"], gd["Kw"]
+
+    def interpreted(theta, theta_dot, wheel_raw):
+        # AIMain's per-tick path (fixed gains)
+        wheel_rate = ai.from_velocity_units(wheel_raw)
+        tau_cmd_nm = -(Kp * theta + Kd * theta_dot + Kw * wheel_rate)
+        saturated = abs(tau_cmd_nm) > ai.TORQUE_LIMIT_NM
+        tau_cmd_nm = ai.clamp(tau_cmd_nm, -ai.TORQUE_LIMIT_NM, ai.TORQUE_LIMIT_NM)
+        drive_cmd = ai.to_drive_units(tau_cmd_nm)
+        limit_drive = ai.to_drive_units(ai.TORQUE_LIMIT_NM)
+        drive_cmd = ai.clamp(drive_cmd, -limit_drive, limit_drive)
+        return wheel_rate, tau_cmd_nm, drive_cmd, saturated
+
+    step = build_step(controller, **config)
+    print(step.source)
+
+    rng = random.Random(0)
+    inputs = [(rng.uniform(-0.3, 0.3), rng.uniform(-5, 5), rng.uniform(-50, 50)) for _ in range(10000)]
+    if controller == "pd_wheel":
+        worst = max(abs(a - b_) for x in inputs for a, b_ in zip(step(*x)[:3], interpreted(*x)[:3]))
+        same_flags = all(step(*x)[3] == interpreted(*x)[3] for x in inputs)
+        print(f"matches AIMain's path: max |diff| {worst:.1e}, saturation flags equal: {same_flags}")
+
+    for label, fn in (("interpreted", interpreted), ("generated", step)):
+        t = min(timeit.repeat(lambda: [fn(*x) for x in inputs], number=10, repeat=5)) / (10 * len(inputs))
+        print(f"{label:12s} {t * 1e9:6.0f} ns/tick")
@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+# Binary Telemetry Writer
+# - Control loop appends fixed-layout records with one struct.pack_into into a
+#   preallocated block (no string formatting, no I/O on the loop)
+# - Full blocks go to a background thread that writes them in one call
+# - Optional rate-limited human-readable console line
+#
+# File layout: 16-byte header (MAGIC + record size) then packed records:
+#   t f64 | theta, theta_dot, wheel_rate, tau_nm, drive_cmd, dt f32 | flags u32
+#
+# Usage: python telemetry.py telemetry.bin   (prints a summary of a log)
+
+import atexit
+import queue
+import struct
+import threading
+
+# =========================
+# ====== USER CONFIG ======
+# =========================
+
+RECORDS_PER_BLOCK = 8192      # ≈8 s at 1 kHz per disk write
+N_BLOCKS = 4                  # blocks in flight before records are dropped
+
+MAGIC = b"PENDTEL1"
+RECORD = struct.Struct("<d6fI")
+HEADER = struct.Struct("<8sQ")
+
+# flags bits
+FLAG_SATURATED = 1 << 0
+FLAG_ESTOP = 1 << 1
+FLAG_INVALID = 1 << 2      # encoder sample flagged invalid, estimator held
+FLAG_STALE = 1 << 3        # wheel-rate feedback older than the driver's staleness limit
+
+# NumPy view of one record, for reading logs back
+RECORD_DTYPE = [
+    ("t", "<f8"),
+    ("theta", "<f4"),
+    ("theta_dot", "<f4"),
+    ("wheel_rate", "<f4"),
+    ("tau_nm", "<f4"),
+    ("drive_cmd", "<f4"),
+    ("dt", "<f4"),
+    ("flags", "<u4"),
+]
+
+# =========================
+# ===== IMPLEMENTATION ====
+# =========================
+
+class Telemetry:
+    """
+    Fixed-record telemetry log. log() is the only call made per tick.
+
+    Closed automatically at interpreter exit; call close() to flush earlier.
+    """
+
+    def __init__(self, path, console_hz=0.0, units="Nm",
+                 records_per_block=RECORDS_PER_BLOCK, n_blocks=N_BLOCKS):
+        self.path = path
+        self.units = units
+        self.block_bytes = RECORD.size * records_per_block
+        self.console_period = 1.0 / console_hz if console_hz > 0 else None
+        self._next_console = 0.0
+
+        self._free = queue.Queue()
+        for _ in range(n_blocks):
+            self._free.put(bytearray(self.block_bytes))
+        self._full = queue.Queue()
+        self._block = self._free.get()
+        self._offset = 0
+
+        self.records = 0
+        self.dropped = 0
+        self.closed = False
+
+        self._file = open(path, "wb")
+        self._file.write(HEADER.pack(MAGIC, RECORD.size))
+        self._writer = threading.Thread(target=self._write_loop, name="telemetry-writer", daemon=True)
+        self._writer.start()
+        atexit.register(self.close)
+
+    def _write_loop(self):
+        f = self._file
+        while True:
+            item = self._full.get()
+            if item is None:
+                break
+            block, length = item
+            f.write(memoryview(block)[:length])
+            self._free.put(block)
+        f.flush()
+
+    def _swap(self):
+        self._full.put((self._block, self._offset))
+        try:
+            self._block = self._free.get_nowait()
+        except queue.Empty:
+            self._block = None     # writer is behind: drop until a block frees up
+        self._offset = 0
+
+    def log(self, t, theta, theta_dot, wheel_rate, tau_nm, drive_cmd, dt, flags=0):
+        block = self._block
+        if block is None:
+            try:
+                block = self._block = self._free.get_nowait()
+            except queue.Empty:
+                self.dropped += 1
+                return
+        RECORD.pack_into(block, self._offset, t, theta, theta_dot, wheel_rate,
+                         tau_nm, drive_cmd, dt, flags)
+        self._offset += RECORD.size
+        self.records += 1
+        if self._offset >= self.block_bytes:
+            self._swap()
+
+        if self.console_period is not None and t >= self._next_console:
+            self._next_console = t + self.console_period
+            sat = " [SAT]" if flags & FLAG_SATURATED else ""
+            print(
+                f"θ={theta:+.3f} rad | θ̇={theta_dot:+.3f} rad/s | ϕ̇={wheel_rate:+.2f} rad/s | "
+                f"τ={tau_nm:+.3f} Nm ({drive_cmd:+.3f} {self.units}) | dt={dt*1e3:.2f} ms{sat}"
+            )
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        if self._block is not None and self._offset:
+            self._full.put((self._block, self._offset))
+        self._full.put(None)
+        self._writer.join()
+        self._file.close()
+
+
+def read_telemetry(path):
+    """
+    Load a telemetry file as a NumPy structured array (fields: RECORD_DTYPE).
+    """
+    import numpy as np
+
+    with open(path, "rb") as f:
+        magic, rec_size = HEADER.unpack(f.read(HEADER.size))
+        if magic != MAGIC or rec_size != RECORD.size:
+            raise ValueError(f"{path} is not a telemetry log of this version")
+        return np.fromfile(f, dtype=np.dtype(RECORD_DTYPE))
+
+
+if __name__ == "__main__":
+    import sys
+
+    import numpy as np
+
+    log = read_telemetry(sys.argv[1])
+    if len(log) == 0:
+        print("empty log")
+        sys.exit(0)
+    dt = log["dt"].astype(float)
+    print(f"{len(log)} records over {log['t'][-1] - log['t'][0]:.2f} s")
+    print(f"dt: mean {dt.mean()*1e3:.3f} ms | p99 {np.percentile(dt, 99)*1e3:.3f} ms | "
+          f"max {dt.max()*1e3:.3f} ms")
+    print(f"max |θ| = {np.abs(log['theta']).max():.3f} rad | "
+          f"max |τ| = {np.abs(log['tau_nm']).max():.3f} Nm | "
+          f"saturated {np.count_nonzero(log['flags'] & FLAG_SATURATED)} ticks | "
+          f"invalid encoder {np.count_nonzero(log['flags'] & FLAG_INVALID)} ticks | "
+          f"stale wheel rate {np.count_nonzero(log['flags'] & FLAG_STALE)} ticks")
@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+# Offline Gain Tuner (simulated plant, no rig required)
+# - Nelder-Mead with restarts over a controller's gain vector
+# - Each candidate is scored on the same batch of simulated episodes
+#   (common random initial conditions), split across a process pool
+# - Cost = settling time + torque effort + saturation at TORQUE_LIMIT_NM +
+#   final wheel speed, with a large penalty for every episode that falls
+#   (larger the earlier it falls, so all-falling candidates still rank)
+# - Best gains go to gains.json, which the controllers read via gains.py
+#
+# Usage: python tune_gains.py pd_wheel --episodes 256 --restarts 3
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import pendulum_sim as sim
+from gains import GAINS_PATH, save_gains
+
+# =========================
+# ====== USER CONFIG ======
+# =========================
+
+EPISODE_S = 3.0            # simulated seconds per episode
+SIM_DT = 0.001             # matches CONTROL_DT
+THETA0_SPAN = 0.2          # rad, initial angle drawn from ±span
+THETA_DOT0_SPAN = 0.5      # rad/s
+SETTLE_TOL = 0.02          # rad, |theta| band counted as settled
+
+# Cost weights
+W_SETTLE = 1.0             # per second of settling time
+W_EFFORT = 0.01            # per mean tau^2 (Nm^2)
+W_SAT = 2.0                # per fraction of ticks at the torque limit
+W_WHEEL = 0.001            # per rad/s of final wheel speed (wheel runaway)
+W_FALL = 100.0             # per fallen episode, scaled up the earlier it fell
+
+# Tunable controllers: gain names, script defaults, initial simplex step,
+# and the vectorized law from pendulum_sim
+CONTROLLERS = {
+    "pd_wheel": (("Kp", "Kd", "Kw"), (-120.0, -20.0, 10.0), (40.0, 5.0, 5.0),
+                 lambda g, dt: sim.pd_wheel_controller(*g, dt=dt)),
+    "pid": (("K1", "K2", "K3"), (6.0, 3.0, 4.0), (5.0, 2.0, 2.0),
+            lambda g, dt: sim.pid_wheel_controller(*g, 0.0, 0.0, 0.0, dt=dt)),
+    "pid_wheel": (("K1", "K2", "K3", "K1v", "K2v", "K3v"), (6.0, 3.0, 4.0, 6.0, 3.0, 4.0),
+                  (5.0, 2.0, 2.0, 5.0, 2.0, 2.0),
+                  lambda g, dt: sim.pid_wheel_controller(*g, dt=dt)),
+    "sliding": (("C",), (3.0,), (1.0,),
+                lambda g, dt: sim.sliding_mode_controller(*g)),
+}
+
+# =========================
+# ====== EVALUATION =======
+# =========================
+
+def episode_costs(controller, gains, x0, params=sim.PendulumParams(),
+                  duration=EPISODE_S, dt=SIM_DT):
+    """
+    Cost of each episode (row of x0) under one gain vector.
+    """
+    law = CONTROLLERS[controller][3](tuple(gains), dt)
+    res = sim.simulate(law, x0, dt=dt, duration=duration, params=params, record_every=1)
+
+    theta = np.abs(res.x[:, :, sim.THETA])                 # (K, N)
+    outside = theta > SETTLE_TOL
+    # last sample outside the band (+1 sample) is the settling time
+    last_out = np.where(outside.any(axis=0),
+                        outside.shape[0] - np.argmax(outside[::-1], axis=0), 0)
+    settle = res.t[np.minimum(last_out, len(res.t) - 1)]
+    effort = np.mean(res.tau[1:] ** 2, axis=0)
+    sat = np.mean(np.abs(res.tau[1:]) >= params.torque_limit * (1.0 - 1e-9), axis=0)
+    wheel = np.abs(res.x[-1, :, sim.WHEEL_VEL])
+    fell = np.isfinite(res.fall_time)
+    settle = np.where(fell, duration, settle)
+    fall = np.where(fell, 2.0 - np.minimum(res.fall_time, duration) / duration, 0.0)
+
+    cost = (W_SETTLE * settle + W_EFFORT * effort + W_SAT * sat
+            + W_WHEEL * np.where(fell, 0.0, wheel) + W_FALL * fall)
+    return np.where(np.isfinite(cost), cost, 2.0 * W_FALL + W_SETTLE * duration)
+
+
+def _chunk_cost(args):
+    controller, gains, x0, params = args
+    return episode_costs(controller, gains, x0, params).sum()
+
+
+class BatchEvaluator:
+    """
+    Mean episode cost of candidate gain vectors, with the episode batch
+    split into one chunk per worker process.
+    """
+
+    def __init__(self, controller, x0, params=sim.PendulumParams(), workers=None):
+        self.controller = controller
+        self.params = params
+        self.n_episodes = len(x0)
+        self.workers = workers or os.cpu_count() or 1
+        self.chunks = np.array_split(x0, self.workers)
+        self.pool = ProcessPoolExecutor(self.workers) if self.workers > 1 else None
+        self.evaluations = 0
+
+    def __call__(self, candidates):
+        candidates = [tuple(float(v) for v in c) for c in candidates]
+        jobs = [(self.controller, c, chunk, self.params)
+                for c in candidates for chunk in self.chunks]
+        mapper = self.pool.map if self.pool is not None else map
+        sums = np.fromiter(mapper(_chunk_cost, jobs), dtype=float, count=len(jobs))
+        self.evaluations += len(candidates)
+        return sums.reshape(len(candidates), len(self.chunks)).sum(axis=1) / self.n_episodes
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown()
+
+
+# =========================
+# ====== OPTIMIZER ========
+# =========================
+
+def nelder_mead(f_batch, x0, step, max_evals=200, tol=1e-4):
+    """
+    Nelder-Mead minimizer. f_batch takes a list of points and returns their
+    costs, so the initial simplex and shrink steps are evaluated in parallel.
+    Returns (best_x, best_cost).
+    """
+    n = len(x0)
+    simplex = [np.asarray(x0, dtype=float)]
+    for i in range(n):
+        p = simplex[0].copy()
+        p[i] += step[i]
+        simplex.append(p)
+    fvals = list(f_batch(simplex))
+    evals = n + 1
+
+    while evals < max_evals:
+        order = np.argsort(fvals)
+        simplex = [simplex[i] for i in order]
+        fvals = [fvals[i] for i in order]
+        if abs(fvals[-1] - fvals[0]) <= tol * (abs(fvals[0]) + tol):
+            break
+
+        centroid = np.mean(simplex[:-1], axis=0)
+        worst = simplex[-1]
+        xr = centroid + (centroid - worst)
+        fr = f_batch([xr])[0]
+        evals += 1
+        if fr < fvals[0]:
+            xe = centroid + 2.0 * (centroid - worst)
+            fe = f_batch([xe])[0]
+            evals += 1
+            simplex[-1], fvals[-1] = (xe, fe) if fe < fr else (xr, fr)
+        elif fr < fvals[-2]:
+            simplex[-1], fvals[-1] = xr, fr
+        else:
+            xc = centroid + 0.5 * (worst - centroid)
+            fc = f_batch([xc])[0]
+            evals += 1
+            if fc < fvals[-1]:
+                simplex[-1], fvals[-1] = xc, fc
+            else:
+                best = simplex[0]
+                simplex = [best] + [best + 0.5 * (p - best) for p in simplex[1:]]
+                fvals = [fvals[0]] + list(f_batch(simplex[1:]))
+                evals += n
+
+    i = int(np.argmin(fvals))
+    return simplex[i], fvals[i]
+
+
+def tune(controller, episodes=256, restarts=3, max_evals=200, seed=0,
+         params=sim.PendulumParams(), workers=None, verbose=True):
+    """
+    Nelder-Mead with restarts from the script's gains. Each restart begins at
+    the best point so far with a fresh simplex of shrinking size.
+    Returns (gains dict, cost).
+    """
+    names, defaults, step, _ = CONTROLLERS[controller]
+    x0 = sim.initial_states(episodes, THETA0_SPAN, THETA_DOT0_SPAN, seed=seed)
+    evaluate = BatchEvaluator(controller, x0, params, workers)
+    try:
+        best_x = np.array(defaults, dtype=float)
+        best_f = evaluate([best_x])[0]
+        if verbose:
+            print(f"[TUNE] {controller} script gains {dict(zip(names, defaults))}: cost {best_f:.4f}")
+        scale = np.array(step, dtype=float)
+        for r in range(restarts):
+            x, f = nelder_mead(evaluate, best_x, scale, max_evals=max_evals)
+            if f < best_f:
+                best_x, best_f = x, f
+            if verbose:
+                print(f"[TUNE] restart {r + 1}/{restarts}: cost {f:.4f} | best {best_f:.4f} | "
+                      f"{evaluate.evaluations} candidates x {episodes} episodes")
+            scale = scale * 0.5
+    finally:
+        evaluate.close()
+    return dict(zip(names, (float(v) for v in best_x))), float(best_f)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Tune controller gains on the simulated plant.")
+    parser.add_argument("controller", choices=sorted(CONTROLLERS))
+    parser.add_argument("--episodes", type=int, default=256)
+    parser.add_argument("--restarts", type=int, default=3)
+    parser.add_argument("--max-evals", type=int, default=200)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--dry-run", action="store_true", help=f"don't write {os.path.basename(GAINS_PATH)}")
+    args = parser.parse_args()
+
+    gains, cost = tune(args.controller, args.episodes, args.restarts, args.max_evals,
+                       args.seed, workers=args.workers)
+    print(f"[TUNE] best {args.controller}: " +
+          ", ".join(f"{k}={v:.4g}" for k, v in gains.items()) + f" | cost {cost:.4f}")
+    if not args.dry_run:
+        save_gains(args.controller, gains)
+        print(f"[TUNE] saved to {GAINS_PATH}")
@@ -0,0 +1,311 @@
+#!/usr/bin/env python3
+# Control-Loop Watchdog
+# - The loop calls beat(theta) once per tick. A monitor outside the loop
+#   e-stops the drive when no beat has arrived for `timeout` (a stalled I2C
+#   read, a blocked event loop, a crashed controller); beat() itself
+#   e-stops as soon as |theta| passes `angle_limit`
+# - mode="thread": the monitor is a thread calling the drive's own estop.
+#   It cannot run while the loop holds the GIL (e.g. inside a C extension
+#   call that does not release it)
+# - mode="process": the monitor is a separate process with its own CAN
+#   socket (estop_factory, e.g. odrive_can.estop_sender), unaffected by the
+#   GIL and still there if the controller process dies
+# - Every firing is recorded (last beat, detection, estop returned), so the
+#   beat -> estop latency is measured against `deadline`, not assumed
+#
+# Usage in a controller:
+#     wd = Watchdog(odrive.estop, timeout=0.005, deadline=0.010, angle_limit=0.55).start()
+#     wd.arm()
+#     while ...:
+#         wd.beat(theta)
+#         ...
+#     wd.stop()
+#
+# Usage: python watchdog.py [--trials N]   (stall injection, latency distribution)
+
+import multiprocessing
+import threading
+import time
+from array import array
+
+# =========================
+# ====== USER CONFIG ======
+# =========================
+
+TIMEOUT_S = 0.005            # no beat for this long = stalled (5 ticks at 1 kHz)
+DEADLINE_S = 0.010           # last beat -> estop sent, must hold for every firing
+ANGLE_LIMIT = 0.55           # rad (~31°)
+IDLE_POLL_S = 0.002          # monitor wake-up period while disarmed or fired
+RECORD_CAPACITY = 1024       # firings kept (ring)
+
+# =========================
+# ===== IMPLEMENTATION ====
+# =========================
+
+# Shared state slots (a RawArray of doubles, so a process can watch it too)
+_T_BEAT, _ARMED, _FIRED, _STOP, _COUNT = range(5)
+REASON_STALL = 1
+REASON_ANGLE = 2
+REASONS = {REASON_STALL: "stall", REASON_ANGLE: "angle"}
+
+
+def _fire(state, records, estop, clock, t_beat, reason):
+    """
+    E-stop once and record (last beat, detected, estop returned, reason).
+    """
+    t_detect = clock()
+    state[_FIRED] = 1.0
+    try:
+        estop()
+    finally:
+        t_done = clock()
+        n = int(state[_COUNT])
+        i = 4 * (n % (len(records) // 4))
+        records[i:i + 4] = array("d", (t_beat, t_detect, t_done, reason))
+        state[_COUNT] = n + 1
+
+
+def _monitor(state, records, timeout, estop, estop_factory, clock):
+    """
+    Monitor loop (thread or process): sleeps until the current beat would
+    time out, fires if no newer beat arrived meanwhile.
+    """
+    if estop is None:
+        estop = estop_factory()
+    sleep = time.sleep
+    while not state[_STOP]:
+        if not state[_ARMED] or state[_FIRED]:
+            sleep(IDLE_POLL_S)
+            continue
+        t_beat = state[_T_BEAT]
+        wait = t_beat + timeout - clock()
+        if wait > 0.0:
+            sleep(wait)
+            continue
+        if state[_T_BEAT] == t_beat and state[_ARMED] and not state[_FIRED]:
+            _fire(state, records, estop, clock, t_beat, REASON_STALL)
+
+
+def _percentile(sorted_values, p):
+    n = len(sorted_values)
+    return sorted_values[min(n - 1, int(p / 100.0 * n))] if n else 0.0
+
+
+class Watchdog:
+    """
+    Heartbeat and angle-limit watchdog for one control loop.
+
+    estop is called on the loop's side for angle trips and, in thread mode,
+    by the monitor for stalls. In process mode the monitor calls
+    estop_factory() once at start-up, in the child, to get its own estop
+    (it must be picklable, e.g. functools.partial(odrive_can.estop_sender,
+    node_id)); the process compares against time.monotonic, so `clock`
+    must be that clock too.
+
+    The watchdog starts disarmed: arm() just before the first tick (and
+    again to re-arm after a firing), disarm() before a planned pause.
+    """
+
+    def __init__(self, estop, timeout=TIMEOUT_S, deadline=DEADLINE_S, angle_limit=ANGLE_LIMIT,
+                 mode="thread", estop_factory=None, clock=time.monotonic,
+                 capacity=RECORD_CAPACITY):
+        if not 0.0 < timeout < deadline:
+            raise ValueError("watchdog timeout must be positive and shorter than its deadline")
+        if mode not in ("thread", "process"):
+            raise ValueError("watchdog mode must be 'thread' or 'process'")
+        if mode == "process" and estop_factory is None:
+            raise ValueError("process mode needs an estop_factory to run in the child")
+        self.estop = estop
+        self.timeout = timeout
+        self.deadline = deadline
+        self.angle_limit = angle_limit
+        self.mode = mode
+        self.estop_factory = estop_factory
+        self.clock = time.monotonic if mode == "process" else clock
+        self._state = multiprocessing.RawArray("d", 5)
+        self._records = multiprocessing.RawArray("d", 4 * capacity)
+        self._worker = None
+
+    def start(self):
+        if self._worker is None:
+            if self.mode == "thread":
+                args = (self._state, self._records, self.timeout, self.estop, None, self.clock)
+                self._worker = threading.Thread(target=_monitor, args=args,
+                                                name="watchdog", daemon=True)
+            else:
+                args = (self._state, self._records, self.timeout, None, self.estop_factory,
+                        time.monotonic)
+                self._worker = multiprocessing.Process(target=_monitor, args=args,
+                                                       name="watchdog", daemon=True)
+            self._worker.start()
+        return self
+
+    def stop(self):
+        self._state[_ARMED] = 0.0
+        self._state[_STOP] = 1.0
+        if self._worker is not None:
+            self._worker.join(1.0)
+            self._worker = None
+
+    def arm(self):
+        state = self._state
+        state[_T_BEAT] = self.clock()
+        state[_FIRED] = 0.0
+        state[_ARMED] = 1.0
+
+    def disarm(self):
+        self._state[_ARMED] = 0.0
+
+    @property
+    def fired(self):
+        return bool(self._state[_FIRED])
+
+    def beat(self, theta=0.0):
+        """
+        Once per tick. Returns True if the watchdog has fired (either way).
+        """
+        state = self._state
+        now = state[_T_BEAT] = self.clock()
+        if state[_FIRED]:
+            return True
+        if abs(theta) > self.angle_limit and state[_ARMED]:
+            _fire(state, self._records, self.estop, self.clock, now, REASON_ANGLE)
+            return True
+        return False
+
+    # ---------- statistics ----------
+
+    def firings(self):
+        """
+        [(reason, last beat, detected, estop returned)], oldest first.
+        """
+        n = int(self._state[_COUNT])
+        cap = len(self._records) // 4
+        out = []
+        for k in range(max(0, n - cap), n):
+            i = 4 * (k % cap)
+            t_beat, t_detect, t_done, reason = self._records[i:i + 4]
+            out.append((REASONS.get(int(reason), "?"), t_beat, t_detect, t_done))
+        return out
+
+    def stats(self):
+        """
+        Latency distribution of the stall firings, in ms: detection lag past
+        the timeout, detection -> estop returned, and last beat -> estop
+        returned (the number the deadline bounds), plus the angle trips'
+        detection -> estop.
+        """
+        stalls = [f for f in self.firings() if f[0] == "stall"]
+        angles = [f for f in self.firings() if f[0] == "angle"]
+        series = {
+            "detect_ms": sorted((d - b - self.timeout) * 1e3 for _, b, d, _ in stalls),
+            "estop_ms": sorted((e - d) * 1e3 for _, _, d, e in stalls),
+            "total_ms": sorted((e - b) * 1e3 for _, b, _, e in stalls),
+            "angle_estop_ms": sorted((e - d) * 1e3 for _, _, d, e in angles),
+        }
+        out = {"stalls": len(stalls), "angle_trips": len(angles),
+               "deadline_misses": sum(1 for t in series["total_ms"] if t > self.deadline * 1e3)}
+        for name, values in series.items():
+            out[name] = {"p50": _percentile(values, 50), "p99": _percentile(values, 99),
+                         "max": values[-1] if values else 0.0}
+        return out
+
+    def report(self):
+        s = self.stats()
+        line = f"[WATCHDOG] {self.mode}: {s['stalls']} stall, {s['angle_trips']} angle firings"
+        if s["stalls"]:
+            d, e, t = s["detect_ms"], s["estop_ms"], s["total_ms"]
+            line += (f" | detection lag p50 {d['p50']:.2f} / p99 {d['p99']:.2f} / max {d['max']:.2f} ms"
+                     f" | estop p50 {e['p50']:.3f} / max {e['max']:.3f} ms"
+                     f" | beat -> estop max {t['max']:.2f} ms, {s['deadline_misses']} over "
+                     f"{self.deadline * 1e3:.1f} ms")
+        return line
+
+# =========================
+# ===== STALL INJECTION ===
+# =========================
+
+def _sleep_stall(seconds):
+    # A blocking syscall that releases the GIL (smbus2's ioctl, a socket read)
+    time.sleep(seconds)
+
+
+_GIL_OPS_PER_S = None
+
+
+def _gil_stall(seconds):
+    # One long C call that keeps the GIL (python-smbus does not release it)
+    global _GIL_OPS_PER_S
+    if _GIL_OPS_PER_S is None:
+        from itertools import repeat
+        t0 = time.perf_counter()
+        sum(repeat(1, 2000000))
+        _GIL_OPS_PER_S = 2000000 / (time.perf_counter() - t0)
+    from itertools import repeat
+    sum(repeat(1, int(seconds * _GIL_OPS_PER_S)))
+
+
+STALLS = {"sleep": _sleep_stall, "gil": _gil_stall}
+
+
+def _count_estop():
+    pass
+
+
+def _estop_factory():
+    return _count_estop
+
+
+def inject_stalls(wd, trials=100, kind="sleep", tick=0.001, stall=(2.0, 4.0), seed=0):
+    """
+    Beat at `tick` for a random 5-20 ticks, then stall for a random
+    stall[0]..stall[1] timeouts without beating, `trials` times, re-arming
+    after each firing. Returns the number of stalls the watchdog missed.
+    """
+    import random
+
+    rng = random.Random(seed)
+    stall_fn = STALLS[kind]
+    missed = 0
+    for _ in range(trials):
+        wd.arm()
+        for _ in range(rng.randint(5, 20)):
+            wd.beat(0.0)
+            time.sleep(tick)
+        wd.beat(0.0)
+        stall_fn(rng.uniform(*stall) * wd.timeout)
+        t_end = time.monotonic() + 10 * wd.deadline
+        while not wd.fired and time.monotonic() < t_end:
+            time.sleep(wd.timeout / 10)
+        missed += not wd.fired
+    wd.disarm()
+    return missed
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Inject control-loop stalls and measure the watchdog.")
+    parser.add_argument("--trials", type=int, default=100)
+    parser.add_argument("--timeout", type=float, default=TIMEOUT_S)
+    parser.add_argument("--deadline", type=float, default=DEADLINE_S)
+    args = parser.parse_args()
+
+    for mode in ("thread", "process"):
+        for kind in STALLS:
+            wd = Watchdog(_count_estop, args.timeout, args.deadline, mode=mode,
+                          estop_factory=_estop_factory).start()
+            missed = inject_stalls(wd, args.trials, kind)
+            wd.stop()
+            print(f"{kind:5s} stalls, {wd.report()}" + (f" | {missed} not detected" if missed else ""))
+
+    # Angle trip: detected on the loop's side at the tick that sees it
+    wd = Watchdog(_count_estop, args.timeout, args.deadline).start()
+    for _ in range(args.trials):
+        wd.arm()
+        wd.beat(0.1)
+        wd.beat(1.0)
+    wd.stop()
+    s = wd.stats()["angle_estop_ms"]
+    print(f"angle trips: {wd.stats()['angle_trips']} | detection -> estop p50 {s['p50'] * 1e3:.1f} / "
+          f"max {s['max'] * 1e3:.1f} us")